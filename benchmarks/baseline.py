@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""
+This script saves the results of a benchmark as a named
+baseline in benchmarks/baselines and compares later runs
+with it, for pipeline_benchmark.py and cli_benchmark.py.
+"""
+
+import os
+import sys
+import json
+import platform
+
+from datetime import datetime
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def add_arguments(parser, default):
+    """
+    Add --baseline, --save and --tolerance to an argument parser.
+
+    :param default: Name of the baseline
+    """
+    parser.add_argument(
+        "--baseline",
+        default=default,
+        help=f"Name of the baseline in {BASELINE_DIR}",
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Save the results as the baseline"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.3,
+        help="Allowed slowdown per result before it counts as a regression",
+    )
+
+
+def compare(results, expected, metric, higher_is_better, tolerance):
+    """
+    :param results: Dictionary of name -> dictionary with metric
+    :param expected: The same from the baseline
+    :param metric: Key of the value that is compared, e.g. "seconds"
+    :param higher_is_better: True for throughputs, False for times
+    :param tolerance: Allowed slowdown, e.g. 0.3 for 30%
+    :return: List of names that are slower than the baseline
+    """
+    width = max(map(len, results), default=0)
+    regressions = []
+    for name, result in results.items():
+        baseline = expected.get(name)
+        if not baseline or not baseline[metric]:
+            continue
+
+        ratio = result[metric] / baseline[metric]
+        if higher_is_better:
+            slower = ratio < 1 - tolerance
+        else:
+            slower = ratio > 1 + tolerance
+        status = "REGRESSION" if slower else "ok"
+        print(f"INFO: {name:<{width}} {ratio:>6.2f}x baseline {status}")
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+def check(args, key, results, metric, higher_is_better):
+    """
+    Save the results as the baseline with --save, otherwise compare them
+    with the baseline and exit with an error on a regression.
+
+    :param args: Parsed arguments, see add_arguments
+    :param key: Key of the results in the baseline file, e.g. "stages"
+    :param results: Dictionary of name -> dictionary with metric
+    :param metric: Key of the value that is compared
+    :param higher_is_better: True for throughputs, False for times
+    """
+    baseline_path = os.path.join(BASELINE_DIR, f"{args.baseline}.json")
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(
+                {
+                    "created": datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    key: results,
+                },
+                f,
+                indent=4,
+            )
+        print(f"INFO: Saved baseline to {baseline_path}.")
+    elif os.path.isfile(baseline_path):
+        with open(baseline_path) as f:
+            expected = json.load(f)[key]
+        regressions = compare(
+            results, expected, metric, higher_is_better, args.tolerance
+        )
+        if regressions:
+            sys.stderr.write(f"ERROR: Slower than baseline: {', '.join(regressions)}.")
+            sys.exit(1)
+    else:
+        print(f"INFO: No baseline at {baseline_path}. Run with --save to create one.")
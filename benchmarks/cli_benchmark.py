@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+This script measures the cold start of every run_local.py
+stage in fresh interpreters, next to importing the Prefect
+flows, and compares the results with a saved baseline.
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+from baseline import add_arguments, check
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+STAGES = ["scrape", "fetch", "transform", "upload", "load"]
+FLOWS = ["fetch_and_transform_to_gcs", "gcs_to_bq"]
+
+
+def cold_start(command, repeat):
+    """
+    Run a command in a fresh interpreter repeat times.
+
+    :return: Median wall time in seconds
+    """
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=BIN_DIR, check=True, capture_output=True)
+        seconds.append(time.perf_counter() - started)
+    return statistics.median(seconds)
+
+
+def run(repeat=5):
+    """
+    :return: Dictionary of command -> median cold start in seconds
+    """
+    commands = {
+        stage: [sys.executable, "run_local.py", "--cold-start", stage]
+        for stage in STAGES
+    }
+    for module in FLOWS:
+        commands[f"flow:{module}"] = [sys.executable, "-c", f"import {module}"]
+
+    results = {}
+    for name, command in commands.items():
+        results[name] = {"seconds": round(cold_start(command, repeat), 3)}
+        print(f"INFO: {name:<34} {results[name]['seconds']:>6.2f}s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Runs of each command, the median counts"
+    )
+    add_arguments(parser, "cli")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+
+    check(args, "commands", results, "seconds", higher_is_better=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""
+This script compares the single-pass biosample parser
+with the previous regex approach on the raw data in
+data/raw_data and checks that both agree.
+"""
+
+import os
+import re
+import sys
+import glob
+import time
+import argparse
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")
+sys.path.insert(0, BIN_DIR)
+
+from record_reader import read_records
+from biosample_parser import parse_record, split_location
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+KEYS = ("collection date", "geographic location")
+
+
+def regex_parse(biosample):
+    """
+    Previous approach: three uncompiled searches over the whole record
+    and repeated splits of the location.
+
+    :return: (accession, collection date, country, region) or None
+    """
+    collection_date = re.search(r"collection date=\"(.+)\"", biosample)
+    geographic_location = re.search(r'geographic location=\"(.+)"', biosample)
+    accession = re.search(r"Accession:\s(.+)[\s\t]ID:.+", biosample)
+
+    if collection_date is None or geographic_location is None or accession is None:
+        return None
+
+    if ":" in geographic_location.group(1):
+        country = geographic_location.group(1).split(":")[0]
+        region = geographic_location.group(1).split(":")[1].split(",")[0].strip()
+    else:
+        country = geographic_location.group(1)
+        region = ""
+
+    return accession.group(1), collection_date.group(1), country, region
+
+
+def single_pass_parse(biosample, keys=KEYS):
+    """
+    Current approach with biosample_parser.
+
+    :return: (accession, collection date, country, region) or None
+    """
+    record = parse_record(biosample, keys)
+    collection_date = record.attributes.get("collection date")
+    geographic_location = record.attributes.get("geographic location")
+
+    if not collection_date or not geographic_location or record.accession is None:
+        return None
+
+    return (record.accession, collection_date, *split_location(geographic_location))
+
+
+def time_parser(parser, records, repeat):
+    """
+    :return: Best time in seconds of parsing all records
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for record in records:
+            parser(record)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--data",
+        default=os.path.join(BIN_DIR, "..", "data", "raw_data"),
+        help="Directory of raw .tsv/.tsv.gz files",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    records = []
+    for path in sorted(glob.glob(os.path.join(args.data, "*.tsv*"))):
+        records.extend(read_records(path))
+
+    if not records:
+        sys.stderr.write(f"ERROR: No records found in {args.data}.")
+        sys.exit(1)
+
+    # Both parsers must agree before timing means anything
+    mismatches = sum(regex_parse(r) != single_pass_parse(r) for r in records)
+    if mismatches:
+        sys.stderr.write(f"ERROR: Parsers disagree on {mismatches} records.")
+        sys.exit(1)
+
+    # Full parse of every attribute, for reference
+    mismatches = sum(regex_parse(r) != single_pass_parse(r, keys=None) for r in records)
+    if mismatches:
+        sys.stderr.write(f"ERROR: Full parse disagrees on {mismatches} records.")
+        sys.exit(1)
+
+    timings = {
+        "regex": time_parser(regex_parse, records, args.repeat),
+        "single-pass": time_parser(single_pass_parse, records, args.repeat),
+        "full-attributes": time_parser(
+            lambda r: single_pass_parse(r, keys=None), records, args.repeat
+        ),
+    }
+
+    print(f"INFO: {len(records)} records")
+    for name, seconds in timings.items():
+        print(
+            f"INFO: {name:<16} {len(records) / seconds:>10,.0f} records/s "
+            f"({timings['regex'] / seconds:.2f}x regex)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+"""
+This script times each stage of the pipeline on the raw
+data in data/raw_data with in-memory weather and local
+storage, and compares the results with a saved baseline.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import pandas as pd
+
+from baseline import add_arguments, check
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")
+sys.path.insert(0, BIN_DIR)
+
+from gazetteer import Gazetteer
+from station_cache import Station
+from record_reader import read_records
+from weather_backends import WeatherBackend
+from parquet_dataset import iter_frames, write_agent
+from warehouse_sinks import SQLiteSink
+from columnar_transform import map_geography, records_to_frame
+from agent_transform import parse_biosample, transform_biosample
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+COLUMNS = ["Biosample", "Agent", "Date", "Country", "region", "Precipitation"]
+
+
+class FakeBackend(WeatherBackend):
+    """
+    Constant monthly precipitation without network requests.
+    """
+
+    def precipitation(self, station, start, end, frequency="monthly"):
+        index = pd.date_range(start.replace(day=1), end, freq="MS", name="time")
+        return pd.DataFrame({"prcp": 1.0}, index=index)
+
+
+class FakeResolver:
+    """
+    One station per country without loading meteostat's inventory.
+    """
+
+    def candidates(self, country_abbrev, region_abbrev=""):
+        return (Station(f"{country_abbrev}{region_abbrev}", 0.0, 0.0),)
+
+
+def peak_rss_mb():
+    """
+    :return: Peak resident set size of this process so far in MB, the
+        high-water mark of every stage that ran, not of the last one
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_stage(name, func, count, results, repeat=1, setup=None):
+    """
+    Time func() and store records/s of the best of repeat runs and the
+    peak RSS of the process after the stage in results.
+
+    :param count: Number of records the stage processes, or a function
+        that counts them from the return value
+    :param setup: Optional function called before every run, not timed
+    :return: Return value of func
+    """
+    seconds = float("inf")
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        value = func()
+        seconds = min(seconds, time.perf_counter() - started)
+
+    if callable(count):
+        count = count(value)
+
+    results[name] = {
+        "records": count,
+        "seconds": round(seconds, 4),
+        "records_per_s": round(count / seconds, 1) if seconds else 0.0,
+        "process_peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(
+        f"INFO: {name:<12} {results[name]['records_per_s']:>12,.0f} records/s "
+        f"{seconds:>8.3f}s {results[name]['process_peak_rss_mb']:>8.1f} MB "
+        f"process peak RSS"
+    )
+    return value
+
+
+def run(data_dir, workdir, repeat=5):
+    """
+    Run every stage.
+
+    :param repeat: Number of runs of each stage, the fastest counts
+
+    :return: Dictionary of stage -> timings
+    """
+    with open(os.path.join(BIN_DIR, "countries.json")) as f:
+        countries = json.load(f)
+    with open(os.path.join(BIN_DIR, "regions.json")) as f:
+        regions = json.load(f)
+
+    # Every run resolves locations from an empty memo, not the last run's
+    gazetteer = Gazetteer.for_tables(countries, regions)
+
+    paths = sorted(glob.glob(os.path.join(data_dir, "*.tsv*")))
+    agents = [os.path.basename(path).split(".")[0] for path in paths]
+    results = {}
+
+    # Record splitting: raw files into biosample records
+    def split():
+        return {agent: list(read_records(path)) for agent, path in zip(agents, paths)}
+
+    records = run_stage(
+        "split", split, lambda value: sum(map(len, value.values())), results, repeat
+    )
+    total = results["split"]["records"]
+
+    # Parsing of every record with the transform_biosample rules
+    def parse():
+        return {
+            agent: [parse_biosample(r, regions, countries) for r in agent_records]
+            for agent, agent_records in records.items()
+        }
+
+    run_stage("parse", parse, total, results, repeat, gazetteer.clear)
+
+    # Vectorized geography mapping of the columnar path
+    frames = [records_to_frame(agent_records) for agent_records in records.values()]
+    run_stage(
+        "geography",
+        lambda: [
+            map_geography(df["raw_location"], countries, regions) for df in frames
+        ],
+        total,
+        results,
+        repeat,
+        gazetteer.clear,
+    )
+
+    # Weather lookup per biosample against an in-memory backend
+    resolver = FakeResolver()
+    backend = FakeBackend()
+
+    def weather():
+        clean = {}
+        for agent, agent_records in records.items():
+            rows = [
+                transform_biosample(agent, r, regions, countries, resolver, backend)
+                for r in agent_records
+            ]
+            clean[agent] = pd.DataFrame(
+                [row for row in rows if row is not None], columns=COLUMNS
+            )
+        return clean
+
+    clean = run_stage("weather", weather, total, results, repeat, gazetteer.clear)
+    rows = sum(len(df) for df in clean.values())
+
+    # Parquet write, as write_local
+    storage_dir = os.path.join(workdir, "storage")
+    os.makedirs(storage_dir)
+
+    def write():
+        for agent, df in clean.items():
+            write_agent(df, storage_dir, agent)
+
+    run_stage("write", write, rows, results, repeat)
+
+    # Streaming merge into a local warehouse, as gcs_to_bq
+    sink = SQLiteSink(os.path.join(workdir, "warehouse.sqlite"))
+
+    def merge():
+        sink.begin()
+        paths = glob.glob(os.path.join(storage_dir, "agent=*", "year=*", "*.parquet"))
+        for df in iter_frames(sorted(paths)):
+            df["Precipitation"] = df["Precipitation"].fillna(0)
+            sink.load(df)
+        sink.merge({agent: "benchmark" for agent in agents})
+
+    run_stage("merge", merge, rows, results, repeat)
+    sink.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--data",
+        default=os.path.join(BIN_DIR, "..", "data", "raw_data"),
+        help="Directory of raw .tsv/.tsv.gz files",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Runs of each stage, the fastest counts"
+    )
+    add_arguments(parser, "pipeline")
+    args = parser.parse_args()
+
+    if not glob.glob(os.path.join(args.data, "*.tsv*")):
+        sys.stderr.write(f"ERROR: No raw data found in {args.data}.")
+        sys.exit(1)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        results = run(args.data, workdir, args.repeat)
+    finally:
+        shutil.rmtree(workdir)
+
+    check(args, "stages", results, "records_per_s", higher_is_better=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+"""
+This script keeps a run-wide index of every biosample
+accession that was already transformed, so biosamples that
+several agents' queries return are only resolved once, and
+records which agents each biosample belongs to.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from biosample_parser import parse_record
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+# Seconds until dropped biosamples are resolved again, e.g. in case
+# meteostat backfilled precipitation of their station
+DROPPED_TTL = 7 * 24 * 3600
+
+# Seconds a write waits for another process's write to the database
+BUSY_TIMEOUT = 60.0
+
+
+def source_key(raw_date, raw_location):
+    """
+    :return: Fingerprint of the attributes a biosample is resolved from
+    """
+    text = f"{raw_date}\x1f{raw_location}".encode()
+    return hashlib.blake2b(text, digest_size=8).hexdigest()
+
+
+class AccessionIndex:
+    """
+    SQLite store of accession -> resolved date, country, region and
+    precipitation, per code and config version, and of agent -> accessions.
+    Biosamples that were dropped are stored too, with a null date, and
+    resolved again once they are older than dropped_ttl.
+
+    Thread-safe. Open it once per process: processes share the database
+    in WAL mode and wait up to BUSY_TIMEOUT for each other's writes.
+    """
+
+    def __init__(self, path, config, code, dropped_ttl=DROPPED_TTL):
+        """
+        :param path: Path to database, e.g. clean_data/accessions.sqlite
+        :param config: Config version of the settings that change the output
+        :param code: Code version of the transform, see manifest.code_version
+        :param dropped_ttl: Seconds dropped biosamples are reused
+        """
+        self.config = config
+        self.code = code
+        self.dropped_ttl = dropped_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=BUSY_TIMEOUT, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+
+        # Indexes of an older layout are rebuilt
+        columns = [
+            row[1] for row in self._connection.execute("PRAGMA table_info(accessions)")
+        ]
+        if columns and "stored" not in columns:
+            self._connection.execute("DROP TABLE accessions")
+
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS accessions (
+                accession TEXT,
+                config TEXT,
+                code TEXT,
+                source TEXT,
+                date TEXT,
+                country TEXT,
+                region TEXT,
+                precipitation REAL,
+                stored REAL,
+                PRIMARY KEY (accession, config, code)
+            );
+            CREATE TABLE IF NOT EXISTS memberships (
+                agent TEXT,
+                accession TEXT,
+                PRIMARY KEY (agent, accession)
+            );
+            """
+        )
+
+    def lookup(self, sources):
+        """
+        :param sources: Dictionary of accession -> source key
+        :return: Dictionary of accession -> (date, country, region, precipitation)
+            of known accessions with the same source, date is None if dropped
+        """
+        found = {}
+        accessions = list(sources)
+        expired = time.time() - self.dropped_ttl
+        with self._lock:
+            # SQLite allows up to 999 parameters per statement
+            for i in range(0, len(accessions), 900):
+                chunk = accessions[i : i + 900]
+                rows = self._connection.execute(
+                    f"""
+                    SELECT accession, source, date, country, region, precipitation
+                    FROM accessions
+                    WHERE config = ? AND code = ?
+                        AND (date IS NOT NULL OR stored > ?)
+                        AND accession IN ({", ".join("?" * len(chunk))})
+                    """,
+                    [self.config, self.code, expired, *chunk],
+                )
+                for accession, source, *values in rows:
+                    if source == sources[accession]:
+                        found[accession] = tuple(values)
+
+            self.hits += len(found)
+            self.misses += len(sources) - len(found)
+        return found
+
+    def store(self, sources, df):
+        """
+        Store newly resolved biosamples.
+
+        :param sources: Dictionary of accession -> source key of the biosamples
+        :param df: Dataframe of the biosamples that were kept, the others
+            are stored as dropped
+        """
+        kept = {
+            row[0]: row[1:]
+            for row in df[
+                ["Biosample", "Date", "Country", "region", "Precipitation"]
+            ].itertuples(index=False, name=None)
+        }
+        stored = time.time()
+        rows = [
+            (
+                accession,
+                self.config,
+                self.code,
+                source,
+                *kept.get(accession, (None,) * 4),
+                stored,
+            )
+            for accession, source in sources.items()
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO accessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def set_members(self, agent, accessions):
+        """
+        Replace the accessions that belong to an agent.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM memberships WHERE agent = ?", [agent])
+        self.add_members(agent, accessions)
+
+    def add_members(self, agent, accessions):
+        """
+        Add accessions to the ones that belong to an agent.
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO memberships VALUES (?, ?)",
+                ((agent, accession) for accession in accessions),
+            )
+
+    def export_memberships(self, path):
+        """
+        Write the agent membership link table as parquet with Biosample
+        and Agent columns.
+
+        :return: Number of links
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT accession, agent FROM memberships ORDER BY agent, accession"
+            ).fetchall()
+
+        table = pa.table(
+            {
+                "Biosample": pa.array([row[0] for row in rows], pa.string()),
+                "Agent": pa.array([row[1] for row in rows], pa.string()),
+            }
+        )
+        tmp_path = f"{path}.tmp"
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+        return len(rows)
+
+    def stats(self):
+        """
+        :return: Dictionary of hits, misses and hit rate of lookups
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def close(self):
+        self._connection.close()
+
+
+class IndexedRecords:
+    """
+    Iterable over the records of one agent that are not in the index yet.
+    Known biosamples are collected as rows instead.
+    """
+
+    def __init__(self, records, index, agent, chunk_size=1000):
+        """
+        :param records: Iterable of biosample records
+        :param index: AccessionIndex
+        :param agent: Agent name with spaces replaced by underscores
+        :param chunk_size: Records looked up at once
+        """
+        self.records = records
+        self.index = index
+        self.agent = agent
+        self.chunk_size = chunk_size
+        self.rows = []
+        self.sources = {}
+
+    def _lookup(self, chunk):
+        sources = {accession: source for accession, source, _ in chunk}
+        found = self.index.lookup(sources)
+
+        for accession, source, record in chunk:
+            values = found.get(accession)
+            if values is None:
+                self.sources[accession] = source
+                yield record
+            elif accession not in self.sources:
+                # Known biosamples are reused once, dropped ones are no rows
+                self.sources[accession] = None
+                if values[0] is not None:
+                    self.rows.append([accession, self.agent, *values])
+
+    def __iter__(self):
+        chunk = []
+        for record in self.records:
+            parsed = parse_record(record, ["collection date", "geographic location"])
+            if parsed.accession is None:
+                yield record
+                continue
+
+            source = source_key(
+                parsed.attributes.get("collection date"),
+                parsed.attributes.get("geographic location"),
+            )
+            chunk.append((parsed.accession, source, record))
+            if len(chunk) >= self.chunk_size:
+                yield from self._lookup(chunk)
+                chunk = []
+
+        if chunk:
+            yield from self._lookup(chunk)
+
+    def new_sources(self):
+        """
+        :return: Dictionary of accession -> source key of the records that
+            were not in the index
+        """
+        return {
+            accession: source
+            for accession, source in self.sources.items()
+            if source is not None
+        }
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+"""
+This script keeps a local registry of the select agents
+parsed from selectagents.gov. The page is only downloaded
+again when it changed, and the cached list is used when
+the site cannot be reached.
+"""
+
+import os
+import re
+import ssl
+import json
+import time
+import certifi
+import urllib.error
+import urllib.request
+
+from bs4 import BeautifulSoup
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+AGENTS_PAGE = "https://www.selectagents.gov/sat/list.htm"
+
+# Agents listed under several names are searched with one broader query:
+# every agent containing the key is replaced by the query
+ALIASES = {
+    "SARS": "SARS-CoV",
+    "influenza virus": "influenza virus",
+    "Botulinum": "Botulinum neurotoxins",
+}
+
+
+def parse_agents(html, aliases=ALIASES):
+    """
+    Parse the agents of the select agents page.
+
+    :param html: Page contents
+    :param aliases: Dictionary of substring -> query that replaces matching agents
+    :return: List of agent names
+    """
+    soup = BeautifulSoup(html, "html.parser")
+
+    agent_list = []
+
+    # Find all <ol> fields, one agent per line
+    for data in soup.find_all("ol"):
+        for line in str(data.text).split("\n"):
+            # Remove bracket/parentheses and information between them
+            line = re.sub(r" ?[\(\[].*?[\)\]]", "", line)
+
+            # Remove html character
+            line = re.sub("\xa0", " ", line).strip()
+
+            # Have to make duplicates more broad to fetch data
+            if line and not any(alias in line for alias in aliases):
+                agent_list.append(line)
+
+    # Add simpler names to list after they've been removed
+    agent_list.extend(aliases.values())
+
+    return agent_list
+
+
+class AgentRegistry:
+    """
+    JSON cache of the parsed agents with the page's ETag and Last-Modified.
+    """
+
+    def __init__(self, path="agent_registry.json", url=AGENTS_PAGE, aliases=ALIASES):
+        """
+        :param path: Path to registry, created on the first refresh
+        :param url: URL of the select agents page
+        :param aliases: Dictionary of substring -> query, see parse_agents
+        """
+        self.path = path
+        self.url = url
+        self.aliases = aliases
+        self.entry = None
+
+        if os.path.isfile(path):
+            with open(path) as f:
+                entry = json.load(f)
+            # A registry of another page or aliases has to be fetched again
+            if entry.get("url") == url and entry.get("aliases") == aliases:
+                self.entry = entry
+
+    def refresh(self, max_age=86400, timeout=30):
+        """
+        Update the registry if the page changed. A registry checked less than
+        max_age seconds ago is used without any request, and the cached
+        registry is used if the page cannot be fetched.
+
+        :param max_age: Seconds a registry is used without checking the page
+        :param timeout: Seconds before the request times out
+        :return: "fresh", "unchanged", "updated" or "offline"
+        """
+        if self.entry is not None and time.time() - self.entry["checked"] < max_age:
+            return "fresh"
+
+        request = urllib.request.Request(self.url)
+        if self.entry is not None:
+            if self.entry.get("etag"):
+                request.add_header("If-None-Match", self.entry["etag"])
+            if self.entry.get("last_modified"):
+                request.add_header("If-Modified-Since", self.entry["last_modified"])
+
+        try:
+            with urllib.request.urlopen(
+                request,
+                timeout=timeout,
+                context=ssl.create_default_context(cafile=certifi.where()),
+            ) as response:
+                html = response.read()
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and self.entry is not None:
+                self.entry["checked"] = time.time()
+                self.save()
+                return "unchanged"
+            return self._offline(e)
+        except (urllib.error.URLError, OSError) as e:
+            return self._offline(e)
+
+        self.entry = {
+            "url": self.url,
+            "aliases": self.aliases,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "checked": time.time(),
+            "agents": parse_agents(html, self.aliases),
+        }
+        self.save()
+        return "updated"
+
+    def _offline(self, error):
+        if self.entry is None:
+            raise RuntimeError(f"Cannot fetch {self.url} and no registry: {error}")
+        print(f"WARNING: Cannot fetch {self.url} ({error}). Using cached agents.")
+        return "offline"
+
+    def agents(self):
+        """
+        :return: List of agent names
+        """
+        if self.entry is None:
+            raise RuntimeError("Agent registry is empty. Refresh it first.")
+        return list(self.entry["agents"])
+
+    def save(self):
+        """
+        Write the registry atomically.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entry, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+def write_agents_list(
+    start=1, end=65, registry_path="agent_registry.json", outfile="agents_list.txt"
+):
+    """
+    Refresh the registry and write the agents from start to end, one per line.
+
+    :return: (refresh status, number of agents in the registry)
+    """
+    registry = AgentRegistry(registry_path)
+    status = registry.refresh()
+    agent_list = registry.agents()
+
+    # Fix possible errors
+    if start < 0:
+        start = 0
+    elif start > len(agent_list):
+        start = len(agent_list) - 1
+    if end > len(agent_list):
+        end = len(agent_list)
+    elif end < 0:
+        end = 1
+
+    with open(outfile, "w") as f:
+        for i in range(start, end):
+            f.write(f"{agent_list[i]}\n")
+
+    return status, len(agent_list)
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+"""
+This script transforms the raw biosample records of an
+agent into rows of accession, date, country, region and
+precipitation. It does not depend on Prefect, so the
+flows and the local runner share it.
+"""
+
+import os
+import json
+import pandas as pd
+
+from tqdm import tqdm
+from datetime import datetime
+from contextlib import nullcontext
+from station_cache import StationResolver
+from station_index import StationIndex
+from precipitation import add_precipitation
+from worker_pool import default_in_flight, map_ordered
+from record_reader import iter_chunks
+from biosample_parser import parse_record
+from gazetteer import Gazetteer
+from accession_index import IndexedRecords
+from columnar_transform import records_to_frame, transform_frame
+from parquet_dataset import PARTITIONS_FILE, ChunkedWriter
+from profiling import SAMPLE_EVERY, profiled
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+# Records of an agent transformed at once when memory is bounded
+CHUNK_RECORDS = 10_000
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def dropped(metrics, reason):
+    """
+    Count a skipped biosample by reason.
+
+    :return: None
+    """
+    if metrics is not None:
+        metrics.count("biosamples_dropped", reason=reason)
+    return None
+
+
+def parse_biosample(biosample, regions, countries, metrics=None):
+    """
+    Parses a biosample from input file. Grabs collection date,
+    geographic location (country and hopefully region), and accession
+    number without looking up any weather data.
+
+    :param biosample: Parsed biosample from input file
+    :param regions: Dictionary of country alpha-2 abbreviation -> dictionary
+        of its regions and their abbreviation
+    :param countries: Dictionary of countries and their alpha-2 abbreviation
+    :param metrics: Optional Metrics that skipped biosamples are counted in
+    :return: [accession, collection date, country abbrev, region abbrev] or None
+    """
+    record = parse_record(biosample, ["collection date", "geographic location"])
+    collection_date = record.attributes.get("collection date")
+    geographic_location = record.attributes.get("geographic location")
+
+    missing_collection_date = ["missing", "unknown", "not applicable"]
+    if record.accession is None:
+        return dropped(metrics, "missing_accession")
+    if not geographic_location:
+        return dropped(metrics, "missing_location")
+    if not collection_date:
+        return dropped(metrics, "missing_date")
+
+    if collection_date in missing_collection_date or "-" not in collection_date:
+        return dropped(metrics, "missing_date")
+
+    # Only full dates (YYYY-MM-DD) can be matched with weather data
+    try:
+        datetime.strptime(collection_date, "%Y-%m-%d")
+    except ValueError:
+        return dropped(metrics, "missing_date")
+
+    # Get country and region abbreviation
+    country_abbrev, region_abbrev = Gazetteer.for_tables(countries, regions).resolve(
+        geographic_location
+    )
+
+    if not country_abbrev:
+        return dropped(metrics, "unmapped_country")
+
+    return [record.accession, collection_date, country_abbrev, region_abbrev]
+
+
+@profiled(sample_every=SAMPLE_EVERY)
+def transform_biosample(
+    filename,
+    biosample,
+    regions,
+    countries,
+    station_resolver,
+    weather_backend,
+    metrics=None,
+):
+    """
+    Parses each biosample from input file. Grabs collection date,
+    geographic location (country and hopefully region), and accession
+    number. Finds precipitation by using location and collection date.
+
+    :param filename: Basename of input file
+    :param biosample: Parsed biosample from input file
+    :param regions: Dictionary of country alpha-2 abbreviation -> dictionary
+        of its regions and their abbreviation
+    :param countries: Dictionary of countries and their alpha-2 abbreviation
+    :param station_resolver: StationResolver that memoizes weather stations
+    :param weather_backend: WeatherBackend that precipitation is looked up from
+    :param metrics: Optional Metrics for skipped biosamples and latencies
+    :return: Row for the dataframe or None if biosample is skipped
+    """
+    with metrics.timer("transform_biosample") if metrics else nullcontext():
+        parsed = parse_biosample(biosample, regions, countries, metrics)
+        if parsed is None:
+            return None
+
+        accession, collection_date, country_abbrev, region_abbrev = parsed
+
+        reformatted_date = datetime.strptime(collection_date, "%Y-%m-%d")
+
+        # Get weather data, falling back to the next station if one has no data
+        stations = station_resolver.candidates(country_abbrev, region_abbrev)
+        if not stations:
+            return dropped(metrics, "no_station")
+
+        precip = None
+        for station in stations:
+            data = weather_backend.precipitation(
+                station, reformatted_date, reformatted_date
+            )
+
+            # Incase data['prcp'] returns an index error = no data avail for that date
+            try:
+                precip = data["prcp"][0]
+            except IndexError:
+                continue
+
+            if pd.notna(precip):
+                break
+
+        if precip is None:
+            return dropped(metrics, "no_precipitation")
+
+        if metrics is not None:
+            metrics.count("biosamples_kept")
+
+        return [
+            accession,
+            filename,
+            collection_date,
+            country_abbrev,
+            region_abbrev,
+            precip,
+        ]
+
+
+def load_geography():
+    """
+    :return: (countries, regions), dictionary of country names and their
+        alpha-2 abbreviation, and dictionary of country abbreviation ->
+        region names and their abbreviation
+    """
+    # Load countries from
+    # https://www.iban.com/country-codes
+    with open(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "countries.json"), "r"
+    ) as f:
+        countries = json.load(f)
+
+    # Load regions from
+    # https://www.in.gov/dor/files/reference/foreign-state-province-codes-2018.pdf
+    # grouped by country
+    with open(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "regions.json"), "r"
+    ) as f:
+        regions = json.load(f)
+
+    return countries, regions
+
+
+def make_station_resolver(local_outpath, station_cache=True, nearest_stations=0):
+    """
+    :param local_outpath: Directory of the persisted station cache
+    :param station_cache: Persist resolved weather stations between flow runs
+    :param nearest_stations: Number of nearest stations, 0 for the first
+        station of the country/region. Distances are measured from the
+        centroid of the stations meteostat lists in the country/region.
+    :return: StationResolver
+    """
+    if nearest_stations:
+        return StationResolver(
+            cache_path=os.path.join(
+                local_outpath, f"station_cache_nearest_{nearest_stations}.json"
+            )
+            if station_cache
+            else None,
+            index=StationIndex(),
+            k=nearest_stations,
+        )
+    return StationResolver(
+        cache_path=os.path.join(local_outpath, "station_cache.json")
+        if station_cache
+        else None
+    )
+
+
+def transform_records(
+    data,
+    filename,
+    regions,
+    countries,
+    station_resolver,
+    weather_backend,
+    executor,
+    frequency="monthly",
+    columnar=False,
+    batch=False,
+    metrics=None,
+    accession_index=None,
+):
+    """
+    Transform the biosample records of one agent into a dataframe.
+
+    :param data: Iterable of biosample records
+    :param filename: Agent name with spaces replaced by underscores
+    :param executor: Thread pool for weather lookups
+    :param accession_index: Optional AccessionIndex, biosamples already in it
+        are reused instead of resolved again
+    :return: Dataframe with Biosample, Agent, Date, Country, region and
+        Precipitation columns
+    """
+    columns = ["Biosample", "Agent", "Date", "Country", "region", "Precipitation"]
+    data_list = []
+
+    if accession_index is not None:
+        # Only biosamples that are not in the index are transformed
+        records = IndexedRecords(data, accession_index, filename)
+        df = transform_records(
+            records,
+            filename,
+            regions,
+            countries,
+            station_resolver,
+            weather_backend,
+            executor,
+            frequency,
+            columnar,
+            batch,
+            metrics,
+        )
+        accession_index.store(records.new_sources(), df)
+
+        if metrics is not None:
+            metrics.count("biosamples_reused", len(records.rows))
+        if records.rows:
+            df = pd.concat(
+                [df, pd.DataFrame(records.rows, columns=columns)], ignore_index=True
+            )
+        return df
+
+    if columnar:
+        # Parse into columns, then map geography and dates vectorized
+        df = transform_frame(
+            records_to_frame(tqdm(data)), filename, countries, regions, metrics
+        )
+        return add_precipitation(
+            df, station_resolver, frequency, executor, weather_backend
+        )
+
+    if batch:
+        # Parse everything first, then fetch weather once per station
+        for biosample in tqdm(data):
+            parsed = parse_biosample(biosample, regions, countries, metrics)
+            if parsed is not None:
+                data_list.append([parsed[0], filename, *parsed[1:]])
+
+        return add_precipitation(
+            pd.DataFrame(data_list, columns=columns[:-1]),
+            station_resolver,
+            frequency,
+            executor,
+            weather_backend,
+        )
+
+    # Multiprocess the parsing of data with process bar
+    rows = map_ordered(
+        executor,
+        lambda biosample: transform_biosample(
+            filename,
+            biosample,
+            regions,
+            countries,
+            station_resolver,
+            weather_backend,
+            metrics,
+        ),
+        data,
+        default_in_flight(),
+    )
+    for row in tqdm(rows):
+        if row is not None:
+            data_list.append(row)
+
+    # Create dataframe from data_list
+    return pd.DataFrame(data_list, columns=columns)
+
+
+def transform_chunks(
+    data,
+    filename,
+    regions,
+    countries,
+    station_resolver,
+    weather_backend,
+    executor,
+    frequency="monthly",
+    columnar=False,
+    batch=False,
+    metrics=None,
+    accession_index=None,
+    max_records=CHUNK_RECORDS,
+    max_bytes=CHUNK_BYTES,
+):
+    """
+    Transform the biosample records of one agent in chunks of at most
+    max_records records or max_bytes characters, so only one chunk and
+    its rows are in memory at a time. Parameters are those of
+    transform_records.
+
+    :return: Generator of dataframes, see transform_records
+    """
+    if accession_index is not None:
+        accession_index.set_members(filename, [])
+
+    for chunk in iter_chunks(data, max_records, max_bytes):
+        df = transform_records(
+            chunk,
+            filename,
+            regions,
+            countries,
+            station_resolver,
+            weather_backend,
+            executor,
+            frequency,
+            columnar,
+            batch,
+            metrics,
+            accession_index,
+        )
+        if accession_index is not None:
+            accession_index.add_members(filename, df["Biosample"].unique())
+        yield df
+
+
+def write_local_chunks(frames, filename, local_outpath, metrics=None):
+    """
+    Write dataframes as they are transformed to the agent's partitions,
+    flushing row groups so memory does not grow with the agent's size.
+
+    :param frames: Iterable of dataframes, e.g. from transform_chunks
+    :return: Tuple of the path to the index of the agent's files and
+        the number of rows
+    """
+    with metrics.timer("write_local") if metrics else nullcontext():
+        with ChunkedWriter(os.path.join(local_outpath, "dataset"), filename) as writer:
+            for df in frames:
+                writer.write(df)
+    print(f"INFO: Writing {filename} to local path in {writer.flushes} flushes.")
+    return os.path.join(writer.path, PARTITIONS_FILE), writer.rows
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""
+This script parses one biosample record from efetch
+output into a typed structure in a single scan with
+one precompiled pattern.
+"""
+
+import re
+import functools
+
+from typing import Dict, NamedTuple, Optional
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+# Fields start on their own line, the first line of a record is its title.
+# Attributes are indented by any number of spaces or tabs.
+ACCESSION = r"\n(?:Accession:\s(.+)\sID:"
+INDENT = r"[ \t]*"
+RECORD = re.compile(
+    ACCESSION + r"|Identifiers:[^\n]*?BioSample:[ \t]*([^;\s]+)"
+    r"|Organism:(.*)"
+    rf'|{INDENT}/([^=\n]+)="(.*)")'
+)
+
+
+class BiosampleRecord(NamedTuple):
+    """
+    Fields of one biosample record.
+    """
+
+    accession: Optional[str]
+    biosample_id: Optional[str]
+    organism: Optional[str]
+    attributes: Dict[str, str]
+
+
+@functools.lru_cache(maxsize=None)
+def _keyed_pattern(keys):
+    """
+    :param keys: Tuple of attribute names
+    :return: Compiled pattern of the accession and the given attributes
+    """
+    attributes = "|".join(re.escape(key) for key in keys)
+    return re.compile(ACCESSION + f'|{INDENT}/({attributes})="(.*)")')
+
+
+def parse_record(record, keys=None):
+    """
+    Parse a biosample record in a single scan with one precompiled pattern.
+
+    :param record: Text of one biosample record from efetch
+    :param keys: Optional attribute names to parse, all attributes if None.
+        With keys only the accession and those attributes are parsed, the
+        BioSample ID and organism are None.
+    :return: BiosampleRecord, fields that are not in the record are None.
+        If a field appears more than once, the first one is kept.
+    """
+    accession = None
+    attributes = {}
+
+    if keys is not None:
+        for found, key, value in _keyed_pattern(tuple(keys)).findall(record):
+            if key:
+                if key not in attributes:
+                    attributes[key] = value
+            elif accession is None:
+                accession = found
+        return BiosampleRecord(accession, None, None, attributes)
+
+    biosample_id = None
+    organism = None
+    for found, found_id, found_organism, key, value in RECORD.findall(record):
+        if key:
+            if key not in attributes:
+                attributes[key] = value
+        elif found:
+            if accession is None:
+                accession = found
+        elif found_id:
+            if biosample_id is None:
+                biosample_id = found_id
+        elif organism is None:
+            organism = found_organism.strip()
+
+    return BiosampleRecord(accession, biosample_id, organism, attributes)
+
+
+def split_location(location):
+    """
+    Split a geographic location into country and region,
+    e.g. "USA: California, Los Angeles" -> ("USA", "California").
+
+    :param location: Value of the geographic location attribute
+    :return: Tuple of country and region, region can be empty
+    """
+    country, separator, rest = location.partition(":")
+    if not separator:
+        return country, ""
+    return country, rest.split(":", 1)[0].split(",", 1)[0].strip()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""
+This script turns parsed biosamples into columns and
+maps geography and dates with vectorized pandas
+operations instead of one Python call per row.
+"""
+
+import pandas as pd
+
+from biosample_parser import parse_record
+from gazetteer import Gazetteer
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+MISSING_COLLECTION_DATE = ["missing", "unknown", "not applicable"]
+
+
+def records_to_frame(records):
+    """
+    Parse records into raw columns.
+
+    :param records: Iterable of biosample records from efetch
+    :return: Dataframe with accession, raw_date and raw_location columns
+    """
+    accessions = []
+    raw_dates = []
+    raw_locations = []
+
+    for record in records:
+        parsed = parse_record(record, ["collection date", "geographic location"])
+        accessions.append(parsed.accession)
+        raw_dates.append(parsed.attributes.get("collection date"))
+        raw_locations.append(parsed.attributes.get("geographic location"))
+
+    return pd.DataFrame(
+        {
+            "accession": pd.Series(accessions, dtype="object"),
+            "raw_date": pd.Series(raw_dates, dtype="object"),
+            "raw_location": pd.Series(raw_locations, dtype="object"),
+        }
+    )
+
+
+def map_geography(raw_location, countries, regions):
+    """
+    Map geographic locations to country and region abbreviations.
+
+    :param raw_location: Series of geographic locations, e.g. "USA: Texas"
+    :param countries: Dictionary of countries and their alpha-2 abbreviation
+    :param regions: Dictionary of country alpha-2 abbreviation -> dictionary
+        of its regions and their abbreviation
+    :return: Dataframe with Country and region columns, "" where unmapped
+    """
+    if raw_location.empty:
+        return pd.DataFrame(
+            {"Country": pd.Series(dtype="object"), "region": pd.Series(dtype="object")},
+            index=raw_location.index,
+        )
+
+    # Locations repeat a lot, so only map each distinct one
+    codes, uniques = pd.factorize(raw_location.fillna(""))
+    uniques = pd.Series(uniques, dtype="object")
+
+    gazetteer = Gazetteer.for_tables(countries, regions)
+    resolved = [gazetteer.resolve(location) for location in uniques]
+    country_abbrev = pd.Series([country for country, _ in resolved], dtype="object")
+    region_abbrev = pd.Series([region for _, region in resolved], dtype="object")
+
+    country_abbrev = country_abbrev.to_numpy()[codes]
+    region_abbrev = region_abbrev.to_numpy()[codes]
+
+    return pd.DataFrame(
+        {"Country": country_abbrev, "region": region_abbrev}, index=raw_location.index
+    )
+
+
+def parse_dates(raw_date):
+    """
+    Parse full collection dates (YYYY-MM-DD). Missing, partial
+    or invalid dates become NaT.
+
+    :param raw_date: Series of collection dates
+    :return: Series of datetimes
+    """
+    raw_date = raw_date.fillna("")
+    full_date = raw_date.str.fullmatch(r"\d{4}-\d{1,2}-\d{1,2}") & ~raw_date.isin(
+        MISSING_COLLECTION_DATE
+    )
+    return pd.to_datetime(raw_date.where(full_date), format="%Y-%m-%d", errors="coerce")
+
+
+def transform_frame(df, agent, countries, regions, metrics=None):
+    """
+    Apply the biosample filter rules to a whole frame: rows need an
+    accession, a full collection date and a mapped country.
+
+    :param df: Dataframe from records_to_frame
+    :param agent: Name of the agent
+    :param countries: Dictionary of countries and their alpha-2 abbreviation
+    :param regions: Dictionary of country alpha-2 abbreviation -> dictionary
+        of its regions and their abbreviation
+    :param metrics: Optional Metrics that skipped rows are counted in
+    :return: Dataframe with Biosample, Agent, Date, Country and region columns
+    """
+    has_accession = df["accession"].notna()
+    has_location = df["raw_location"].fillna("") != ""
+    dates = parse_dates(df["raw_date"])
+
+    if metrics is not None:
+        for reason, dropped in [
+            ("missing_accession", ~has_accession),
+            ("missing_location", has_accession & ~has_location),
+            ("missing_date", has_accession & has_location & dates.isna()),
+        ]:
+            metrics.count("biosamples_dropped", int(dropped.sum()), reason=reason)
+
+    df = df[has_accession & has_location & dates.notna()]
+
+    geography = map_geography(df["raw_location"], countries, regions)
+    keep = geography["Country"] != ""
+
+    if metrics is not None:
+        metrics.count(
+            "biosamples_dropped", int((~keep).sum()), reason="unmapped_country"
+        )
+
+    return pd.DataFrame(
+        {
+            "Biosample": df["accession"][keep],
+            "Agent": agent,
+            "Date": df["raw_date"][keep],
+            "Country": geography["Country"][keep],
+            "region": geography["region"][keep],
+        }
+    ).reset_index(drop=True)
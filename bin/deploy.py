@@ -9,6 +9,7 @@ from docker_block import create_docker_block
 from gcp_block import create_gcp_block
 from fetch_and_transform_to_gcs import fetch_and_transform
 from gcs_to_bq import gcs_to_bq
+from fan_out_agents import fan_out_agents
 
 from prefect.deployments import Deployment
 from prefect.infrastructure.docker import DockerContainer
@@ -38,8 +39,17 @@ def main():
         infrastructure=docker_block,
     )
 
+    # One task per agent on a local Dask cluster in the container
+    deployment3 = Deployment.build_from_flow(
+        flow=fan_out_agents,
+        name="docker-flow1-dask",
+        infrastructure=docker_block,
+        infra_overrides={"env.AGENTS_TASK_RUNNER": "dask"},
+    )
+
     deployment1.apply()
     deployment2.apply()
+    deployment3.apply()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+
+"""
+This script is an asyncio client for NCBI's E-utilities.
+Biosamples of each agent are searched once on the history
+server and fetched in large batches under NCBI's rate limit,
+with a checkpoint after every batch so an interrupted agent
+resumes where it stopped.
+"""
+
+import os
+import gzip
+import json
+import time
+import random
+import asyncio
+import httpx
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+
+# Requests per second allowed by NCBI
+# https://ncbiinsights.ncbi.nlm.nih.gov/2017/11/02/new-api-keys-for-the-e-utilities/
+RATE_LIMIT = 3
+RATE_LIMIT_API_KEY = 10
+
+# Responses that are worth retrying
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by every request of a client.
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        :param rate: Tokens added per second
+        :param capacity: Maximum number of tokens, 1 spaces requests evenly
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Wait until a token is available and take it.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class EutilsError(Exception):
+    """
+    Raised when a request still fails after every retry.
+    """
+
+
+class EutilsClient:
+    """
+    E-utilities client with one connection pool, a rate limit and retries.
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        base_url=EUTILS_URL,
+        rate=None,
+        retries=5,
+        backoff=1.0,
+        timeout=300,
+    ):
+        """
+        :param api_key: NCBI API key, raises the rate limit to 10 requests/s
+        :param base_url: URL of the E-utilities, e.g. a local stub server
+        :param rate: Requests per second, defaults to NCBI's limit
+        :param retries: Number of retries of a failed request
+        :param backoff: Seconds before the first retry, doubled each retry
+        :param timeout: Seconds before a request times out
+        """
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.bucket = TokenBucket(
+            rate or (RATE_LIMIT_API_KEY if api_key else RATE_LIMIT)
+        )
+        self.client = httpx.AsyncClient(timeout=timeout)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+
+    async def request(self, endpoint, params):
+        """
+        GET an E-utility, retrying connection errors and 429/5xx responses.
+
+        :param endpoint: e.g. "esearch.fcgi"
+        :param params: Query parameters
+        :return: httpx.Response
+        """
+        params = {"tool": "bio-agents_and_precip", **params}
+        if self.api_key:
+            params["api_key"] = self.api_key
+
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            try:
+                response = await self.client.get(
+                    f"{self.base_url}/{endpoint}", params=params
+                )
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response
+                error = f"HTTP {response.status_code}"
+                retry_after = response.headers.get("Retry-After")
+            except httpx.TransportError as e:
+                error = repr(e)
+                retry_after = None
+
+            if attempt == self.retries:
+                raise EutilsError(
+                    f"{endpoint} failed after {attempt + 1} tries: {error}"
+                )
+
+            delay = self.backoff * 2**attempt * (1 + random.random() / 2)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            print(f"WARNING: {endpoint} failed ({error}). Retrying in {delay:.1f}s..")
+            await asyncio.sleep(delay)
+
+    async def esearch(self, db, term):
+        """
+        Search a database and keep the results on the history server.
+
+        :return: Dictionary with count, webenv and query_key
+        """
+        response = await self.request(
+            "esearch.fcgi",
+            {
+                "db": db,
+                "term": term,
+                "usehistory": "y",
+                "retmax": 0,
+                "retmode": "json",
+            },
+        )
+        result = response.json()["esearchresult"]
+        if "ERROR" in result:
+            raise EutilsError(f"esearch of '{term}' failed: {result['ERROR']}")
+
+        return {
+            "count": int(result["count"]),
+            "webenv": result["webenv"],
+            "query_key": result["querykey"],
+        }
+
+    async def efetch(self, db, webenv, query_key, retstart, retmax):
+        """
+        Fetch one batch of search results from the history server as text.
+
+        :return: Text of up to retmax records
+        """
+        response = await self.request(
+            "efetch.fcgi",
+            {
+                "db": db,
+                "WebEnv": webenv,
+                "query_key": query_key,
+                "retstart": retstart,
+                "retmax": retmax,
+                "retmode": "text",
+            },
+        )
+        return response.text
+
+
+class Checkpoint:
+    """
+    JSON file of how far an agent's download got.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """
+        :return: Dictionary with term, count, retstart and size, or None
+        """
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, **state):
+        """
+        Write the checkpoint atomically.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+async def fetch_agent(client, term, out_path, db="biosample", retmax=5000):
+    """
+    Download every biosample of an agent into out_path. Batches are appended
+    to out_path.part and checkpointed, so a rerun after an interruption
+    continues at the next batch. Records of consecutive batches are
+    separated by a blank line.
+
+    :param client: EutilsClient
+    :param term: Search term, e.g. "Bacillus anthracis"
+    :param out_path: Path to output file, e.g. raw_data/Bacillus_anthracis.tsv
+    :param db: Entrez database
+    :param retmax: Records per efetch request
+    :return: Number of records found
+    """
+    part_path = f"{out_path}.part"
+    checkpoint = Checkpoint(f"{out_path}.checkpoint")
+
+    search = await client.esearch(db, term)
+    count = search["count"]
+
+    # Resume only if the search still returns the same results
+    state = checkpoint.load()
+    if (
+        state is not None
+        and state["term"] == term
+        and state["count"] == count
+        and os.path.isfile(part_path)
+    ):
+        retstart = state["retstart"]
+        print(f"INFO: Resuming {term} at {retstart}/{count}.")
+    else:
+        state = {"size": 0}
+        retstart = 0
+
+    with open(part_path, "ab") as f:
+        # Drop anything written after the last checkpoint
+        f.truncate(state["size"])
+
+        while retstart < count:
+            text = await client.efetch(
+                db, search["webenv"], search["query_key"], retstart, retmax
+            )
+            f.write(text.rstrip("\n").encode() + b"\n\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+            retstart = min(retstart + retmax, count)
+            checkpoint.save(term=term, count=count, retstart=retstart, size=f.tell())
+
+    os.replace(part_path, out_path)
+    checkpoint.remove()
+    return count
+
+
+async def stream_agent(client, term, raw_path, db="biosample", retmax=5000):
+    """
+    Download every biosample of an agent and yield each batch as soon as it
+    arrives. The raw text is also written gzip compressed to raw_path, which
+    appears once the download is complete. Streams are not resumed, the
+    partial file of one that failed or was closed early is removed.
+
+    :param client: EutilsClient
+    :param term: Search term, e.g. "Bacillus anthracis"
+    :param raw_path: Path to output file, e.g. raw_data/Bacillus_anthracis.tsv.gz
+    :param db: Entrez database
+    :param retmax: Records per efetch request
+    :return: Async generator of text batches of whole records
+    """
+    search = await client.esearch(db, term)
+    part_path = f"{raw_path}.part"
+
+    try:
+        # mtime=0 so the same records always compress to the same bytes
+        with gzip.GzipFile(part_path, "wb", mtime=0) as f:
+            for retstart in range(0, search["count"], retmax):
+                text = await client.efetch(
+                    db, search["webenv"], search["query_key"], retstart, retmax
+                )
+                text = text.rstrip("\n") + "\n\n"
+                f.write(text.encode())
+                yield text
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    os.replace(part_path, raw_path)
+
+
+async def fetch_agents(
+    terms,
+    out_dir,
+    api_key=None,
+    base_url=EUTILS_URL,
+    concurrency=4,
+    retmax=5000,
+):
+    """
+    Download every agent with one client, at most concurrency agents at once.
+
+    :param terms: List of search terms
+    :param out_dir: Directory of output files, named with spaces as underscores
+    :return: Dictionary of term -> number of records, or the exception it raised
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with EutilsClient(api_key, base_url) as client:
+
+        async def fetch(term):
+            async with semaphore:
+                out_path = os.path.join(out_dir, f"{term.replace(' ', '_')}.tsv")
+                count = await fetch_agent(client, term, out_path, retmax=retmax)
+                print(f"INFO: Fetched {count} biosamples of {term}.")
+                return count
+
+        results = await asyncio.gather(
+            *[fetch(term) for term in terms], return_exceptions=True
+        )
+
+    return dict(zip(terms, results))
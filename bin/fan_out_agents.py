@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+
+"""
+This script runs fetch_and_transform with one task per
+agent, so agents are spread over the workers of a
+concurrent or Dask task runner instead of one loop.
+Largest agents are scheduled first, downloads and
+weather lookups each have a concurrency limit, and a
+failed agent is retried on its own.
+"""
+
+import os
+import sys
+import ssl
+import time
+import asyncio
+import argparse
+import threading
+import concurrent.futures
+
+from prefect import flow, task
+from prefect.runtime import flow_run
+from prefect.task_runners import ConcurrentTaskRunner
+from eutils import RATE_LIMIT, RATE_LIMIT_API_KEY, EutilsClient, fetch_agent
+from accession_index import AccessionIndex
+from manifest import Manifest, code_version, config_version, hash_file
+from metrics import Metrics
+from record_reader import find_raw_file, read_records
+from storage_backends import Uploader, get_storage_backend
+from weather_backends import (
+    TimedWeatherBackend,
+    check_weather_backend,
+    get_weather_backend,
+)
+from worker_pool import default_workers
+from scrape_agents_webpage import scrape_agents_webpage
+from agent_transform import (
+    load_geography,
+    make_station_resolver,
+    transform_chunks,
+    transform_records,
+    write_local_chunks,
+)
+from fetch_and_transform_to_gcs import write_gcs, write_local
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+# Seconds between checks for finished tasks
+POLL_INTERVAL = 1.0
+
+
+def wait_first(*submitted, interval=POLL_INTERVAL):
+    """
+    Wait for whichever task run finishes first, not the oldest one, so a
+    large agent does not hold the slots of smaller ones behind it.
+
+    :param submitted: Lists of (term, PrefectFuture), not all empty
+    :return: (list, term, PrefectFuture, final state) of a finished task
+        run, which is removed from the list it was in
+    """
+    while True:
+        for runs in submitted:
+            for i, (term, future) in enumerate(runs):
+                if future.get_state().is_final():
+                    del runs[i]
+                    return runs, term, future, future.wait()
+        time.sleep(interval)
+
+
+def get_task_runner(name="concurrent", address=None, n_workers=None):
+    """
+    :param name: "concurrent" for threads in the flow's process or "dask"
+        for a Dask cluster, which needs prefect-dask
+    :param address: Scheduler of an existing Dask cluster, e.g.
+        tcp://10.0.0.2:8786. A local cluster is started if None.
+    :param n_workers: Number of worker processes of a local Dask cluster
+    :return: Prefect task runner
+    """
+    if name == "concurrent":
+        return ConcurrentTaskRunner()
+    if name == "dask":
+        try:
+            from prefect_dask import DaskTaskRunner
+        except ImportError:
+            raise ValueError("The dask task runner needs prefect-dask installed.")
+
+        if address:
+            return DaskTaskRunner(address=address)
+        return DaskTaskRunner(cluster_kwargs={"n_workers": n_workers})
+    raise ValueError(f"Unknown task runner '{name}'.")
+
+
+class WorkerContext:
+    """
+    Geography, station resolver, weather backend, accession index, thread
+    pool and uploader of one worker process, built by the first agent that
+    runs on it and shared by the agents after it.
+    """
+
+    _contexts = {}
+    _contexts_lock = threading.Lock()
+
+    def __init__(
+        self,
+        local_outpath,
+        station_cache,
+        nearest_stations,
+        weather,
+        frequency,
+        storage,
+        workers,
+        reuse_accessions,
+        config,
+        code,
+    ):
+        # Monkeypatching -- Discouraged but quick fix to run on GCS
+        ssl._create_default_https_context = ssl._create_unverified_context
+
+        self.countries, self.regions = load_geography()
+        self.station_resolver = make_station_resolver(
+            local_outpath, station_cache, nearest_stations
+        )
+        self.weather_backend = get_weather_backend(
+            weather, os.path.join(local_outpath, "weather.sqlite"), frequency
+        )
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers or default_workers()
+        )
+        self.uploader = Uploader(get_storage_backend(storage))
+        self.save_lock = threading.Lock()
+
+        # One connection per process, concurrent agents share it
+        self.accession_index = None
+        if reuse_accessions:
+            self.accession_index = AccessionIndex(
+                os.path.join(local_outpath, "accessions.sqlite"), config, code
+            )
+
+    @classmethod
+    def get(cls, *settings):
+        """
+        :param settings: Arguments of WorkerContext
+        :return: WorkerContext of this process for the settings
+        """
+        with cls._contexts_lock:
+            if settings not in cls._contexts:
+                cls._contexts[settings] = cls(*settings)
+            return cls._contexts[settings]
+
+
+def raw_size(local_inpath, term):
+    """
+    :return: Size of an agent's raw data from an earlier fetch, 0 if none
+    """
+    file = find_raw_file(local_inpath, term.replace(" ", "_"))
+    return os.path.getsize(file) if file is not None else 0
+
+
+@task(retries=3, retry_delay_seconds=30, tags=["ncbi"], log_prints=True)
+def fetch_agent_data(term, local_inpath, api_key=None, rate=None):
+    """
+    Download the biosamples of one agent. A retry resumes at the last
+    checkpointed batch.
+
+    :param rate: Requests per second of this agent, its share of NCBI's limit
+    :return: Number of biosamples
+    """
+    out_path = os.path.join(local_inpath, f"{term.replace(' ', '_')}.tsv")
+
+    async def fetch():
+        async with EutilsClient(api_key, rate=rate) as client:
+            return await fetch_agent(client, term, out_path)
+
+    count = asyncio.run(fetch())
+    print(f"INFO: Fetched {count} biosamples of {term}.")
+    return count
+
+
+@task(retries=2, retry_delay_seconds=10, tags=["weather"], log_prints=True)
+def process_agent(term, settings, incremental=True):
+    """
+    Transform one agent's raw data, write it and upload it.
+
+    :param term: Agent name
+    :param settings: Dictionary of fan_out_agents settings, see fan_out_agents
+    :param incremental: Skip the agent if its raw data, code and settings
+        are unchanged since it was last written
+    :return: Dictionary with filename, status, and for processed agents
+        input_hash, index, rows and metrics
+    """
+    context = WorkerContext.get(
+        settings["local_outpath"],
+        settings["station_cache"],
+        settings["nearest_stations"],
+        settings["weather"],
+        settings["frequency"],
+        settings["storage"],
+        settings["workers"],
+        settings["reuse_accessions"],
+        settings["config"],
+        settings["code"],
+    )
+    filename = term.replace(" ", "_")
+
+    file = find_raw_file(settings["local_inpath"], filename)
+    input_hash = hash_file(file) if file is not None else None
+
+    manifest = Manifest(os.path.join(settings["local_outpath"], "manifest.json"))
+    if incremental and manifest.is_current(
+        filename, input_hash, settings["code"], settings["config"]
+    ):
+        print(f"INFO: {filename} is unchanged. Skipping..")
+        return {"filename": filename, "status": "unchanged"}
+
+    print(f"INFO: Cleaning {filename}")
+    metrics = Metrics()
+    accession_index = context.accession_index
+    transform_args = (
+        read_records(file) if file is not None else [],
+        filename,
+        context.regions,
+        context.countries,
+        context.station_resolver,
+        TimedWeatherBackend(context.weather_backend, metrics),
+        context.executor,
+        settings["frequency"],
+        settings["columnar"],
+        settings["batch"],
+        metrics,
+        accession_index,
+    )
+    if settings["bounded_memory"]:
+        index, rows = write_local_chunks(
+            transform_chunks(*transform_args),
+            filename,
+            settings["local_outpath"],
+            metrics,
+        )
+    else:
+        df = transform_records(*transform_args)
+        if accession_index is not None:
+            accession_index.set_members(filename, df["Biosample"].unique())
+        rows = len(df)
+        index = write_local.fn(df, filename, settings["local_outpath"], metrics)
+    with context.save_lock:
+        context.station_resolver.save()
+
+    print(f"INFO: Length of df = {rows}")
+    metrics.count("rows_written", rows, agent=filename)
+
+    with metrics.timer("write_gcs"):
+        # Raises if an upload failed, so the agent is retried
+        write_gcs.fn(
+            filename, settings["local_outpath"], settings["gcs_path"], context.uploader
+        ).result()
+
+    return {
+        "filename": filename,
+        "status": "processed",
+        "input_hash": input_hash,
+        "index": index,
+        "rows": rows,
+        "metrics": metrics.to_dict(),
+    }
+
+
+# Deployments choose the task runner with the environment of their
+# infrastructure, e.g. AGENTS_TASK_RUNNER=dask DASK_ADDRESS=tcp://10.0.0.2:8786
+@flow(
+    log_prints=True,
+    task_runner=get_task_runner(
+        os.environ.get("AGENTS_TASK_RUNNER", "concurrent"),
+        os.environ.get("DASK_ADDRESS"),
+    ),
+)
+def fan_out_agents(
+    api_key="NULL",
+    start=0,
+    end=66,
+    station_cache=True,
+    batch=False,
+    frequency="monthly",
+    workers=None,
+    columnar=False,
+    incremental=True,
+    weather="meteostat",
+    nearest_stations=0,
+    storage="gcs",
+    fetch=True,
+    ncbi_concurrency=3,
+    weather_concurrency=4,
+    reuse_accessions=True,
+    bounded_memory=False,
+):
+    """
+    Entry point of script that processes every agent as its own task.
+    Raw data and clean_data have to be on a volume that every worker
+    shares when the task runner has several nodes.
+
+    Parameters are those of fetch_and_transform, and:
+
+    :param fetch: Download agents from NCBI, otherwise raw_data is used as is
+    :param ncbi_concurrency: Agents downloaded at once. NCBI's rate limit is
+        shared between them.
+    :param weather_concurrency: Agents transformed at once, which bounds the
+        concurrent requests to the weather backend
+    """
+    # Set params
+    infile = "agents_list.txt"
+    local_inpath = "raw_data"
+    local_outpath = "clean_data"
+    gcs_path = "data"
+
+    # Fail before any agent runs, the workers build the backend themselves
+    check_weather_backend(weather, frequency)
+
+    # Scrape webpage
+    scrape_agents_webpage(start, end)
+
+    # Make directories if they don't exist
+    os.makedirs(local_outpath, exist_ok=True)
+    os.makedirs(local_inpath, exist_ok=True)
+
+    with open(infile) as f:
+        terms = [line.strip() for line in f if line.strip()]
+
+    # Largest agents from earlier runs first, so the long tail starts early
+    terms.sort(key=lambda term: raw_size(local_inpath, term), reverse=True)
+
+    api_key = None if api_key in (None, "", "NULL") else api_key
+    rate = (RATE_LIMIT_API_KEY if api_key else RATE_LIMIT) / ncbi_concurrency
+
+    manifest = Manifest(os.path.join(local_outpath, "manifest.json"))
+    settings = {
+        "local_inpath": local_inpath,
+        "local_outpath": local_outpath,
+        "gcs_path": gcs_path,
+        "station_cache": station_cache,
+        "nearest_stations": nearest_stations,
+        "weather": weather,
+        "storage": storage,
+        "workers": workers,
+        "batch": batch,
+        "frequency": frequency,
+        "columnar": columnar,
+        "reuse_accessions": reuse_accessions,
+        "bounded_memory": bounded_memory,
+        "code": code_version(),
+        "config": config_version(
+            {
+                "batch": batch,
+                "frequency": frequency,
+                "columnar": columnar,
+                "weather": weather,
+                "nearest_stations": nearest_stations,
+            }
+        ),
+    }
+
+    # Counters and latencies of every agent, exported when the flow finishes
+    metrics = Metrics()
+    failed = []
+
+    def fail(term, state):
+        print(f"ERROR: {term} failed: {state.message}")
+        metrics.count("agents", status="failed")
+        failed.append(term)
+
+    def collect(term, state):
+        if not state.is_completed():
+            fail(term, state)
+            return
+
+        result = state.result()
+        metrics.count("agents", status=result["status"])
+        if result["status"] == "processed":
+            metrics.merge(result["metrics"])
+            # Only agents that reached storage are recorded
+            manifest.record(
+                result["filename"],
+                result["input_hash"],
+                settings["code"],
+                settings["config"],
+                result["index"],
+            )
+
+    # Downloads and transforms are pipelined, each with its own limit, and
+    # a slot is refilled as soon as any of its agents finishes. An agent is
+    # only transformed once its download completed: a task waiting for a
+    # failed one would stay pending forever.
+    queued = list(terms) if fetch else []
+    ready = [] if fetch else list(terms)
+    downloading = []
+    processing = []
+    while queued or ready or downloading or processing:
+        while queued and len(downloading) < ncbi_concurrency:
+            term = queued.pop(0)
+            download = fetch_agent_data.submit(term, local_inpath, api_key, rate)
+            downloading.append((term, download))
+        while ready and len(processing) < weather_concurrency:
+            term = ready.pop(0)
+            processing.append((term, process_agent.submit(term, settings, incremental)))
+
+        runs, term, _, state = wait_first(downloading, processing)
+        if runs is processing:
+            collect(term, state)
+        elif state.is_completed():
+            ready.append(term)
+        else:
+            fail(term, state)
+
+    # Which agents each biosample belongs to, for the warehouse
+    if reuse_accessions:
+        accession_index = AccessionIndex(
+            os.path.join(local_outpath, "accessions.sqlite"),
+            settings["config"],
+            settings["code"],
+        )
+        membership = os.path.join(local_outpath, "agent_membership.parquet")
+        print(
+            f"INFO: {accession_index.export_memberships(membership)} agent memberships"
+        )
+        accession_index.close()
+        with Uploader(get_storage_backend(storage)) as uploader:
+            upload = uploader.submit(membership, f"{gcs_path}/agent_membership.parquet")
+        if upload.exception() is not None:
+            print(f"ERROR: Upload of memberships failed: {upload.exception()}")
+            failed.append("agent_membership")
+
+    metrics.export(
+        os.path.join(local_outpath, "metrics"),
+        flow_run.name or "fan_out_agents",
+        artifact_key="fan-out-agents-metrics",
+    )
+
+    if failed:
+        raise RuntimeError(f"Agents failed: {', '.join(failed)}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--start", type=int, default=0)
+    parser.add_argument("--end", type=int, default=66)
+    parser.add_argument(
+        "--task-runner", choices=["concurrent", "dask"], default="concurrent"
+    )
+    parser.add_argument("--address", help="Scheduler of an existing Dask cluster")
+    parser.add_argument("--n-workers", type=int, help="Workers of a local cluster")
+    args = parser.parse_args()
+
+    try:
+        task_runner = get_task_runner(args.task_runner, args.address, args.n_workers)
+    except ValueError as e:
+        sys.stderr.write(f"ERROR: {e}\n")
+        sys.exit(1)
+
+    fan_out_agents.with_options(task_runner=task_runner)(start=args.start, end=args.end)
@@ -6,158 +6,125 @@ obtains weather data, and exports a dataframe.
 """
 
 import os
-import re
 import sys
 import ssl
-import json
-import pandas as pd
 import concurrent.futures
 
-from tqdm import tqdm
-from pathlib import Path
-from datetime import datetime
+from contextlib import nullcontext
 from prefect import flow, task
-from prefect_gcp.cloud_storage import GcsBucket
-from meteostat import Monthly, Point, Stations
+from prefect.runtime import flow_run
+from worker_pool import default_workers
+from record_reader import find_raw_file, read_records
+from accession_index import AccessionIndex
+from agent_transform import (
+    load_geography,
+    make_station_resolver,
+    transform_chunks,
+    transform_records,
+    write_local_chunks,
+)
+from manifest import Manifest, code_version, config_version, hash_file
+from weather_backends import TimedWeatherBackend, get_weather_backend
+from storage_backends import Uploader, get_storage_backend
+from parquet_dataset import upload_agent, write_agent
+from metrics import Metrics
+from profiling import profiled, section, start_profiling, stop_profiling
 from scrape_agents_webpage import scrape_agents_webpage
 from fetch_data import fetch_data
-
+from eutils import EutilsError
+from record_stream import RecordStream
 
 __author__ = "Gregory Sprenger"
 __license__ = "Apache 2.0"
 __version__ = "1.0.0"
 
 
-def transform_biosample(filename, biosample, data_list, regions, countries):
-    """
-    Parses each biosample from input file. Grabs collection date,
-    geographic location (country and hopefully region), and accession
-    number. Finds precipitation by using location and collection date.
-    Then adds all of this information to the dataframe parameter.
-
-    :param filename: Basename of input file
-    :param biosample: Parsed biosample from input file
-    :param df: Dataframe that data will be added to
-    :param regions: Dictionary of regions and their alpha-2 abbreviation
-    :param countries: Dictionary of countries and their alpha-2 abbreviation
-    :return: None
-    """
-    collection_date = re.search(r"collection date=\"(.+)\"", biosample)
-    geographic_location = re.search(r'geographic location=\"(.+)"', biosample)
-    accession = re.search(r"Accession:\s(.+)[\s\t]ID:.+", biosample)
-
-    missing_collection_date = ["missing", "unknown", "not applicable"]
-    if (
-        collection_date is not None
-        and geographic_location is not None
-        and accession is not None
-    ):
-        if collection_date.group(
-            1
-        ) not in missing_collection_date and "-" in collection_date.group(1):
-            # Get country abbreviation
-            if ":" in geographic_location.group(1):
-                country = geographic_location.group(1).split(":")[0]
-                region = (
-                    geographic_location.group(1).split(":")[1].split(",")[0].strip()
-                )
-            else:
-                country = geographic_location.group(1)
-                region = ""
-
-            if country == "USA":
-                country_abbrev = "US"
-            else:
-                country_abbrev = countries.get(country.upper(), "")
-
-            # Get region abbreviation
-            if region:
-                region_abbrev = regions.get(region.upper(), "")
-            else:
-                region_abbrev = ""
-
-            # Get weather data
-            stations = Stations()
-            if country_abbrev and region_abbrev:
-                stations = stations.region(country_abbrev, region_abbrev)
-            elif country_abbrev:
-                stations = stations.region(country_abbrev)
-            else:
-                return
-
-            stations = stations.fetch(1)
-            try:
-                area = Point(stations.latitude[0], stations.longitude[0], 1)
-            except IndexError:
-                area = "Error"
-
-            if area != "Error":
-                split_date = collection_date.group(1).split("-")
-                if len(split_date) == 3:
-                    reformatted_date = datetime(
-                        int(split_date[0]), int(split_date[1]), int(split_date[2])
-                    )
-
-                    data = Monthly(area, reformatted_date, reformatted_date)
-                    data = data.fetch()
-
-                    # Incase data['prcp'] returns an index error = no data avail for that date
-                    try:
-                        precip = data["prcp"][0]
-                    except IndexError:
-                        precip = "Error"
-
-                    if precip != "Error":
-                        new_row = [
-                            accession.group(1),
-                            filename,
-                            collection_date.group(1),
-                            country_abbrev,
-                            region_abbrev,
-                            precip,
-                        ]
-                        data_list.append(new_row)
-
-
-def transform_biosample_wrapper(args):
-    """
-    Wrapper function that multiprocesses the parsing of the input file.
-
-    :param args: filename, biosample, dataframe, regions, and countries from main function
-    :return: Returns parse_lines function with parameters
-    """
-    return transform_biosample(*args)
-
-
 @task(log_prints=True)
-def write_local(df, filename, local_outpath):
+@profiled
+def write_local(df, filename, local_outpath, metrics=None):
     """
-    Write dataframe to local path as parquet.
+    Write dataframe to local path as the agent's partitions of
+    the typed parquet dataset in <local_outpath>/dataset.
+
+    :return: Path to the index of the agent's files
     """
-    df.to_parquet(
-        f"{local_outpath}/{filename}.parquet.gz", compression="gzip", index=False
-    )
+    with metrics.timer("write_local") if metrics else nullcontext():
+        index = write_agent(df, os.path.join(local_outpath, "dataset"), filename)
     print(f"INFO: Writing {filename} to local path.")
+    return index
 
 
 @task(log_prints=True)
-def write_gcs(filename, local_outpath, gcs_path):
+@profiled
+def write_gcs(filename, local_outpath, gcs_path, uploader):
     """
-    Upload parquet files to GCS.
+    Queue upload of an agent's parquet files to GCS. The uploads run in
+    the background while the next agent is processed, and the index of
+    the agent's files is uploaded once all of them are in GCS.
+
+    :param uploader: Uploader that reuses one storage client
+    :return: Future of the index upload
     """
-    gcs_bucket = GcsBucket.load("gcs-agents-precip")
-    gcs_bucket.upload_from_path(
-        from_path=f"{local_outpath}/{filename}.parquet.gz",
-        to_path=f"{gcs_path}/{filename}.parquet.gz",
-        timeout=9000,
-    )
     print(f"INFO: Writing {filename} to GCS.")
+    return upload_agent(
+        uploader, os.path.join(local_outpath, "dataset"), gcs_path, filename
+    )
 
 
 @flow(log_prints=True)
-def fetch_and_transform(api_key="NULL", start=0, end=66):
+def fetch_and_transform(
+    api_key="NULL",
+    start=0,
+    end=66,
+    station_cache=True,
+    batch=False,
+    frequency="monthly",
+    workers=None,
+    columnar=False,
+    incremental=True,
+    weather="meteostat",
+    nearest_stations=0,
+    storage="gcs",
+    uploads=4,
+    stream=False,
+    reuse_accessions=True,
+    bounded_memory=False,
+    profile=False,
+):
     """
     Entry point of script that does the processing of input file.
+
+    :param station_cache: Persist resolved weather stations between flow runs
+    :param batch: Fetch precipitation once per station instead of per biosample
+    :param frequency: "monthly" or "daily" precipitation when batch is set
+    :param workers: Number of worker threads, defaults to the number of CPUs
+    :param columnar: Parse records into columns and filter them vectorized,
+        precipitation is then fetched once per station like batch
+    :param incremental: Skip agents whose raw data, code and settings are
+        unchanged since they were last written. Not with stream.
+    :param weather: "meteostat" for live requests or "local" for the
+        pre-warmed store in clean_data/weather.sqlite
+    :param nearest_stations: Use the k nearest stations reporting monthly data
+        to each country/region centroid, falling back to the next one when a
+        station has no data. 0 uses the first station of the country/region.
+    :param storage: "gcs" for the GCS bucket or "local" to copy uploads
+        to storage/ for offline runs
+    :param uploads: Number of concurrent background uploads
+    :param stream: Transform each agent's records while they are downloaded
+        instead of fetching every agent first. Raw data is kept as
+        raw_data/<agent>.tsv.gz. Every agent is downloaded and transformed
+        again: incremental does not apply, as the raw data is only known
+        once it was transformed.
+    :param reuse_accessions: Reuse biosamples that another agent or an earlier
+        run already resolved with the same settings, from
+        clean_data/accessions.sqlite
+    :param bounded_memory: Transform and write each agent in chunks, so
+        peak memory does not grow with the largest agent. With batch or
+        columnar, precipitation is then fetched once per station per chunk.
+    :param profile: Profile every task and every 20th biosample with
+        cProfile, and sample the stack of each agent's transform. Dumps are
+        written to clean_data/profiles/<flow run> and the hotspots published
+        as an artifact.
     """
     # Set params
     infile = "agents_list.txt"
@@ -165,16 +132,22 @@ def fetch_and_transform(api_key="NULL", start=0, end=66):
     local_outpath = "clean_data"
     gcs_path = "data"
 
+    profiler = None
+    if profile:
+        profiler = start_profiling(os.path.join(local_outpath, "profiles"))
+
     # Monkeypatching -- Discouraged but quick fix to run on GCS
     ssl._create_default_https_context = ssl._create_unverified_context
 
     # Scrape webpage
     scrape_agents_webpage(start, end)
 
-    # Grab data with esearch/efetch
-    print("INFO: Fetching data..")
-    fetch_data(api_key)
-    print("INFO: Done fetching data.")
+    # Grab data with the E-utilities client
+    fetched = None
+    if not stream:
+        print("INFO: Fetching data..")
+        fetched = fetch_data(api_key)
+        print("INFO: Done fetching data.")
 
     # Check if input/output directory exists
     if not os.path.exists(infile):
@@ -187,69 +160,203 @@ def fetch_and_transform(api_key="NULL", start=0, end=66):
     if not os.path.exists(local_inpath):
         os.makedirs(local_inpath)
 
-    # Load countries from
-    # https://www.iban.com/country-codes
-    with open(
-        os.path.join(os.path.dirname(os.path.abspath(__file__)), "countries.json"), "r"
-    ) as f:
-        countries = json.load(f)
+    countries, regions = load_geography()
 
-    # Load regions from
-    # https://www.in.gov/dor/files/reference/foreign-state-province-codes-2018.pdf
-    with open(
-        os.path.join(os.path.dirname(os.path.abspath(__file__)), "regions.json"), "r"
-    ) as f:
-        regions = json.load(f)
+    # Resolve weather stations once per (country, region) pair
+    station_resolver = make_station_resolver(
+        local_outpath, station_cache, nearest_stations
+    )
 
-    filenames = []
+    # Precipitation source
+    weather_backend = get_weather_backend(
+        weather, os.path.join(local_outpath, "weather.sqlite"), frequency
+    )
+
+    terms = []
 
     # Read input file
     with open(infile) as f:
         for line in f.readlines():
-            line = line.strip().replace(" ", "_")
-            filenames.append(line + ".tsv")
-
-    for i in filenames:
-        data_list = []
-
-        file = os.path.join(local_inpath, i)
-        if os.path.isfile(file):
-            with open(file) as f:
-                lines = f.read()
-
-            data = lines.split("\n\n")
-            filename = os.path.basename(i).split(".")[0]
-
-            print(f"INFO: Cleaning {filename}")
-
-            # Multiprocess the parsing of data with process bar
-            for biosample in tqdm(data):
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    executor.submit(
-                        transform_biosample_wrapper,
-                        args=(filename, biosample, data_list, regions, countries),
-                    )
-
-        # Create dataframe from data_list
-        df = pd.DataFrame(
-            data_list,
-            columns=[
-                "Biosample",
-                "Agent",
-                "Date",
-                "Country",
-                "region",
-                "Precipitation",
-            ],
+            terms.append(line.strip())
+
+    # Download in the background while earlier agents are transformed
+    record_stream = None
+    if stream:
+        record_stream = RecordStream(
+            terms,
+            local_inpath,
+            None if api_key == "NULL" else api_key,
+            concurrency=3 if api_key == "NULL" else 8,
         )
 
-        print(f"INFO: Length of df = {len(df)}")
+    # Agents built from the same input, code and settings are skipped
+    manifest = Manifest(os.path.join(local_outpath, "manifest.json"))
+    code = code_version()
+    config = config_version(
+        {
+            "batch": batch,
+            "frequency": frequency,
+            "columnar": columnar,
+            "weather": weather,
+            "nearest_stations": nearest_stations,
+        }
+    )
 
-        # Write df to local area
-        write_local(df, filename, local_outpath)
+    # Counters and latencies of this flow run, exported when it finishes
+    metrics = Metrics()
+    weather_backend = TimedWeatherBackend(weather_backend, metrics)
+
+    # Biosamples returned by several agents' queries are resolved once
+    accession_index = None
+    if reuse_accessions:
+        accession_index = AccessionIndex(
+            os.path.join(local_outpath, "accessions.sqlite"), config, code
+        )
+
+    # Uploads reuse one storage client and overlap with the next agent
+    uploader = Uploader(
+        get_storage_backend(storage), max_workers=uploads, metrics=metrics
+    )
+    pending = []
+
+    # One long-lived pool of workers for the whole flow run. Downloads
+    # stop when the flow does, even if it fails.
+    downloads = record_stream if record_stream is not None else nullcontext()
+    with uploader, downloads, concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers or default_workers()
+    ) as executor:
+        for term in terms:
+            filename = term.replace(" ", "_")
+            data = []
+
+            if record_stream is not None:
+                # Records arrive while the agent is still downloading
+                data = record_stream.records(term)
+                print(f"INFO: Cleaning {filename}")
+            elif term not in fetched:
+                # Raw data left by an earlier run is not current, skip the agent
+                print(f"ERROR: Fetching {filename} failed. Skipping..")
+                metrics.count("agents", status="failed")
+                continue
+            else:
+                # Stream records from raw_data/<agent>.tsv or .tsv.gz
+                file = find_raw_file(local_inpath, filename)
+                input_hash = hash_file(file) if file is not None else None
+
+                if incremental and manifest.is_current(
+                    filename, input_hash, code, config
+                ):
+                    print(f"INFO: {filename} is unchanged. Skipping..")
+                    metrics.count("agents", status="unchanged")
+                    continue
+
+                if file is not None:
+                    data = read_records(file)
+
+                    print(f"INFO: Cleaning {filename}")
+
+            transform_args = (
+                filename,
+                regions,
+                countries,
+                station_resolver,
+                weather_backend,
+                executor,
+                frequency,
+                columnar,
+                batch,
+                metrics,
+                accession_index,
+            )
+            try:
+                with section("transform_records", sampled=True):
+                    if bounded_memory:
+                        # Chunks are transformed while the writer consumes them
+                        index, rows = write_local_chunks(
+                            transform_chunks(data, *transform_args),
+                            filename,
+                            local_outpath,
+                            metrics,
+                        )
+                    else:
+                        df = transform_records(data, *transform_args)
+                        rows = len(df)
+                        if accession_index is not None:
+                            accession_index.set_members(
+                                filename, df["Biosample"].unique()
+                            )
+            except EutilsError as e:
+                print(f"ERROR: Fetching {filename} failed: {e}")
+                metrics.count("agents", status="failed")
+                continue
+
+            if record_stream is not None:
+                file = record_stream.raw_path(term)
+                input_hash = hash_file(file)
+
+            print(f"INFO: Length of df = {rows}")
+            print(f"INFO: Station cache = {station_resolver.stats()}")
+            station_resolver.save()
+            metrics.count("agents", status="processed")
+            metrics.count("rows_written", rows, agent=filename)
+
+            # Write df to local area
+            if not bounded_memory:
+                index = write_local(df, filename, local_outpath, metrics)
+
+            # Write files in outpath to Google Cloud Storage (GCS)
+            upload = write_gcs(filename, local_outpath, gcs_path, uploader)
+            pending.append((filename, input_hash, index, upload))
+
+        # Which agents each biosample belongs to, for the warehouse
+        if accession_index is not None:
+            membership = os.path.join(local_outpath, "agent_membership.parquet")
+            links = accession_index.export_memberships(membership)
+            print(f"INFO: {links} agent memberships, index {accession_index.stats()}")
+            membership_upload = uploader.submit(
+                membership, f"{gcs_path}/agent_membership.parquet"
+            )
+
+    # Only agents that reached storage are recorded, failed ones are rebuilt next run
+    failed = []
+    for filename, input_hash, index, upload in pending:
+        if upload.exception() is not None:
+            print(f"ERROR: Upload of {filename} failed: {upload.exception()}")
+            failed.append(filename)
+            continue
+
+        manifest.record(filename, input_hash, code, config, index)
+
+    if accession_index is not None:
+        if membership_upload.exception() is not None:
+            print(
+                f"ERROR: Upload of memberships failed: {membership_upload.exception()}"
+            )
+            failed.append("agent_membership")
+        for name, value in accession_index.stats().items():
+            metrics.gauge(f"accession_index_{name}", value)
+        accession_index.close()
+
+    print(f"INFO: Uploaded {uploader.uploaded}, unchanged {uploader.skipped}.")
+
+    metrics.count("uploads", uploader.uploaded, status="uploaded")
+    metrics.count("uploads", uploader.skipped, status="unchanged")
+    for name, value in station_resolver.stats().items():
+        metrics.gauge(f"station_cache_{name}", value)
+    metrics.export(
+        os.path.join(local_outpath, "metrics"),
+        flow_run.name or "fetch_and_transform",
+        artifact_key="fetch-and-transform-metrics",
+    )
+    if profiler is not None:
+        profiler.export(
+            flow_run.name or "fetch_and_transform",
+            artifact_key="fetch-and-transform-profile",
+        )
+        stop_profiling()
 
-        # Write files in outpath to Google Cloud Storage (GCS)
-        write_gcs(filename, local_outpath, gcs_path)
+    if failed:
+        raise RuntimeError(f"Uploads failed for {', '.join(failed)}.")
 
 
 if __name__ == "__main__":
@@ -1,18 +1,55 @@
 #!/usr/bin/env python3
 
 """
-This script is essentially a wrapper script
-for run_flow.sh to import in deploy.py
+This script fetches the biosamples of every agent in
+agents_list.txt into raw_data with the E-utilities
+client, to import in deploy.py
 """
 
-import subprocess
+import os
+import sys
+import time
+import asyncio
 
+from eutils import EUTILS_URL, fetch_agents
 
-def fetch_data(api_key):
-    process = subprocess.call(
-        ["run_flow.sh", api_key],
-        shell=True,
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+def fetch_data(
+    api_key, infile="agents_list.txt", outdir="raw_data", base_url=EUTILS_URL
+):
+    """
+    :param api_key: NCBI API key or "NULL" to use the lower rate limit
+    :param infile: File with one agent per line
+    :param outdir: Directory of raw .tsv files
+    :param base_url: URL of the E-utilities
+    :return: Dictionary of agent -> number of biosamples
+    """
+    os.makedirs(outdir, exist_ok=True)
+    os.makedirs("clean_data", exist_ok=True)
+
+    with open(infile) as f:
+        terms = [line.strip() for line in f if line.strip()]
+
+    # More agents at once with an API key, the rate limit is shared either way
+    api_key = None if api_key in (None, "", "NULL") else api_key
+    concurrency = 8 if api_key else 3
+
+    start = time.perf_counter()
+    results = asyncio.run(
+        fetch_agents(terms, outdir, api_key, base_url, concurrency=concurrency)
     )
+    print(f"INFO: Time to fetch biosamples: {time.perf_counter() - start:.0f}s")
+
+    failed = {term: e for term, e in results.items() if isinstance(e, Exception)}
+    for term, e in failed.items():
+        sys.stderr.write(f"ERROR: Fetching {term} failed: {e}\n")
+
+    return {term: count for term, count in results.items() if term not in failed}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+"""
+This script maps raw geographic locations of biosamples,
+e.g. "USA: Texas, Galveston", to alpha-2 country and
+region codes. Names are normalized once into lookup
+tables with aliases, and every distinct location string
+is only resolved once.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import difflib
+import argparse
+import threading
+import unicodedata
+
+from collections import Counter, OrderedDict
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+# Common and historical names that are not in countries.json
+COUNTRY_ALIASES = {
+    "USA": "US",
+    "US": "US",
+    "UNITED STATES": "US",
+    "AMERICA": "US",
+    "UK": "GB",
+    "GREAT BRITAIN": "GB",
+    "BRITAIN": "GB",
+    "ENGLAND": "GB",
+    "SCOTLAND": "GB",
+    "WALES": "GB",
+    "NORTHERN IRELAND": "GB",
+    "RUSSIA": "RU",
+    "SOUTH KOREA": "KR",
+    "KOREA": "KR",
+    "NORTH KOREA": "KP",
+    "TANZANIA": "TZ",
+    "ZAIRE": "CD",
+    "DEMOCRATIC REPUBLIC OF THE CONGO": "CD",
+    "DR CONGO": "CD",
+    "DRC": "CD",
+    "REPUBLIC OF THE CONGO": "CG",
+    "CZECH REPUBLIC": "CZ",
+    "SYRIA": "SY",
+    "VIETNAM": "VN",
+    "LAOS": "LA",
+    "BURMA": "MM",
+    "IVORY COAST": "CI",
+    "CAPE VERDE": "CV",
+    "SWAZILAND": "SZ",
+    "EAST TIMOR": "TL",
+    "BRUNEI": "BN",
+    "MACEDONIA": "MK",
+    "NORTH MACEDONIA": "MK",
+    "TURKIYE": "TR",
+    "HOLLAND": "NL",
+    "THE NETHERLANDS": "NL",
+    "PALESTINE": "PS",
+    "MOLDOVA": "MD",
+    "PORTO RICO": "PR",
+    "VIRGIN ISLANDS": "VI",
+    "JAVA": "ID",
+}
+
+# Values that mean the location was not recorded
+MISSING_LOCATIONS = {
+    "",
+    "MISSING",
+    "MISSSING",
+    "NOT APPLICABLE",
+    "NOT COLLECTED",
+    "NOT PROVIDED",
+    "NOT AVAILABLE",
+    "NOT STATED",
+    "UNKNOWN",
+    "NONE",
+    "NA",
+    "N A",
+}
+
+
+def normalize(name):
+    """
+    Normalize a place name for lookups: accents, punctuation and
+    parenthesized or bracketed text are removed, whitespace collapsed
+    and letters uppercased, e.g. " Göttingen (Lower Saxony)" -> "GOTTINGEN".
+
+    :param name: Place name
+    :return: Normalized name
+    """
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    name = re.sub(r"[\(\[].*?[\)\]]", " ", name)
+    name = re.sub(r"[^\w]+", " ", name.upper().replace("&", " AND "))
+    return " ".join(name.replace("_", " ").split())
+
+
+class Gazetteer:
+    """
+    Lookup tables of normalized country names and of the region names of
+    each country, with a thread-safe LRU memo of resolved location strings.
+    """
+
+    # Gazetteers of the countries/regions dictionaries in use, see for_tables
+    _tables = {}
+    _tables_lock = threading.Lock()
+
+    def __init__(
+        self, countries, regions, aliases=COUNTRY_ALIASES, fuzzy=False, maxsize=65536
+    ):
+        """
+        :param countries: Dictionary of country names and their alpha-2 code
+        :param regions: Dictionary of country alpha-2 code -> dictionary of
+            region names and their abbreviation
+        :param aliases: Dictionary of other country names and their alpha-2 code
+        :param fuzzy: Match misspelled names to the closest known name
+        :param maxsize: Maximum number of location strings to memoize
+        """
+        self.fuzzy = fuzzy
+        self.maxsize = maxsize
+
+        self.countries = {}
+        for name, code in countries.items():
+            self.countries[normalize(name)] = code
+            # "TANZANIA, UNITED REPUBLIC OF" is also known as "TANZANIA"
+            if "," in name:
+                self.countries.setdefault(normalize(name.split(",", 1)[0]), code)
+        for name, code in aliases.items():
+            self.countries.setdefault(normalize(name), code)
+
+        self.regions = {
+            country: {normalize(name): code for name, code in names.items()}
+            for country, names in regions.items()
+        }
+
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_tables(cls, countries, regions):
+        """
+        Return one shared Gazetteer per pair of dictionaries, so callers that
+        pass the dictionaries around do not rebuild it for every biosample.
+
+        :return: Gazetteer
+        """
+        key = (id(countries), id(regions))
+        with cls._tables_lock:
+            if key not in cls._tables:
+                # The dictionaries are kept so their ids are not reused
+                cls._tables[key] = (countries, regions, cls(countries, regions))
+            return cls._tables[key][2]
+
+    def _lookup(self, table, name):
+        code = table.get(name)
+        if code is None and self.fuzzy and len(name) > 3:
+            matches = difflib.get_close_matches(name, table.keys(), n=1, cutoff=0.88)
+            code = table[matches[0]] if matches else None
+        return code
+
+    def country(self, name):
+        """
+        :param name: Country name
+        :return: Alpha-2 code or "" if unknown
+        """
+        name = normalize(name)
+        if name in MISSING_LOCATIONS:
+            return ""
+        return self._lookup(self.countries, name) or ""
+
+    def region(self, name, country_code):
+        """
+        :param name: Region name
+        :param country_code: Alpha-2 code of the country the region is in
+        :return: Abbreviation or "" if unknown in that country
+        """
+        name = normalize(name)
+        if name in MISSING_LOCATIONS:
+            return ""
+        return self._lookup(self.regions.get(country_code, {}), name) or ""
+
+    def _resolve(self, location):
+        country, separator, rest = location.partition(":")
+
+        if separator:
+            parts = rest.split(":", 1)[0].split(",")
+            country_code = self.country(country)
+        else:
+            # No "country: region", e.g. "Newry, Northern Ireland"
+            parts = location.split(",")
+            country_code = ""
+            for i in (0, len(parts) - 1):
+                country_code = self.country(parts[i])
+                if country_code:
+                    parts = parts[:i] + parts[i + 1 :]
+                    break
+
+        if not country_code:
+            return "", ""
+
+        # The first part that is a known region, usually the first one
+        for part in parts:
+            region_code = self.region(part, country_code)
+            if region_code:
+                return country_code, region_code
+        return country_code, ""
+
+    def resolve(self, location):
+        """
+        Resolve a geographic location, e.g. "USA: Texas, Galveston".
+
+        :param location: Value of the geographic location attribute
+        :return: Tuple of country and region code, "" where unknown
+        """
+        with self._lock:
+            resolved = self._memo.get(location)
+            if resolved is not None:
+                self._memo.move_to_end(location)
+                self.hits += 1
+                return resolved
+            self.misses += 1
+
+        resolved = self._resolve(location)
+
+        with self._lock:
+            self._memo[location] = resolved
+            self._memo.move_to_end(location)
+            while len(self._memo) > self.maxsize:
+                self._memo.popitem(last=False)
+        return resolved
+
+    def clear(self):
+        """
+        Forget every resolved location and reset the hit/miss counters.
+        """
+        with self._lock:
+            self._memo.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        :return: Dictionary of memo hits, misses, hit rate and size
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "size": len(self._memo),
+            }
+
+
+def load_gazetteer(fuzzy=False):
+    """
+    :param fuzzy: Match misspelled names to the closest known name
+    :return: Gazetteer of countries.json and regions.json
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(directory, "countries.json")) as f:
+        countries = json.load(f)
+    with open(os.path.join(directory, "regions.json")) as f:
+        regions = json.load(f)
+    return Gazetteer(countries, regions, fuzzy=fuzzy)
+
+
+def main():
+    """
+    Report resolver throughput and how many biosample locations of a
+    raw data directory are mapped to a country and a region.
+    """
+    from record_reader import read_records
+    from biosample_parser import parse_record
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--data", default="data/raw_data", help="Raw data directory")
+    parser.add_argument(
+        "--fuzzy", action="store_true", help="Match misspelled names too"
+    )
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data):
+        sys.stderr.write(f"ERROR: {args.data} does not exist.\n")
+        sys.exit(1)
+
+    locations = []
+    for name in sorted(os.listdir(args.data)):
+        for record in read_records(os.path.join(args.data, name)):
+            location = parse_record(record, ["geographic location"]).attributes.get(
+                "geographic location"
+            )
+            if location:
+                locations.append(location)
+
+    started = time.perf_counter()
+    gazetteer = load_gazetteer(args.fuzzy)
+    print(f"INFO: Built gazetteer in {time.perf_counter() - started:.3f}s.")
+
+    started = time.perf_counter()
+    resolved = [gazetteer.resolve(location) for location in locations]
+    seconds = time.perf_counter() - started
+
+    counts = Counter(
+        "region" if region else "country" if country else "unmapped"
+        for country, region in resolved
+    )
+    total = len(locations)
+    print(
+        f"INFO: Resolved {total} locations ({len(set(locations))} distinct) "
+        f"in {seconds:.3f}s, {total / seconds:,.0f} locations/s."
+    )
+    print(f"INFO: Memo {gazetteer.stats()}")
+    print(
+        f"INFO: Country and region {counts['region'] / total:.1%}, "
+        f"country only {counts['country'] / total:.1%}, "
+        f"unmapped {counts['unmapped'] / total:.1%}."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,13 +7,16 @@ downloads, transforms, and uploads to BigQuery.
 
 import os
 import sys
-import pandas as pd
-import pandas_gbq
 
-from pathlib import Path
+from contextlib import nullcontext
+from collections import deque
 from prefect import flow, task
-from prefect_gcp import GcpCredentials
-from prefect_gcp.cloud_storage import GcsBucket
+from prefect.runtime import flow_run
+from metrics import Metrics
+from profiling import profiled, start_profiling, stop_profiling
+from parquet_dataset import count_rows, download_agent, iter_frames
+from storage_backends import get_storage_backend
+from warehouse_sinks import COLUMNS, get_warehouse_sink
 from scrape_agents_webpage import scrape_agents_webpage
 
 
@@ -23,109 +26,218 @@ __version__ = "1.0.0"
 
 
 @task(retries=3, log_prints=True)
-def extract_from_gcs(filename, local_path, gcs_path):
+@profiled
+def extract_from_gcs(
+    filename, local_path, gcs_path, storage, watermark=None, metrics=None
+):
     """
-    Download data from GCS.
-
-    :return: Local path
+    Download an agent's partitions from GCS. Partitions that are already
+    downloaded with the same contents are not downloaded again.
+
+    :param filename: Agent name with spaces replaced by underscores
+    :param storage: StorageBackend shared by every download
+    :param watermark: Content hash of the agent's index when it was last loaded
+    :param metrics: Optional Metrics that download latencies are observed in
+    :return: (local paths, content hash), the paths are None if the agent
+        does not exist or is unchanged since it was loaded
     """
-    print(f"INFO: Extracting {filename} from GCS.")
-
-    file_gcs_path = f"{gcs_path}/{filename}"
-    gcs_bucket = GcsBucket.load("gcs-agents-precip")
-    gcs_bucket.get_directory(from_path=file_gcs_path, local_path=local_path)
+    with metrics.timer("extract_from_gcs") if metrics else nullcontext():
+        paths, checksum = download_agent(
+            storage, gcs_path, local_path, filename, watermark
+        )
 
-    return Path(f"{local_path}/{file_gcs_path}")
+    if checksum is None:
+        print(f"INFO: {filename} is not in GCS. Skipping..")
+    elif paths is None:
+        print(f"INFO: {filename} is already loaded. Skipping..")
+    else:
+        print(f"INFO: Extracted {filename} from GCS.")
+    return paths, checksum
 
 
 @task(log_prints=True)
-def transform_data(path, filename):
+@profiled
+def transform_data(df):
     """
-    Read parquet data, clean, and return dataframe.
+    Clean a batch of rows.
 
     :return: Pandas dataframe
     """
-    if os.path.isfile(path) and os.path.getsize(path) > 0:
-        print(f"INFO: Transforming {filename}")
-        df = pd.read_parquet(path)
-
-        print(
-            f"INFO: PRE - Missing precipitation count: {df['Precipitation'].isna().sum()}"
-        )
+    print(
+        f"INFO: PRE - Missing precipitation count: {df['Precipitation'].isna().sum()}"
+    )
 
-        df["Precipitation"].fillna(0, inplace=True)
+    df["Precipitation"] = df["Precipitation"].fillna(0)
 
-        print(
-            f"INFO: POST - Missing precipitation count: {df['Precipitation'].isna().sum()}"
-        )
-        return df
-    else:
-        print(f"INFO: {filename} is empty. Skipping..")
+    print(
+        f"INFO: POST - Missing precipitation count: {df['Precipitation'].isna().sum()}"
+    )
+    return df
 
 
 @task(log_prints=True)
-def write_to_bq(df):
+@profiled
+def write_to_bq(df, sink, metrics=None):
     """
-    Write dataframe to BigQuery.
+    Write dataframe to the BigQuery staging table.
+
+    :param sink: WarehouseSink that the rows are staged in
     """
     print("INFO: Writing file to BigQuery.")
-    gcp_credentials = GcpCredentials.load("gcp-agents-creds")
-    pandas_gbq.to_gbq(
-        df,
-        destination_table="agents.agents_and_precip",
-        project_id="agents-and-precipitation",
-        credentials=gcp_credentials.get_credentials_from_service_account(),
-        chunksize=500_000,
-        if_exists="append",
-    )
+    with metrics.timer("write_to_bq") if metrics else nullcontext():
+        sink.load(df)
+
+
+@task(log_prints=True)
+@profiled
+def merge_into_bq(sink, watermarks, metrics=None):
+    """
+    Merge the staging table into agents.agents_and_precip.
+
+    :param watermarks: Dictionary of agent -> content hash of every staged agent
+    """
+    print(f"INFO: Merging {len(watermarks)} agents into BigQuery.")
+    with metrics.timer("merge_into_bq") if metrics else nullcontext():
+        sink.merge(watermarks)
 
 
 @flow(log_prints=True)
-def gcs_to_bq(start, end):
+def gcs_to_bq(
+    start,
+    end,
+    downloads=8,
+    batch_size=500_000,
+    storage="gcs",
+    warehouse="bigquery",
+    incremental=True,
+    profile=False,
+):
     """
     Entry point on the script that extracts data
     from GCS and then uploads to BigQuery.
+
+    :param downloads: Number of concurrent downloads
+    :param batch_size: Rows read into memory and written to BigQuery at once
+    :param storage: "gcs" for the GCS bucket or "local" for storage/
+    :param warehouse: "bigquery" for load jobs into agents.agents_and_precip
+        or "sqlite" for gcs_data/warehouse.sqlite
+    :param incremental: Skip agents whose file is unchanged since it was last
+        loaded, otherwise every agent is merged again
+    :param profile: Profile every task with cProfile. Dumps are written to
+        gcs_data/profiles/<flow run> and the hotspots published as an artifact.
     """
     # Set params
     infile = "agents_list.txt"
     local_path = "gcs_data"
     gcs_path = "data"
 
+    profiler = None
+    if profile:
+        profiler = start_profiling(os.path.join(local_path, "profiles"))
+
     # Scrape agent's webpage again
     scrape_agents_webpage(start, end)
 
     if not os.path.exists(local_path):
         os.makedirs(local_path)
 
-    # Create empty dataframe_list to append dataframes to
-    dataframe_list = []
+    filenames = []
 
-    # Loop over infile list
+    # Read infile list
     with open(infile) as f:
-        lines = f.readlines()
-
-        for filename in lines:
+        for filename in f.readlines():
             filename = filename.strip().replace(" ", "_")
 
             # Try to catch errors
-            if "." in filename:
-                if not filename.endswith(".parquet.gz"):
-                    sys.stderr.write("ERROR: Filename does not end with '.parquet.gz'.")
-                    sys.exit(1)
-            elif not "." in filename:
-                filename = filename + ".parquet.gz"
+            if "/" in filename or filename.startswith("."):
+                sys.stderr.write(f"ERROR: '{filename}' is not an agent name.")
+                sys.exit(1)
+
+            filenames.append(filename)
+
+    # Storage client is created once and shared by every download
+    storage_backend = get_storage_backend(storage)
+
+    sink = get_warehouse_sink(warehouse, os.path.join(local_path, "warehouse.sqlite"))
+    loaded = sink.watermarks() if incremental else {}
+
+    # Counters and latencies of this flow run, exported when it finishes
+    metrics = Metrics()
+
+    # Download concurrently, at most `downloads` at once
+    paths = []
+    changed = {}
+    skipped = []
+    in_flight = deque()
+
+    def collect(filename, future):
+        agent_paths, checksum = future.result()
+
+        if agent_paths is None:
+            status = "missing" if checksum is None else "unchanged"
+        else:
+            # Changed agents are merged even if empty, so their old rows are deleted
+            changed[filename] = checksum
+            status = "loaded" if any(map(count_rows, agent_paths)) else "empty"
+
+        metrics.count("files", status=status)
+        if status == "loaded":
+            paths.extend(map(str, agent_paths))
+        else:
+            if status == "empty":
+                print(f"INFO: {filename} is empty. Skipping..")
+            skipped.append(filename)
+
+    for filename in filenames:
+        if len(in_flight) >= downloads:
+            collect(*in_flight.popleft())
+        in_flight.append(
+            (
+                filename,
+                extract_from_gcs.submit(
+                    filename,
+                    local_path,
+                    gcs_path,
+                    storage_backend,
+                    loaded.get(filename),
+                    metrics,
+                ),
+            )
+        )
+    while in_flight:
+        collect(*in_flight.popleft())
 
-            # ETL process
-            path = extract_from_gcs(filename, local_path, gcs_path)
-            df = transform_data(path, filename)
-            dataframe_list.append(df)
+    print(
+        f"INFO: {len(paths)} partitions to load, "
+        f"{len(skipped)} agents empty, missing or already loaded."
+    )
 
-    print(f"INFO: df list = {len(dataframe_list)}")
+    if changed:
+        # Merge files batch by batch instead of concatenating everything in memory
+        sink.begin()
+        # Only the columns the warehouse stores are read from the files
+        for df in iter_frames(paths, batch_size, columns=COLUMNS):
+            df = transform_data(df)
+            write_to_bq(df, sink, metrics)
 
-    merged_df = pd.concat(dataframe_list)
+        merge_into_bq(sink, changed, metrics)
 
-    print(f"INFO: Dataframe is of length {len(merged_df)}")
-    write_to_bq(merged_df)
+        print(f"INFO: Dataframe is of length {sink.rows}")
+        print(f"INFO: Load throughput = {sink.throughput()}")
+    else:
+        print("INFO: No agents changed since the last load.")
+
+    metrics.count("rows_loaded", sink.rows)
+    for name, value in sink.throughput().items():
+        metrics.gauge(f"load_{name}", value)
+    metrics.export(
+        os.path.join(local_path, "metrics"),
+        flow_run.name or "gcs_to_bq",
+        artifact_key="gcs-to-bq-metrics",
+    )
+    if profiler is not None:
+        profiler.export(flow_run.name or "gcs_to_bq", artifact_key="gcs-to-bq-profile")
+        stop_profiling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""
+This script keeps a manifest of which raw files, code
+and settings produced each agent's output so unchanged
+agents can be skipped on the next run.
+"""
+
+import os
+import json
+import hashlib
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    :param path: Path to file
+    :return: SHA-256 hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Scripts and lookup tables that determine the transform output
+TRANSFORM_FILES = [
+    "accession_index.py",
+    "agent_transform.py",
+    "biosample_parser.py",
+    "columnar_transform.py",
+    "gazetteer.py",
+    "parquet_dataset.py",
+    "precipitation.py",
+    "record_reader.py",
+    "station_cache.py",
+    "station_index.py",
+    "weather_backends.py",
+    "countries.json",
+    "regions.json",
+]
+
+
+def code_version(directory=None, files=TRANSFORM_FILES):
+    """
+    Hash the scripts and lookup tables that the transform output depends
+    on, so a change to the parsing code, countries.json or regions.json
+    rebuilds agents, but a change to e.g. the flows or deploy.py does not.
+
+    :param directory: Directory of scripts, defaults to this script's directory
+    :param files: Names of the files in directory, missing ones are skipped
+    :return: SHA-256 hex digest
+    """
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+
+    digest = hashlib.sha256()
+    for name in files:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            digest.update(name.encode())
+            digest.update(hash_file(path).encode())
+    return digest.hexdigest()
+
+
+def config_version(config):
+    """
+    :param config: Dictionary of settings that change the output
+    :return: SHA-256 hex digest of the settings
+    """
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class Manifest:
+    """
+    JSON manifest of agent -> input hash, code version, config version and output.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path to manifest, e.g. clean_data/manifest.json
+        """
+        self.path = path
+        self.agents = {}
+
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.agents = json.load(f).get("agents", {})
+
+    def is_current(self, agent, input_hash, code, config):
+        """
+        Check if an agent was already built from the same input, code and config
+        and its output still exists.
+
+        :return: True if the agent can be skipped
+        """
+        entry = self.agents.get(agent)
+        if entry is None:
+            return False
+
+        return (
+            entry["input_hash"] == input_hash
+            and entry["code_version"] == code
+            and entry["config_version"] == config
+            and os.path.exists(entry["output"])
+        )
+
+    def record(self, agent, input_hash, code, config, output):
+        """
+        Record that an agent was built and save the manifest.
+        """
+        self.agents[agent] = {
+            "input_hash": input_hash,
+            "code_version": code,
+            "config_version": config,
+            "output": output,
+        }
+        self.save()
+
+    def save(self):
+        """
+        Write the manifest atomically.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"agents": self.agents}, f, indent=4, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+"""
+This script collects counters, gauges and latency histograms
+of a flow run and exports them as JSON, as a Prefect
+artifact and in Prometheus text format.
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+
+from contextlib import contextmanager
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+# Upper bounds in seconds, from a cached lookup to a long upload
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts)),
+        }
+
+
+class Metrics:
+    """
+    Thread-safe registry of metrics, each identified by a name and labels.
+    """
+
+    def __init__(self, prefix="agents_precip"):
+        """
+        :param prefix: Prefix of metric names in Prometheus format
+        """
+        self.prefix = prefix
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, **labels):
+        """
+        Increase a counter, e.g. count("dropped", reason="missing_date").
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        """
+        Set a gauge to its current value, e.g. a cache hit rate.
+        """
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Add a latency in seconds to a histogram.
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe the time spent in a with block.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def to_dict(self):
+        """
+        :return: Dictionary of counters, gauges and histograms
+        """
+
+        def entries(metrics, value):
+            return [
+                {"name": name, "labels": dict(labels), **value(metric)}
+                for (name, labels), metric in sorted(metrics.items())
+            ]
+
+        with self._lock:
+            return {
+                "counters": entries(self.counters, lambda v: {"value": v}),
+                "gauges": entries(self.gauges, lambda v: {"value": v}),
+                "histograms": entries(self.histograms, Histogram.to_dict),
+            }
+
+    def merge(self, data):
+        """
+        Add metrics collected elsewhere, e.g. by a task on another worker.
+        Counters and histograms are summed, gauges are overwritten.
+
+        :param data: Dictionary from to_dict
+        """
+        with self._lock:
+            for entry in data["counters"]:
+                key = (entry["name"], _label_key(entry["labels"]))
+                self.counters[key] = self.counters.get(key, 0) + entry["value"]
+            for entry in data["gauges"]:
+                self.gauges[(entry["name"], _label_key(entry["labels"]))] = entry[
+                    "value"
+                ]
+            for entry in data["histograms"]:
+                key = (entry["name"], _label_key(entry["labels"]))
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+                histogram = self.histograms[key]
+                histogram.counts = [
+                    count + other
+                    for count, other in zip(histogram.counts, entry["buckets"].values())
+                ]
+                histogram.count += entry["count"]
+                histogram.sum += entry["sum"]
+
+    def to_prometheus(self):
+        """
+        :return: Metrics in Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for kind, metrics in [("counter", self.counters), ("gauge", self.gauges)]:
+                for name in sorted({name for name, _ in metrics}):
+                    metric = f"{self.prefix}_{name}"
+                    if kind == "counter":
+                        metric += "_total"
+                    lines.append(f"# TYPE {metric} {kind}")
+                    for (other, labels), value in sorted(metrics.items()):
+                        if other == name:
+                            lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+            for name in sorted({name for name, _ in self.histograms}):
+                metric = f"{self.prefix}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for (other, labels), histogram in sorted(self.histograms.items()):
+                    if other != name:
+                        continue
+                    cumulative = 0
+                    bounds = [*map(str, histogram.buckets), "+Inf"]
+                    for bound, count in zip(bounds, histogram.counts):
+                        cumulative += count
+                        lines.append(
+                            f"{metric}_bucket{_format_labels(labels, [('le', bound)])} "
+                            f"{cumulative}"
+                        )
+                    lines.append(
+                        f"{metric}_sum{_format_labels(labels)} {histogram.sum}"
+                    )
+                    lines.append(
+                        f"{metric}_count{_format_labels(labels)} {histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def export(self, directory, run_name, artifact_key=None):
+        """
+        Write <run_name>.json and <run_name>.prom to directory and publish
+        the JSON as a markdown artifact of the current flow run.
+
+        :param directory: Directory of metric files
+        :param run_name: Name of the flow run the metrics belong to
+        :param artifact_key: Key of the artifact, no artifact if None
+        :return: Path to the JSON file
+        """
+        os.makedirs(directory, exist_ok=True)
+        data = self.to_dict()
+
+        json_path = os.path.join(directory, f"{run_name}.json")
+        with open(json_path, "w") as f:
+            json.dump(data, f, indent=4)
+        with open(os.path.join(directory, f"{run_name}.prom"), "w") as f:
+            f.write(self.to_prometheus())
+
+        if artifact_key:
+            # Imported here, so runs without Prefect do not load it
+            from prefect.artifacts import create_markdown_artifact
+
+            create_markdown_artifact(
+                key=artifact_key,
+                markdown=f"```json\n{json.dumps(data, indent=2)}\n```",
+                description=f"Metrics of {run_name}",
+            )
+        return json_path
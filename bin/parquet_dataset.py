@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+
+"""
+This script writes each agent as a typed parquet dataset
+partitioned by agent and year, and streams many agents'
+files as one dataset in bounded batches, so merging them
+never holds more than one batch in memory.
+"""
+
+import os
+import json
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from storage_backends import md5_file
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+# Schema of written files. Agent, Country and region repeat a lot and are
+# dictionary encoded. Precipitation keeps double precision, so values read
+# back equal the ones that were written.
+OUTPUT_SCHEMA = pa.schema(
+    [
+        ("Biosample", pa.string()),
+        ("Agent", pa.dictionary(pa.int32(), pa.string())),
+        ("Date", pa.date32()),
+        ("Country", pa.dictionary(pa.int32(), pa.string())),
+        ("region", pa.dictionary(pa.int32(), pa.string())),
+        ("Precipitation", pa.float64()),
+    ]
+)
+
+# Files are read with one schema and every file is cast to it
+SCHEMA = pa.schema(
+    [
+        ("Biosample", pa.string()),
+        ("Agent", pa.string()),
+        ("Date", pa.date32()),
+        ("Country", pa.string()),
+        ("region", pa.string()),
+        ("Precipitation", pa.float64()),
+    ]
+)
+
+# Partition keys of the dataset, e.g. agent=Ebola_virus/year=2014
+PARTITIONING = ds.partitioning(
+    pa.schema([("agent", pa.string()), ("year", pa.int32())]), flavor="hive"
+)
+
+# Name of a partition without a year, as written by Hive and Spark
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# About 2 MB per row group, small enough to skip by statistics
+ROW_GROUP_SIZE = 64_000
+
+# Bounded-memory writes flush a row group at whichever limit comes first
+FLUSH_ROWS = ROW_GROUP_SIZE
+FLUSH_BYTES = 32 * 1024 * 1024
+
+# Index of an agent's files, the only object readers have to check
+PARTITIONS_FILE = "_partitions.json"
+
+
+def to_table(df):
+    """
+    Convert a dataframe of transformed biosamples to OUTPUT_SCHEMA.
+    Dates are parsed as YYYY-MM-DD and precipitation as numbers,
+    anything else becomes null.
+
+    :param df: Dataframe with Biosample, Agent, Date, Country, region
+        and Precipitation columns
+    :return: pyarrow.Table
+    """
+    dates = pd.to_datetime(df["Date"], format="%Y-%m-%d", errors="coerce")
+    precipitation = pd.to_numeric(df["Precipitation"], errors="coerce")
+
+    def dictionary(column):
+        return pa.array(df[column], pa.string(), from_pandas=True).dictionary_encode()
+
+    return pa.Table.from_arrays(
+        [
+            pa.array(df["Biosample"], pa.string(), from_pandas=True),
+            dictionary("Agent"),
+            pa.array(dates, from_pandas=True).cast(pa.date32()),
+            dictionary("Country"),
+            dictionary("region"),
+            pa.array(precipitation, pa.float64(), from_pandas=True),
+        ],
+        schema=OUTPUT_SCHEMA,
+    )
+
+
+class DatasetWriter:
+    """
+    Writes one agent's rows to <root>/agent=<agent>/year=<year>/part-0.parquet
+    with zstd compression and column statistics. Every write appends row
+    groups to the open files, and close() replaces the agent's previous
+    partitions and writes the index of its files.
+    """
+
+    def __init__(self, root, agent, row_group_size=ROW_GROUP_SIZE):
+        """
+        :param root: Directory of the dataset, e.g. clean_data/dataset
+        :param agent: Agent name with spaces replaced by underscores
+        :param row_group_size: Maximum rows per row group
+        """
+        self.root = root
+        self.agent = agent
+        self.row_group_size = row_group_size
+        self.path = os.path.join(root, f"agent={agent}")
+        self.rows = 0
+
+        # Written next to the previous partitions, hidden from readers,
+        # and swapped in on close
+        self._tmp_path = os.path.join(root, f".agent={agent}.tmp")
+        shutil.rmtree(self._tmp_path, ignore_errors=True)
+        os.makedirs(self._tmp_path)
+        self._writers = {}
+        self._rows = {}
+
+    def _writer(self, year):
+        if year not in self._writers:
+            directory = os.path.join(self._tmp_path, f"year={year}")
+            os.makedirs(directory)
+            self._writers[year] = pq.ParquetWriter(
+                os.path.join(directory, "part-0.parquet"),
+                OUTPUT_SCHEMA,
+                compression="zstd",
+                write_statistics=True,
+            )
+        return self._writers[year]
+
+    def write(self, df):
+        """
+        Append a dataframe as row groups of its years' files.
+        """
+        table = to_table(df)
+        if table.num_rows == 0:
+            return
+
+        years = pc.year(table["Date"])
+        for year in pc.unique(years).to_pylist():
+            if year is None:
+                rows = table.filter(pc.is_null(years))
+                year = NULL_PARTITION
+            else:
+                rows = table.filter(pc.equal(years, year))
+            self._writer(year).write_table(rows, row_group_size=self.row_group_size)
+            self._rows[year] = self._rows.get(year, 0) + rows.num_rows
+
+        self.rows += table.num_rows
+
+    def close(self):
+        """
+        Close the files and replace the agent's previous partitions.
+
+        :return: Path to the index of the agent's files
+        """
+        for writer in self._writers.values():
+            writer.close()
+
+        files = []
+        for year in sorted(self._writers, key=str):
+            path = f"year={year}/part-0.parquet"
+            full_path = os.path.join(self._tmp_path, path)
+            files.append(
+                {
+                    "path": path,
+                    "rows": self._rows[year],
+                    "md5": md5_file(full_path),
+                }
+            )
+
+        with open(os.path.join(self._tmp_path, PARTITIONS_FILE), "w") as f:
+            json.dump({"agent": self.agent, "files": files}, f, indent=4)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self._tmp_path, self.path)
+        return os.path.join(self.path, PARTITIONS_FILE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            for writer in self._writers.values():
+                writer.close()
+            shutil.rmtree(self._tmp_path, ignore_errors=True)
+
+
+class ChunkedWriter(DatasetWriter):
+    """
+    DatasetWriter for agents that arrive in small dataframes. They are
+    buffered and flushed as row groups every max_rows rows or max_bytes
+    bytes of buffered dataframes, so an agent of any size is written
+    with bounded memory.
+    """
+
+    def __init__(self, root, agent, max_rows=FLUSH_ROWS, max_bytes=FLUSH_BYTES):
+        """
+        :param root: Directory of the dataset, e.g. clean_data/dataset
+        :param agent: Agent name with spaces replaced by underscores
+        :param max_rows: Buffered rows that trigger a flush
+        :param max_bytes: Buffered bytes that trigger a flush
+        """
+        super().__init__(root, agent, row_group_size=max_rows)
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.flushes = 0
+        self._buffer = []
+        self._buffered_rows = 0
+        self._buffered_bytes = 0
+
+    def write(self, df):
+        """
+        Buffer a dataframe and flush the buffer once it is full.
+        """
+        if df.empty:
+            return
+
+        self._buffer.append(df)
+        self._buffered_rows += len(df)
+        self._buffered_bytes += int(df.memory_usage(index=False, deep=True).sum())
+        if (
+            self._buffered_rows >= self.max_rows
+            or self._buffered_bytes >= self.max_bytes
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Append the buffered dataframes as row groups.
+        """
+        if not self._buffer:
+            return
+
+        super().write(pd.concat(self._buffer, ignore_index=True))
+        self.flushes += 1
+        self._buffer = []
+        self._buffered_rows = 0
+        self._buffered_bytes = 0
+
+    def close(self):
+        self.flush()
+        return super().close()
+
+
+def write_agent(df, root, agent, row_group_size=ROW_GROUP_SIZE):
+    """
+    Write a dataframe as the agent's partitions.
+
+    :return: Path to the index of the agent's files
+    """
+    writer = DatasetWriter(root, agent, row_group_size)
+    with writer:
+        writer.write(df)
+    return os.path.join(writer.path, PARTITIONS_FILE)
+
+
+def read_partitions(path):
+    """
+    :param path: Path to an agent's index of files
+    :return: List of dictionaries with path, rows and md5 of each file
+    """
+    with open(path) as f:
+        return json.load(f)["files"]
+
+
+def upload_agent(uploader, local_root, remote_root, agent):
+    """
+    Queue upload of an agent's parquet files. The index of the agent's
+    files is uploaded once all of them are uploaded.
+
+    :param uploader: storage_backends.Uploader
+    :param local_root: Directory of the dataset, e.g. clean_data/dataset
+    :param remote_root: Path of the dataset in storage, e.g. data
+    :param agent: Agent name with spaces replaced by underscores
+    :return: Future of the index upload
+    """
+    local_path = os.path.join(local_root, f"agent={agent}")
+    remote_path = f"{remote_root}/agent={agent}"
+
+    index = os.path.join(local_path, PARTITIONS_FILE)
+    parts = [
+        uploader.submit(
+            os.path.join(local_path, part["path"]), f"{remote_path}/{part['path']}"
+        )
+        for part in read_partitions(index)
+    ]
+    return uploader.submit(index, f"{remote_path}/{PARTITIONS_FILE}", after=parts)
+
+
+def download_agent(storage, remote_root, local_root, agent, watermark=None):
+    """
+    Download an agent's parquet files. Files that are already downloaded
+    with the same contents are not downloaded again.
+
+    :param storage: storage_backends.StorageBackend
+    :param remote_root: Path of the dataset in storage, e.g. data
+    :param local_root: Directory that storage paths are downloaded to
+    :param agent: Agent name with spaces replaced by underscores
+    :param watermark: Content hash of the agent's index when it was last loaded
+    :return: (local paths, content hash), the paths are None if the agent
+        does not exist or is unchanged since the watermark
+    """
+    remote_path = f"{remote_root}/agent={agent}"
+    index_path = f"{remote_path}/{PARTITIONS_FILE}"
+    checksum = storage.checksum(index_path)
+    if checksum is None or checksum == watermark:
+        return None, checksum
+
+    index = os.path.join(local_root, index_path)
+    storage.download(index_path, index)
+
+    paths = []
+    for part in read_partitions(index):
+        path = os.path.join(os.path.dirname(index), part["path"])
+        if not os.path.isfile(path) or md5_file(path) != part["md5"]:
+            storage.download(f"{remote_path}/{part['path']}", path)
+        paths.append(path)
+    return paths, checksum
+
+
+def count_rows(path):
+    """
+    :param path: Path to parquet file
+    :return: Number of rows or None if the file is missing, empty or unreadable
+    """
+    if not os.path.isfile(path) or os.path.getsize(path) == 0:
+        return None
+    try:
+        return pq.ParquetFile(path).metadata.num_rows
+    except pa.ArrowInvalid:
+        return None
+
+
+def iter_frames(paths, batch_size=500_000, schema=SCHEMA, filter=None, columns=None):
+    """
+    Read parquet files as one dataset and yield it in dataframes of
+    about batch_size rows. Small files are combined into one dataframe.
+    The filter and columns are pushed down to the files, so row groups
+    whose statistics do not match are skipped.
+
+    :param paths: List of parquet files
+    :param batch_size: Rows per dataframe
+    :param schema: Schema that every file is cast to
+    :param filter: Optional pyarrow.dataset expression, e.g.
+        ds.field("Date") >= datetime.date(2020, 1, 1)
+    :param columns: Optional list of columns to read
+    :return: Generator of dataframes
+    """
+    if not paths:
+        return
+
+    dataset = ds.dataset(paths, schema=schema, format="parquet")
+    if columns is not None:
+        schema = pa.schema([schema.field(column) for column in columns])
+
+    batches = []
+    rows = 0
+    for batch in dataset.to_batches(
+        batch_size=batch_size, filter=filter, columns=columns
+    ):
+        if batch.num_rows == 0:
+            continue
+
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= batch_size:
+            yield pa.Table.from_batches(batches, schema=schema).to_pandas()
+            batches = []
+            rows = 0
+
+    if batches:
+        yield pa.Table.from_batches(batches, schema=schema).to_pandas()
+
+
+def read_dataset(root, agents=None, years=None, columns=None, filter=None):
+    """
+    Read part of a dataset for local analysis. Only the partitions of
+    the given agents and years are opened.
+
+    :param root: Directory of the dataset, e.g. clean_data/dataset
+    :param agents: Optional list of agents, spaces replaced by underscores
+    :param years: Optional list of years
+    :param columns: Optional list of columns to read
+    :param filter: Optional pyarrow.dataset expression on the columns
+    :return: Dataframe
+    """
+    dataset = ds.dataset(
+        root,
+        schema=pa.unify_schemas([SCHEMA, PARTITIONING.schema]),
+        format="parquet",
+        partitioning=PARTITIONING,
+        # Unfinished writes and indexes are not part of the dataset
+        ignore_prefixes=[".", "_"],
+    )
+
+    expression = ds.scalar(True)
+    if agents is not None:
+        expression &= ds.field("agent").isin(agents)
+    if years is not None:
+        expression &= ds.field("year").isin(years)
+    if filter is not None:
+        expression &= filter
+
+    return dataset.to_table(
+        columns=columns or SCHEMA.names, filter=expression
+    ).to_pandas()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""
+This script adds precipitation to parsed biosamples in
+batches: one weather request per station covering all
+collection dates, joined back onto the rows with pandas.
+"""
+
+import pandas as pd
+
+from worker_pool import default_in_flight, map_ordered
+from weather_backends import MeteostatBackend
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+def fetch_station_precipitation(
+    station, start, end, frequency="monthly", weather_backend=None
+):
+    """
+    Fetch precipitation of one station for a range of dates.
+
+    :param station: Station from StationResolver
+    :param start: First collection date
+    :param end: Last collection date
+    :param frequency: "monthly" or "daily"
+    :param weather_backend: WeatherBackend, defaults to live meteostat
+    :return: Dataframe with Station, Period and Precipitation columns
+    """
+    if weather_backend is None:
+        weather_backend = MeteostatBackend()
+
+    data = weather_backend.precipitation(station, start, end, frequency)
+
+    if data.empty:
+        return pd.DataFrame(columns=["Station", "Period", "Precipitation"])
+
+    return pd.DataFrame(
+        {
+            "Station": station.id,
+            "Period": to_period(data.index, frequency),
+            "Precipitation": data["prcp"].values,
+        }
+    )
+
+
+def to_period(dates, frequency):
+    """
+    Truncate dates to the key weather data is joined on.
+
+    :param dates: DatetimeIndex or datetime Series
+    :param frequency: "monthly" or "daily"
+    :return: Timestamps of the first of the month or of the day
+    """
+    dates = pd.DatetimeIndex(dates)
+    if frequency == "monthly":
+        return dates.to_period("M").to_timestamp()
+    return dates.normalize()
+
+
+def add_precipitation(
+    df, station_resolver, frequency="monthly", executor=None, weather_backend=None
+):
+    """
+    Resolve candidate stations for every row, fetch precipitation once per
+    station for the min-max collection dates, and merge it onto the rows.
+    Rows without data at a station fall back to the next candidate station;
+    rows without a station or without weather data at all are dropped.
+
+    :param df: Dataframe with Biosample, Agent, Date, Country and region columns
+    :param station_resolver: StationResolver that memoizes weather stations
+    :param frequency: "monthly" or "daily"
+    :param executor: Optional executor to fetch stations concurrently
+    :param weather_backend: WeatherBackend, defaults to live meteostat
+    :return: Dataframe with an added Precipitation column
+    """
+    columns = list(df.columns) + ["Precipitation"]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    # Drop dates that cannot be matched with weather data
+    dates = pd.to_datetime(df["Date"], format="%Y-%m-%d", errors="coerce")
+    df = df[dates.notna()].assign(Period=to_period(dates[dates.notna()], frequency))
+    df = df.assign(Row=range(len(df)))
+
+    # Resolve each (country, region) pair once
+    pairs = df[["Country", "region"]].drop_duplicates()
+    candidates = {}
+    for country_abbrev, region_abbrev in pairs.itertuples(index=False):
+        stations = station_resolver.candidates(country_abbrev, region_abbrev)
+        if stations:
+            candidates[(country_abbrev, region_abbrev)] = stations
+
+    def fetch(args):
+        return fetch_station_precipitation(*args, frequency, weather_backend)
+
+    found = []
+    remaining = df
+    rank = 0
+    while not remaining.empty:
+        # Station of this rank for every pair that still has one
+        station_ids = pd.DataFrame(
+            [
+                (*pair, stations[rank].id, len(stations) == rank + 1)
+                for pair, stations in candidates.items()
+                if len(stations) > rank
+            ],
+            columns=["Country", "region", "Station", "Last"],
+        )
+        remaining = remaining.merge(station_ids, on=["Country", "region"])
+        if remaining.empty:
+            break
+
+        # One weather request per station
+        by_id = {
+            stations[rank].id: stations[rank]
+            for stations in candidates.values()
+            if len(stations) > rank
+        }
+        ranges = [
+            (by_id[station_id], group.min(), group.max())
+            for station_id, group in remaining.groupby("Station")["Period"]
+        ]
+        if executor is not None:
+            weather = list(map_ordered(executor, fetch, ranges, default_in_flight()))
+        else:
+            weather = [fetch(args) for args in ranges]
+
+        merged = remaining.merge(
+            pd.concat(weather, ignore_index=True),
+            on=["Station", "Period"],
+            how="left",
+            indicator=True,
+        )
+
+        # Keep rows with precipitation, or with a (empty) weather row at
+        # their last candidate like a single-station lookup would
+        keep = merged["Precipitation"].notna() | (
+            merged["Last"] & (merged["_merge"] == "both")
+        )
+        found.append(merged[keep])
+        remaining = merged[~keep & ~merged["Last"]].drop(
+            columns=["Station", "Last", "Precipitation", "_merge"]
+        )
+        rank += 1
+
+    if not found:
+        return pd.DataFrame(columns=columns)
+
+    df = pd.concat(found, ignore_index=True).sort_values("Row")
+    return df[columns].reset_index(drop=True)
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+
+"""
+This script profiles sections of a flow run, e.g. tasks
+and the per-biosample hot path, with cProfile, and long
+loops with a stack sampler. Hot paths are only profiled
+every Nth call, so profiling can stay on for a production
+run. Sections are dumped for pstats, snakeviz or flame
+graphs, and the slowest functions published as a summary.
+"""
+
+import os
+import sys
+import time
+import pstats
+import cProfile
+import functools
+import threading
+
+from collections import Counter
+from contextlib import contextmanager
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+# Every Nth call of a hot path is profiled
+SAMPLE_EVERY = 20
+
+# Seconds between stack samples of sampled sections
+SAMPLE_INTERVAL = 0.005
+
+# Functions that wait on other threads, left out of the hotspots
+IDLE = ("threading.py:", "of '_thread.lock'", "of '_thread.RLock'")
+
+# Profiler of the current flow run, see start_profiling
+_active = None
+# A thread is only profiled by its outermost section
+_local = threading.local()
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+class StackSampler:
+    """
+    Background thread that samples the stacks of registered threads, for
+    sections where tracing every call would slow the run down.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        # Section -> Counter of stacks, root first
+        self.stacks = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, name):
+        """
+        Sample the calling thread as part of a section until remove().
+        """
+        with self._lock:
+            self._threads[threading.get_ident()] = name
+            self.stacks.setdefault(name, Counter())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def remove(self):
+        with self._lock:
+            self._threads.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                # Stopped until the next section starts
+                if not self._threads:
+                    self._thread = None
+                    return
+                for ident, name in self._threads.items():
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_name(frame))
+                        frame = frame.f_back
+                    self.stacks[name][tuple(reversed(stack))] += 1
+
+    def functions(self, name):
+        """
+        :return: Dictionary of function -> (own samples, cumulative samples)
+        """
+        own = Counter()
+        cumulative = Counter()
+        with self._lock:
+            stacks = dict(self.stacks.get(name, {}))
+        for stack, count in stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack):
+                cumulative[function] += count
+        return {
+            function: (own[function], cumulative[function]) for function in cumulative
+        }
+
+    def dump(self, name, path):
+        """
+        Write a section's stacks in collapsed format for flame graphs.
+        """
+        with self._lock:
+            stacks = dict(self.stacks.get(name, {}))
+        with open(path, "w") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{';'.join(stack)} {count}\n")
+
+
+class Profiler:
+    """
+    Thread-safe collection of cProfile statistics and stack samples per
+    section.
+    """
+
+    def __init__(self, directory, interval=SAMPLE_INTERVAL):
+        """
+        :param directory: Directory of profile dumps
+        :param interval: Seconds between stack samples of sampled sections
+        """
+        self.directory = directory
+        # (Section, thread) -> cProfile.Profile, enabled for each profiled call
+        self.profiles = {}
+        self.calls = {}
+        self.profiled = {}
+        self.seconds = {}
+        self.sampler = StackSampler(interval)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def sample(self, name):
+        """
+        Sample the stack of this thread during the with block as part of
+        a section.
+        """
+        started = time.perf_counter()
+        self.sampler.add(name)
+        try:
+            yield
+        finally:
+            self.sampler.remove()
+            with self._lock:
+                self.calls[name] = self.calls.get(name, 0) + 1
+                self.profiled[name] = self.profiled.get(name, 0) + 1
+                self.seconds[name] = (
+                    self.seconds.get(name, 0) + time.perf_counter() - started
+                )
+
+    @contextmanager
+    def profile(self, name, sample_every=1):
+        """
+        Profile the with block as part of a section.
+
+        :param name: Section, e.g. a task name
+        :param sample_every: Profile every Nth entry of the section only
+        """
+        with self._lock:
+            call = self.calls.get(name, 0)
+            self.calls[name] = call + 1
+
+        # Another section of this thread already profiles the block
+        if call % sample_every or getattr(_local, "active", False):
+            yield
+            return
+
+        key = (name, threading.get_ident())
+        with self._lock:
+            profile = self.profiles.get(key)
+            if profile is None:
+                profile = self.profiles[key] = cProfile.Profile()
+
+        _local.active = True
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            _local.active = False
+            with self._lock:
+                self.profiled[name] = self.profiled.get(name, 0) + 1
+
+    def stats(self):
+        """
+        :return: Dictionary of profiled section -> pstats.Stats of all threads
+        """
+        stats = {}
+        with self._lock:
+            for (name, _), profile in self.profiles.items():
+                if name in stats:
+                    stats[name].add(profile)
+                else:
+                    stats[name] = pstats.Stats(profile)
+        return stats
+
+    def dump(self, run_name):
+        """
+        Write <directory>/<run_name>/<section>.prof for every profiled
+        section and <section>.folded for every sampled one.
+
+        :return: List of paths
+        """
+        directory = os.path.join(self.directory, run_name)
+        os.makedirs(directory, exist_ok=True)
+
+        paths = []
+        for name, stats in sorted(self.stats().items()):
+            path = os.path.join(directory, f"{name}.prof")
+            stats.dump_stats(path)
+            paths.append(path)
+        for name in sorted(self.sampler.stacks):
+            path = os.path.join(directory, f"{name}.folded")
+            self.sampler.dump(name, path)
+            paths.append(path)
+        return paths
+
+    def hotspots(self, limit=20):
+        """
+        :param limit: Number of functions
+        :return: List of dictionaries of the functions with the most own
+            time in any section, slowest first. Calls of sampled sections
+            are None, their times are estimated from the samples. Waiting
+            on other threads is left out.
+        """
+        rows = []
+        for name, stats in self.stats().items():
+            for (file, line, function), entry in stats.stats.items():
+                _, calls, own, cumulative, _ = entry
+                rows.append(
+                    {
+                        "section": name,
+                        "function": f"{os.path.basename(file)}:{line}({function})",
+                        "calls": calls,
+                        "own_s": round(own, 4),
+                        "cumulative_s": round(cumulative, 4),
+                    }
+                )
+        interval = self.sampler.interval
+        for name in list(self.sampler.stacks):
+            for function, (own, cumulative) in self.sampler.functions(name).items():
+                rows.append(
+                    {
+                        "section": name,
+                        "function": function,
+                        "calls": None,
+                        "own_s": round(own * interval, 4),
+                        "cumulative_s": round(cumulative * interval, 4),
+                    }
+                )
+        rows = [
+            row for row in rows if not any(idle in row["function"] for idle in IDLE)
+        ]
+        rows.sort(key=lambda row: row["own_s"], reverse=True)
+        return rows[:limit]
+
+    def summary(self, limit=20):
+        """
+        :return: Markdown with the profiled calls of every section and
+            the ranked hotspots
+        """
+        seconds = {name: stats.total_tt for name, stats in self.stats().items()}
+        with self._lock:
+            seconds.update(self.seconds)
+            sections = [
+                f"| {name} | {self.profiled.get(name, 0)} of {calls} | "
+                f"{seconds[name]:.3f} |"
+                for name, calls in sorted(self.calls.items())
+                if name in seconds
+            ]
+
+        lines = [
+            "| Section | Profiled calls | Profiled seconds |",
+            "| --- | --- | --- |",
+            *sections,
+            "",
+            "| Section | Function | Calls | Own seconds | Cumulative seconds |",
+            "| --- | --- | --- | --- | --- |",
+        ]
+        for row in self.hotspots(limit):
+            calls = "sampled" if row["calls"] is None else row["calls"]
+            lines.append(
+                f"| {row['section']} | `{row['function']}` | {calls} | "
+                f"{row['own_s']:.4f} | {row['cumulative_s']:.4f} |"
+            )
+        return "\n".join(lines) + "\n"
+
+    def export(self, run_name, artifact_key=None, limit=20):
+        """
+        Dump every section and write the summary to
+        <directory>/<run_name>/summary.md, also published as a markdown
+        artifact of the current flow run.
+
+        :param run_name: Name of the flow run the profiles belong to
+        :param artifact_key: Key of the artifact, no artifact if None
+        :return: Path to the summary
+        """
+        self.dump(run_name)
+        summary = self.summary(limit)
+
+        path = os.path.join(self.directory, run_name, "summary.md")
+        with open(path, "w") as f:
+            f.write(summary)
+
+        if artifact_key:
+            # Imported here, so runs without Prefect do not load it
+            from prefect.artifacts import create_markdown_artifact
+
+            create_markdown_artifact(
+                key=artifact_key,
+                markdown=summary,
+                description=f"Profile of {run_name}",
+            )
+        return path
+
+
+def start_profiling(directory):
+    """
+    Profile the sections of this process from now on.
+
+    :return: Profiler
+    """
+    global _active
+    _active = Profiler(directory)
+    return _active
+
+
+def stop_profiling():
+    global _active
+    _active = None
+
+
+@contextmanager
+def section(name, sample_every=1, sampled=False):
+    """
+    Profile the with block if profiling is on, see Profiler.profile.
+
+    :param sampled: Sample the stack instead, see Profiler.sample
+    """
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+
+    if sampled:
+        with profiler.sample(name):
+            yield
+    else:
+        with profiler.profile(name, sample_every):
+            yield
+
+
+def profiled(func=None, *, sample_every=1):
+    """
+    Decorator that profiles calls of a function as a section named after
+    it if profiling is on. Goes below @task, so Prefect sees the function.
+
+    :param sample_every: Profile every Nth call only, for hot paths
+    """
+    if func is None:
+        return functools.partial(profiled, sample_every=sample_every)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _active
+        if profiler is None:
+            return func(*args, **kwargs)
+
+        with profiler.profile(func.__name__, sample_every):
+            return func(*args, **kwargs)
+
+    return wrapper
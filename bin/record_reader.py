@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""
+This script streams biosample records from plain or
+gzip compressed efetch output, one record at a time.
+"""
+
+import os
+import gzip
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def find_raw_file(local_inpath, name):
+    """
+    Find the raw efetch output of an agent, compressed or not.
+
+    :param local_inpath: Directory of raw data
+    :param name: Agent name with spaces replaced by underscores
+    :return: Path to name.tsv or name.tsv.gz, or None if neither exists
+    """
+    for extension in [".tsv", ".tsv.gz"]:
+        path = os.path.join(local_inpath, name + extension)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def open_text(path):
+    """
+    Open a plain or gzip compressed file as text.
+    Compression is detected from the file contents, not its name.
+
+    :param path: Path to file
+    :return: Text file object
+    """
+    with open(path, "rb") as f:
+        magic = f.read(2)
+
+    if magic == GZIP_MAGIC:
+        return gzip.open(path, "rt")
+    return open(path)
+
+
+def iter_records(lines):
+    """
+    Split lines into records separated by blank lines.
+
+    :param lines: Iterable of lines with or without line endings
+    :return: Generator of records without the trailing newline
+    """
+    record = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line:
+            record.append(line)
+        elif record:
+            yield "\n".join(record)
+            record = []
+
+    if record:
+        yield "\n".join(record)
+
+
+def iter_chunks(records, max_records, max_bytes):
+    """
+    Group records into lists of at most max_records records or about
+    max_bytes characters, whichever is reached first.
+
+    :param records: Iterable of records
+    :return: Generator of lists of records
+    """
+    chunk = []
+    size = 0
+    for record in records:
+        chunk.append(record)
+        size += len(record)
+        if len(chunk) >= max_records or size >= max_bytes:
+            yield chunk
+            chunk = []
+            size = 0
+
+    if chunk:
+        yield chunk
+
+
+def read_records(path):
+    """
+    Stream biosample records from a plain or gzip compressed file.
+
+    :param path: Path to efetch output
+    :return: Generator of records
+    """
+    with open_text(path) as f:
+        yield from iter_records(f)
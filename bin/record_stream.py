@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+"""
+This script downloads agents in a background thread and
+hands their biosample records to the transform while the
+download is still running, so parsing and fetching overlap.
+"""
+
+import os
+import queue
+import asyncio
+import threading
+
+from eutils import EUTILS_URL, EutilsClient, EutilsError, stream_agent
+from record_reader import iter_records
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+# Put on an agent's queue after its last batch
+DONE = object()
+
+# Seconds a blocked download waits before checking if it was stopped
+PUT_TIMEOUT = 0.1
+
+
+class RecordStream:
+    """
+    Streams the records of every agent, in order. Agents are downloaded ahead
+    of the one being transformed, each holding at most max_batches batches.
+    """
+
+    def __init__(
+        self,
+        terms,
+        out_dir,
+        api_key=None,
+        base_url=EUTILS_URL,
+        concurrency=3,
+        retmax=5000,
+        max_batches=4,
+        retries=5,
+    ):
+        """
+        :param terms: List of search terms, e.g. lines of agents_list.txt
+        :param out_dir: Directory that raw <agent>.tsv.gz files are written to
+        :param api_key: NCBI API key or None
+        :param base_url: URL of the E-utilities
+        :param concurrency: Number of agents downloaded at once
+        :param retmax: Records per efetch request
+        :param max_batches: Batches buffered per agent before its download waits
+        :param retries: Number of retries of a failed request
+        """
+        self.terms = terms
+        self.out_dir = out_dir
+        self.api_key = api_key
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.retmax = retmax
+        self.retries = retries
+        self._queues = {term: queue.Queue(maxsize=max_batches) for term in terms}
+        # Agents whose records are no longer read
+        self._abandoned = set()
+        self._stopped = threading.Event()
+
+        self._thread = threading.Thread(
+            target=asyncio.run, args=(self._run(),), daemon=True
+        )
+        self._thread.start()
+
+    def raw_path(self, term):
+        """
+        :return: Path to the compressed raw output of an agent
+        """
+        return os.path.join(self.out_dir, f"{term.replace(' ', '_')}.tsv.gz")
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async with EutilsClient(
+            self.api_key, self.base_url, retries=self.retries
+        ) as client:
+            await asyncio.gather(
+                *[self._fetch(client, semaphore, term) for term in self.terms]
+            )
+
+    def _put(self, term, item):
+        """
+        Put an item on an agent's queue, waiting while it is full.
+
+        :return: False if the stream was closed or the agent abandoned
+        """
+        batches = self._queues[term]
+        while not self._stopped.is_set() and term not in self._abandoned:
+            try:
+                batches.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    async def _fetch(self, client, semaphore, term):
+        async with semaphore:
+            if self._stopped.is_set() or term in self._abandoned:
+                return
+            batches = stream_agent(
+                client, term, self.raw_path(term), retmax=self.retmax
+            )
+            try:
+                async for text in batches:
+                    # Blocks while the transform is behind, so do it off the loop
+                    if not await asyncio.to_thread(self._put, term, text):
+                        return
+                await asyncio.to_thread(self._put, term, DONE)
+            except Exception as e:
+                # A new error without the traceback of this thread's frames,
+                # it is raised again in the thread that reads the records
+                if isinstance(e, EutilsError):
+                    message = str(e)
+                else:
+                    message = f"Fetching {term} failed: {e!r}"
+                await asyncio.to_thread(self._put, term, EutilsError(message))
+            finally:
+                # Closes the raw file of a stopped or abandoned download
+                await batches.aclose()
+
+    def records(self, term):
+        """
+        Yield the records of an agent as they are downloaded. When the
+        generator is exhausted the raw file at raw_path(term) is complete.
+
+        :param term: One of terms
+        :return: Generator of records
+        """
+        batches = self._queues[term]
+        finished = False
+        try:
+            while True:
+                batch = batches.get()
+                if batch is DONE:
+                    finished = True
+                    return
+                if isinstance(batch, Exception):
+                    finished = True
+                    raise batch
+                yield from iter_records(batch.splitlines())
+        finally:
+            # The download of an agent that is not read to the end stops
+            if not finished:
+                self._abandoned.add(term)
+
+    def close(self):
+        """
+        Stop every download and wait for the background thread.
+        """
+        self._stopped.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+"""
+This script runs the stages of the pipeline in this
+process, without a Prefect server, agent or blocks:
+scrape, fetch, transform, upload and load. Each stage
+only imports the modules it needs, when it runs.
+"""
+
+import os
+import sys
+import time
+import argparse
+import importlib
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+INFILE = "agents_list.txt"
+LOCAL_INPATH = "raw_data"
+LOCAL_OUTPATH = "clean_data"
+LOCAL_PATH = "gcs_data"
+GCS_PATH = "data"
+# Agents are recorded once written locally, so run_local keeps its own
+# manifest. The flows' clean_data/manifest.json means an agent is in storage.
+MANIFEST = "local_manifest.json"
+
+# Modules each stage imports, loaded and timed before it runs
+STAGE_MODULES = {
+    "scrape": ["agent_registry"],
+    "fetch": ["fetch_data"],
+    "transform": [
+        "agent_transform",
+        "accession_index",
+        "manifest",
+        "metrics",
+        "parquet_dataset",
+        "record_reader",
+        "weather_backends",
+        "worker_pool",
+    ],
+    "upload": ["parquet_dataset", "storage_backends"],
+    "load": ["metrics", "parquet_dataset", "storage_backends", "warehouse_sinks"],
+}
+
+
+def read_agents(infile=INFILE):
+    """
+    :return: List of agent names with spaces replaced by underscores
+    """
+    with open(infile) as f:
+        return [line.strip().replace(" ", "_") for line in f if line.strip()]
+
+
+def scrape(args):
+    from agent_registry import write_agents_list
+
+    status, count = write_agents_list(args.start, args.end, outfile=INFILE)
+    print(f"INFO: Agent registry {status}, {count} agents.")
+
+
+def fetch(args):
+    from fetch_data import fetch_data
+
+    counts = fetch_data(args.api_key, INFILE, LOCAL_INPATH)
+    print(f"INFO: Fetched {sum(counts.values())} biosamples of {len(counts)} agents.")
+
+
+def transform(args):
+    import concurrent.futures
+
+    from accession_index import AccessionIndex
+    from agent_transform import (
+        load_geography,
+        make_station_resolver,
+        transform_chunks,
+        transform_records,
+        write_local_chunks,
+    )
+    from manifest import Manifest, code_version, config_version, hash_file
+    from metrics import Metrics
+    from parquet_dataset import write_agent
+    from record_reader import find_raw_file, read_records
+    from weather_backends import TimedWeatherBackend, get_weather_backend
+    from worker_pool import default_workers
+
+    os.makedirs(LOCAL_OUTPATH, exist_ok=True)
+    countries, regions = load_geography()
+    station_resolver = make_station_resolver(
+        LOCAL_OUTPATH, not args.no_station_cache, args.nearest_stations
+    )
+    metrics = Metrics()
+    weather_backend = TimedWeatherBackend(
+        get_weather_backend(
+            args.weather, os.path.join(LOCAL_OUTPATH, "weather.sqlite"), args.frequency
+        ),
+        metrics,
+    )
+
+    manifest = Manifest(os.path.join(LOCAL_OUTPATH, MANIFEST))
+    code = code_version()
+    config = config_version(
+        {
+            "batch": args.batch,
+            "frequency": args.frequency,
+            "columnar": args.columnar,
+            "weather": args.weather,
+            "nearest_stations": args.nearest_stations,
+        }
+    )
+    accession_index = None
+    if not args.no_reuse_accessions:
+        accession_index = AccessionIndex(
+            os.path.join(LOCAL_OUTPATH, "accessions.sqlite"), config, code
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=args.workers or default_workers()
+    ) as executor:
+        for filename in read_agents():
+            file = find_raw_file(LOCAL_INPATH, filename)
+            if file is None:
+                print(f"WARNING: {filename} has no raw data. Skipping..")
+                continue
+
+            input_hash = hash_file(file)
+            if not args.no_incremental and manifest.is_current(
+                filename, input_hash, code, config
+            ):
+                print(f"INFO: {filename} is unchanged. Skipping..")
+                continue
+
+            print(f"INFO: Cleaning {filename}")
+            transform_args = (
+                read_records(file),
+                filename,
+                regions,
+                countries,
+                station_resolver,
+                weather_backend,
+                executor,
+                args.frequency,
+                args.columnar,
+                args.batch,
+                metrics,
+                accession_index,
+            )
+            if args.bounded_memory:
+                index, rows = write_local_chunks(
+                    transform_chunks(*transform_args), filename, LOCAL_OUTPATH, metrics
+                )
+            else:
+                df = transform_records(*transform_args)
+                if accession_index is not None:
+                    accession_index.set_members(filename, df["Biosample"].unique())
+                rows = len(df)
+                index = write_agent(
+                    df, os.path.join(LOCAL_OUTPATH, "dataset"), filename
+                )
+
+            station_resolver.save()
+            # Written agents are recorded, upload puts them in storage
+            manifest.record(filename, input_hash, code, config, index)
+            metrics.count("rows_written", rows, agent=filename)
+            print(f"INFO: Wrote {rows} rows of {filename}.")
+
+    if accession_index is not None:
+        accession_index.export_memberships(
+            os.path.join(LOCAL_OUTPATH, "agent_membership.parquet")
+        )
+        accession_index.close()
+
+    metrics.export(os.path.join(LOCAL_OUTPATH, "metrics"), "run_local_transform")
+
+
+def upload(args):
+    from parquet_dataset import upload_agent
+    from storage_backends import Uploader, get_storage_backend
+
+    root = os.path.join(LOCAL_OUTPATH, "dataset")
+    uploads = []
+    with Uploader(
+        get_storage_backend(args.storage), max_workers=args.uploads
+    ) as uploader:
+        for filename in read_agents():
+            if not os.path.isdir(os.path.join(root, f"agent={filename}")):
+                print(f"WARNING: {filename} is not transformed. Skipping..")
+                continue
+            uploads.append((filename, upload_agent(uploader, root, GCS_PATH, filename)))
+
+        membership = os.path.join(LOCAL_OUTPATH, "agent_membership.parquet")
+        if os.path.isfile(membership):
+            uploads.append(
+                (
+                    "agent_membership",
+                    uploader.submit(membership, f"{GCS_PATH}/agent_membership.parquet"),
+                )
+            )
+
+    failed = [name for name, future in uploads if future.exception() is not None]
+    print(f"INFO: Uploaded {uploader.uploaded}, unchanged {uploader.skipped}.")
+    if failed:
+        raise RuntimeError(f"Uploads failed for {', '.join(failed)}.")
+
+
+def load(args):
+    from metrics import Metrics
+    from parquet_dataset import count_rows, download_agent, iter_frames
+    from storage_backends import get_storage_backend
+    from warehouse_sinks import COLUMNS, get_warehouse_sink
+
+    os.makedirs(LOCAL_PATH, exist_ok=True)
+    storage = get_storage_backend(args.storage)
+    sink = get_warehouse_sink(
+        args.warehouse, os.path.join(LOCAL_PATH, "warehouse.sqlite")
+    )
+    loaded = sink.watermarks() if not args.no_incremental else {}
+    metrics = Metrics()
+
+    paths = []
+    changed = {}
+    for filename in read_agents():
+        agent_paths, checksum = download_agent(
+            storage, GCS_PATH, LOCAL_PATH, filename, loaded.get(filename)
+        )
+        if agent_paths is None:
+            status = "missing" if checksum is None else "unchanged"
+        else:
+            # Changed agents are merged even if empty, so their old rows are deleted
+            changed[filename] = checksum
+            status = "loaded" if any(map(count_rows, agent_paths)) else "empty"
+            if status == "loaded":
+                paths.extend(agent_paths)
+        metrics.count("files", status=status)
+
+    if changed:
+        sink.begin()
+        for df in iter_frames(paths, args.batch_size, columns=COLUMNS):
+            df["Precipitation"] = df["Precipitation"].fillna(0)
+            sink.load(df)
+        sink.merge(changed)
+        print(f"INFO: Loaded {sink.rows} rows of {len(changed)} agents.")
+    else:
+        print("INFO: No agents changed since the last load.")
+
+    metrics.count("rows_loaded", sink.rows)
+    metrics.export(os.path.join(LOCAL_PATH, "metrics"), "run_local_load")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--cold-start",
+        action="store_true",
+        help="Only import the stage's modules and report how long it took",
+    )
+    stages = parser.add_subparsers(dest="stage", required=True)
+
+    parser_scrape = stages.add_parser("scrape", help="Write agents_list.txt")
+    parser_scrape.add_argument("--start", type=int, default=0)
+    parser_scrape.add_argument("--end", type=int, default=66)
+    parser_scrape.set_defaults(run=scrape)
+
+    parser_fetch = stages.add_parser("fetch", help="Download biosamples to raw_data")
+    parser_fetch.add_argument("--api-key", default="NULL", help="NCBI API key")
+    parser_fetch.set_defaults(run=fetch)
+
+    parser_transform = stages.add_parser(
+        "transform", help="Transform raw_data into clean_data/dataset"
+    )
+    parser_transform.add_argument("--columnar", action="store_true")
+    parser_transform.add_argument("--batch", action="store_true")
+    parser_transform.add_argument(
+        "--frequency", choices=["monthly", "daily"], default="monthly"
+    )
+    parser_transform.add_argument(
+        "--weather", choices=["meteostat", "local"], default="meteostat"
+    )
+    parser_transform.add_argument("--nearest-stations", type=int, default=0)
+    parser_transform.add_argument("--workers", type=int)
+    parser_transform.add_argument("--bounded-memory", action="store_true")
+    parser_transform.add_argument("--no-station-cache", action="store_true")
+    parser_transform.add_argument("--no-incremental", action="store_true")
+    parser_transform.add_argument("--no-reuse-accessions", action="store_true")
+    parser_transform.set_defaults(run=transform)
+
+    parser_upload = stages.add_parser("upload", help="Upload clean_data to storage")
+    parser_upload.add_argument("--storage", choices=["gcs", "local"], default="gcs")
+    parser_upload.add_argument("--uploads", type=int, default=4)
+    parser_upload.set_defaults(run=upload)
+
+    parser_load = stages.add_parser("load", help="Load storage into the warehouse")
+    parser_load.add_argument("--storage", choices=["gcs", "local"], default="gcs")
+    parser_load.add_argument(
+        "--warehouse", choices=["bigquery", "sqlite"], default="bigquery"
+    )
+    parser_load.add_argument("--batch-size", type=int, default=500_000)
+    parser_load.add_argument("--no-incremental", action="store_true")
+    parser_load.set_defaults(run=load)
+
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    for module in STAGE_MODULES[args.stage]:
+        importlib.import_module(module)
+    loaded = time.perf_counter()
+    print(f"INFO: Imported {args.stage} in {loaded - started:.2f}s.")
+    if args.cold_start:
+        return
+
+    try:
+        args.run(args)
+    except (OSError, RuntimeError, ValueError) as e:
+        sys.stderr.write(f"ERROR: {e}\n")
+        sys.exit(1)
+    print(f"INFO: Ran {args.stage} in {time.perf_counter() - loaded:.2f}s.")
+
+
+if __name__ == "__main__":
+    main()
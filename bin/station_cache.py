@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+"""
+This script memoizes the lookup of weather stations
+by country and region abbreviation so meteostat's
+station inventory is only filtered once per pair.
+"""
+
+import os
+import json
+import fcntl
+import threading
+
+from collections import OrderedDict, namedtuple
+from meteostat import Point, Stations
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+Station = namedtuple("Station", ["id", "latitude", "longitude"])
+
+
+class StationResolver:
+    """
+    Thread-safe LRU cache of (country_abbrev, region_abbrev) -> candidate Stations.
+    Pairs without a station are cached as empty so they are not looked up again.
+    """
+
+    def __init__(self, maxsize=4096, cache_path=None, index=None, k=5):
+        """
+        :param maxsize: Maximum number of pairs to keep in memory
+        :param cache_path: Optional JSON file to load from and save to between runs
+        :param index: Optional StationIndex to find the k nearest stations with,
+            otherwise the first station of the country/region is used
+        :param k: Number of candidate stations when index is given
+        """
+        self.maxsize = maxsize
+        self.cache_path = cache_path
+        self.index = index
+        self.k = k
+        self.hits = 0
+        self.misses = 0
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._stations = None
+
+        if cache_path and os.path.isfile(cache_path):
+            self.load()
+
+    def _inventory(self):
+        """
+        Load meteostat's station inventory once.
+
+        :return: meteostat Stations object
+        """
+        with self._lock:
+            if self._stations is None:
+                self._stations = Stations()
+            return self._stations
+
+    def _lookup(self, country_abbrev, region_abbrev):
+        """
+        Find the candidate stations for a country and (optional) region.
+
+        :return: Tuple of Station, nearest first, empty if there are no stations
+        """
+        if self.index is not None:
+            return tuple(self.index.nearest(country_abbrev, region_abbrev, self.k))
+
+        stations = self._inventory()
+        if region_abbrev:
+            stations = stations.region(country_abbrev, region_abbrev)
+        else:
+            stations = stations.region(country_abbrev)
+
+        stations = stations.fetch(1)
+        if stations.empty:
+            return ()
+
+        return (
+            Station(
+                str(stations.index[0]),
+                float(stations.latitude.iloc[0]),
+                float(stations.longitude.iloc[0]),
+            ),
+        )
+
+    def candidates(self, country_abbrev, region_abbrev=""):
+        """
+        Get the candidate weather stations for a country and region abbreviation.
+
+        :param country_abbrev: Alpha-2 abbreviation of country
+        :param region_abbrev: Abbreviation of region, can be empty
+        :return: Tuple of Station, nearest first, empty if none was found
+        """
+        if not country_abbrev:
+            return ()
+
+        key = (country_abbrev, region_abbrev or "")
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        stations = self._lookup(*key)
+
+        with self._lock:
+            self._cache[key] = stations
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+        return stations
+
+    def resolve(self, country_abbrev, region_abbrev=""):
+        """
+        Get the weather station for a country and region abbreviation.
+
+        :param country_abbrev: Alpha-2 abbreviation of country
+        :param region_abbrev: Abbreviation of region, can be empty
+        :return: Station or None if no station was found
+        """
+        stations = self.candidates(country_abbrev, region_abbrev)
+        return stations[0] if stations else None
+
+    def point(self, country_abbrev, region_abbrev=""):
+        """
+        Get a meteostat Point for a country and region abbreviation.
+
+        :return: meteostat Point or None if no station was found
+        """
+        station = self.resolve(country_abbrev, region_abbrev)
+        if station is None:
+            return None
+        return Point(station.latitude, station.longitude, 1)
+
+    def stations(self):
+        """
+        :return: Set of every cached Station
+        """
+        with self._lock:
+            return {
+                station for stations in self._cache.values() for station in stations
+            }
+
+    def stats(self):
+        """
+        :return: Dictionary of hits, misses, hit rate and cache size
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._cache),
+            }
+
+    def load(self):
+        """
+        Load cached stations from cache_path.
+        """
+        with open(self.cache_path) as f:
+            cached = json.load(f)
+
+        with self._lock:
+            for key, stations in cached.items():
+                country_abbrev, region_abbrev = key.split("|", 1)
+
+                # Older caches stored a single station or None per pair
+                if stations is None:
+                    stations = []
+                elif stations and not isinstance(stations[0], list):
+                    stations = [stations]
+
+                self._cache[(country_abbrev, region_abbrev)] = tuple(
+                    Station(*station) for station in stations
+                )
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def save(self):
+        """
+        Save cached stations to cache_path, merged with the pairs that
+        other processes saved there.
+        """
+        if not self.cache_path:
+            return
+
+        with self._lock:
+            cached = {
+                f"{country_abbrev}|{region_abbrev}": [
+                    list(station) for station in stations
+                ]
+                for (country_abbrev, region_abbrev), stations in self._cache.items()
+            }
+
+        # Worker processes of a Dask cluster share the cache, so each one
+        # adds its pairs to the saved ones while holding a lock file
+        with open(f"{self.cache_path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.isfile(self.cache_path):
+                with open(self.cache_path) as f:
+                    cached = {**json.load(f), **cached}
+
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cached, f)
+            os.replace(tmp_path, self.cache_path)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+"""
+This script loads meteostat's station inventory once into
+coordinate arrays with a KD-tree so a country or region can
+be mapped to the nearest stations that report monthly data.
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from scipy.spatial import cKDTree
+from meteostat import Stations
+from station_cache import Station
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+def to_xyz(latitude, longitude):
+    """
+    Convert coordinates in degrees to points on the unit sphere, so
+    euclidean distance in the KD-tree orders stations like great-circle distance.
+
+    :return: Array of shape (n, 3)
+    """
+    latitude = np.radians(np.asarray(latitude, dtype="float64"))
+    longitude = np.radians(np.asarray(longitude, dtype="float64"))
+    return np.column_stack(
+        [
+            np.cos(latitude) * np.cos(longitude),
+            np.cos(latitude) * np.sin(longitude),
+            np.sin(latitude),
+        ]
+    )
+
+
+def to_latlon(xyz):
+    """
+    :return: Latitude and longitude in degrees of a (not necessarily unit) vector
+    """
+    x, y, z = xyz
+    return (
+        float(np.degrees(np.arctan2(z, np.hypot(x, y)))),
+        float(np.degrees(np.arctan2(y, x))),
+    )
+
+
+class StationIndex:
+    """
+    Nearest-station lookup for country and region centroids. Centroids are
+    those of the inventory's stations in each country and country/region,
+    unless gazetteer_path gives one.
+    """
+
+    def __init__(self, inventory=None, gazetteer_path=None):
+        """
+        :param inventory: Dataframe of stations indexed by id with country,
+            region, latitude, longitude and monthly_start columns,
+            defaults to meteostat's inventory
+        :param gazetteer_path: Optional JSON of centroids, e.g.
+            {"US": [39.8, -98.6], "US|CA": [37.2, -119.4]}
+        """
+        if inventory is None:
+            inventory = Stations().fetch()
+
+        # Only stations that report monthly data can be matched
+        if "monthly_start" in inventory.columns:
+            inventory = inventory[inventory["monthly_start"].notna()]
+        inventory = inventory[
+            inventory["latitude"].notna() & inventory["longitude"].notna()
+        ]
+
+        self.ids = inventory.index.astype(str).to_numpy()
+        self.latitude = inventory["latitude"].to_numpy(dtype="float64")
+        self.longitude = inventory["longitude"].to_numpy(dtype="float64")
+        self.tree = cKDTree(to_xyz(self.latitude, self.longitude))
+
+        self.centroids = self._inventory_centroids(inventory)
+        if gazetteer_path and os.path.isfile(gazetteer_path):
+            with open(gazetteer_path) as f:
+                for key, (latitude, longitude) in json.load(f).items():
+                    self.centroids[key] = (latitude, longitude)
+
+    @staticmethod
+    def _inventory_centroids(inventory):
+        """
+        Centroid of the stations of every country and every country/region pair,
+        used when there is no gazetteer entry.
+
+        :return: Dictionary of "country" or "country|region" -> (lat, lon)
+        """
+        xyz = pd.DataFrame(
+            to_xyz(inventory["latitude"], inventory["longitude"]),
+            columns=["x", "y", "z"],
+            index=inventory.index,
+        )
+        country = inventory["country"].astype(str)
+        region = inventory["region"].fillna("").astype(str)
+
+        centroids = {}
+        for keys in [country, (country + "|" + region)[region != ""]]:
+            totals = xyz.loc[keys.index].groupby(keys).sum()
+            for key, total in zip(totals.index, totals.to_numpy()):
+                centroids[key] = to_latlon(total)
+        return centroids
+
+    def centroid(self, country_abbrev, region_abbrev=""):
+        """
+        :return: (lat, lon) of a region, falling back to its country, or None
+        """
+        if region_abbrev:
+            centroid = self.centroids.get(f"{country_abbrev}|{region_abbrev}")
+            if centroid is not None:
+                return centroid
+        return self.centroids.get(country_abbrev)
+
+    def nearest(self, country_abbrev, region_abbrev="", k=5):
+        """
+        Find the k nearest stations to the centroid of a country or region.
+
+        :return: List of Station ordered by distance, empty if unknown
+        """
+        centroid = self.centroid(country_abbrev, region_abbrev)
+        if centroid is None or len(self.ids) == 0:
+            return []
+
+        k = min(k, len(self.ids))
+        _, positions = self.tree.query(to_xyz([centroid[0]], [centroid[1]]), k=k)
+        positions = np.atleast_1d(positions[0])
+
+        return [
+            Station(self.ids[i], float(self.latitude[i]), float(self.longitude[i]))
+            for i in positions
+        ]
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+"""
+This script provides the object stores that parquet files
+are uploaded to: a Google Cloud Storage bucket that reuses
+one client, or a local directory for offline runs, and a
+bounded background uploader with retries.
+"""
+
+import os
+import time
+import base64
+import shutil
+import hashlib
+import threading
+import concurrent.futures
+
+from abc import ABC, abstractmethod
+from pathlib import PurePosixPath
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+def md5_file(path, chunk_size=1 << 20):
+    """
+    :param path: Path to file
+    :return: MD5 hex digest of the file contents, as GCS reports it
+    """
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StorageBackend(ABC):
+    """
+    Interface of an object store.
+    """
+
+    @abstractmethod
+    def upload(self, from_path, to_path):
+        """
+        Upload a local file to to_path in the store.
+        """
+
+    @abstractmethod
+    def download(self, from_path, to_path):
+        """
+        Download from_path in the store to a local file.
+        """
+
+    @abstractmethod
+    def checksum(self, path):
+        """
+        :return: MD5 hex digest of an object in the store or None if it does not exist
+        """
+
+
+class GcsStorage(StorageBackend):
+    """
+    Google Cloud Storage bucket from a Prefect GcsBucket block. The block and
+    its storage client are loaded once and shared by every upload.
+    """
+
+    def __init__(self, block_name="gcs-agents-precip"):
+        """
+        :param block_name: Name of the GcsBucket block created by gcp_block.py
+        """
+        # Imported here, so local runs do not pay for the GCP clients
+        from prefect_gcp.cloud_storage import GcsBucket
+
+        # GcsBucket.upload_from_path creates a new client for every upload
+        block = GcsBucket.load(block_name)
+        client = block.gcp_credentials.get_cloud_storage_client()
+        self._bucket = client.bucket(block.bucket)
+        self._bucket_folder = block.bucket_folder
+
+    def _resolve_path(self, path):
+        if self._bucket_folder:
+            path = str(PurePosixPath(self._bucket_folder, path))
+        return self._bucket, path
+
+    def upload(self, from_path, to_path):
+        bucket, to_path = self._resolve_path(to_path)
+        bucket.blob(to_path).upload_from_filename(from_path, timeout=9000)
+
+    def download(self, from_path, to_path):
+        bucket, from_path = self._resolve_path(from_path)
+        os.makedirs(os.path.dirname(os.path.abspath(to_path)), exist_ok=True)
+        bucket.blob(from_path).download_to_filename(to_path, timeout=9000)
+
+    def checksum(self, path):
+        bucket, path = self._resolve_path(path)
+        blob = bucket.get_blob(path)
+        if blob is None or blob.md5_hash is None:
+            return None
+        return base64.b64decode(blob.md5_hash).hex()
+
+
+class LocalStorage(StorageBackend):
+    """
+    Directory that stands in for a bucket, for offline runs and tests.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: Directory that objects are stored under
+        """
+        self.root = root
+
+    def _resolve_path(self, path):
+        return os.path.join(self.root, *PurePosixPath(path).parts)
+
+    def upload(self, from_path, to_path):
+        to_path = self._resolve_path(to_path)
+        os.makedirs(os.path.dirname(to_path), exist_ok=True)
+        shutil.copyfile(from_path, to_path)
+
+    def download(self, from_path, to_path):
+        os.makedirs(os.path.dirname(os.path.abspath(to_path)), exist_ok=True)
+        shutil.copyfile(self._resolve_path(from_path), to_path)
+
+    def checksum(self, path):
+        path = self._resolve_path(path)
+        if not os.path.isfile(path):
+            return None
+        return md5_file(path)
+
+
+def get_storage_backend(name, root="storage"):
+    """
+    :param name: "gcs" or "local"
+    :param root: Directory of the store when name is "local"
+    :return: StorageBackend
+    """
+    if name == "gcs":
+        return GcsStorage()
+    if name == "local":
+        return LocalStorage(root)
+    raise ValueError(f"Unknown storage backend '{name}'.")
+
+
+class Uploader:
+    """
+    Uploads files in the background on a bounded thread pool. Objects whose
+    checksum already matches are skipped and failed uploads are retried
+    with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        storage,
+        max_workers=4,
+        max_pending=8,
+        retries=3,
+        backoff=2.0,
+        metrics=None,
+    ):
+        """
+        :param storage: StorageBackend to upload to
+        :param max_workers: Number of concurrent uploads
+        :param max_pending: Submitting blocks while this many uploads are unfinished
+        :param retries: Number of retries after a failed upload
+        :param backoff: Seconds to wait before the first retry, doubled each retry
+        :param metrics: Optional Metrics that upload latencies are observed in
+        """
+        self.storage = storage
+        self.retries = retries
+        self.backoff = backoff
+        self.metrics = metrics
+        self.uploaded = 0
+        self.skipped = 0
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+
+    def _upload(self, from_path, to_path, after=()):
+        """
+        :return: True if uploaded, False if the object was already up to date
+        """
+        try:
+            # Raises if an upload this one depends on failed
+            for future in after:
+                future.result()
+
+            if self.storage.checksum(to_path) == md5_file(from_path):
+                print(f"INFO: {to_path} is up to date. Skipping upload..")
+                with self._lock:
+                    self.skipped += 1
+                return False
+
+            for attempt in range(self.retries + 1):
+                started = time.perf_counter()
+                try:
+                    self.storage.upload(from_path, to_path)
+                    break
+                except Exception as e:
+                    if self.metrics is not None:
+                        self.metrics.count("upload_errors")
+                    if attempt == self.retries:
+                        raise
+                    delay = self.backoff * 2**attempt
+                    print(
+                        f"WARNING: Upload of {to_path} failed ({e}). Retrying in {delay}s.."
+                    )
+                    time.sleep(delay)
+
+            if self.metrics is not None:
+                self.metrics.observe("write_gcs", time.perf_counter() - started)
+
+            with self._lock:
+                self.uploaded += 1
+            print(f"INFO: Uploaded {to_path}.")
+            return True
+        finally:
+            self._slots.release()
+
+    def submit(self, from_path, to_path, after=()):
+        """
+        Queue an upload, waiting if max_pending uploads are unfinished.
+
+        :param after: Futures of uploads that have to succeed first, e.g. the
+            files an index lists. They must have been submitted earlier.
+        :return: Future of the upload
+        """
+        self._slots.acquire()
+        try:
+            return self._executor.submit(self._upload, from_path, to_path, after)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def close(self):
+        """
+        Wait for all queued uploads to finish.
+        """
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
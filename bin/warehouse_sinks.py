@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+
+"""
+This script provides the warehouses that merged agents
+are loaded into: BigQuery through bulk load jobs, or a
+local SQLite database with the same semantics. Rows are
+loaded into a staging table and merged on Biosample and
+Agent, so reloading an agent never duplicates rows.
+"""
+
+import time
+import sqlite3
+import threading
+import pandas as pd
+
+from abc import ABC, abstractmethod
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+COLUMNS = ["Biosample", "Agent", "Date", "Country", "region", "Precipitation"]
+# Rows staged twice for a Biosample and Agent are merged once, keeping the
+# first in this order over every other column, so both sinks keep the same row
+DEDUPLICATE_ORDER = "Date DESC, Country, region, Precipitation DESC"
+
+
+class WarehouseSink(ABC):
+    """
+    Interface of a warehouse table. A load is begin(), load() for every
+    batch of rows and merge() with the content hash of every agent loaded.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    @abstractmethod
+    def watermarks(self):
+        """
+        :return: Dictionary of agent -> content hash of its last merged file
+        """
+
+    @abstractmethod
+    def begin(self):
+        """
+        Empty the staging table.
+        """
+
+    @abstractmethod
+    def write(self, df):
+        """
+        Append a dataframe with COLUMNS to the staging table.
+        """
+
+    @abstractmethod
+    def merge(self, watermarks):
+        """
+        Upsert the staging table into the table on Biosample and Agent,
+        keeping the first of duplicate staged rows in DEDUPLICATE_ORDER,
+        delete rows of the given agents that are no longer staged and
+        record their content hashes.
+
+        :param watermarks: Dictionary of agent -> content hash of every staged agent
+        """
+
+    def load(self, df):
+        """
+        Stage a dataframe and count its rows, bytes and load time.
+        """
+        started = time.perf_counter()
+        self.write(df)
+        self.seconds += time.perf_counter() - started
+        self.rows += len(df)
+        self.bytes += int(df.memory_usage(index=False, deep=True).sum())
+
+    def throughput(self):
+        """
+        :return: Dictionary of rows, bytes, seconds, rows/s and bytes/s loaded so far
+        """
+        return {
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 3),
+            "rows_per_s": round(self.rows / self.seconds, 1) if self.seconds else 0.0,
+            "bytes_per_s": round(self.bytes / self.seconds, 1) if self.seconds else 0.0,
+        }
+
+
+class BigQuerySink(WarehouseSink):
+    """
+    BigQuery table loaded with load jobs. Each dataframe is sent as
+    one parquet file instead of being serialized row by row. The table
+    is partitioned by month of Date and clustered on Agent and Biosample,
+    so merges and dashboard queries for one agent only scan its blocks.
+    """
+
+    def __init__(
+        self,
+        table="agents.agents_and_precip",
+        project="agents-and-precipitation",
+        credentials_block="gcp-agents-creds",
+    ):
+        """
+        :param table: Dataset and table, created if it does not exist
+        :param project: GCP project
+        :param credentials_block: Name of the GcpCredentials block
+        """
+        # Imported here, so local runs do not pay for the GCP clients
+        from google.cloud import bigquery
+        from prefect_gcp import GcpCredentials
+
+        super().__init__()
+        self.table = f"{project}.{table}"
+        self.staging_table = f"{self.table}_staging"
+        self.watermark_table = f"{self.table}_watermarks"
+        self.client = GcpCredentials.load(credentials_block).get_bigquery_client(
+            project=project
+        )
+        self.job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        )
+
+        self._query(
+            f"""
+            CREATE TABLE IF NOT EXISTS `{self.table}` (
+                Biosample STRING,
+                Agent STRING,
+                Date DATE,
+                Country STRING,
+                region STRING,
+                Precipitation FLOAT64
+            )
+            PARTITION BY DATE_TRUNC(Date, MONTH)
+            CLUSTER BY Agent, Biosample;
+
+            CREATE TABLE IF NOT EXISTS `{self.watermark_table}` (
+                Agent STRING,
+                content_hash STRING,
+                loaded_at TIMESTAMP
+            );
+            """
+        )
+
+    def _query(self, sql, parameters=None):
+        from google.cloud import bigquery
+
+        job_config = bigquery.QueryJobConfig(query_parameters=parameters or [])
+        return self.client.query(sql, job_config=job_config).result()
+
+    def watermarks(self):
+        rows = self._query(f"SELECT Agent, content_hash FROM `{self.watermark_table}`")
+        return {row["Agent"]: row["content_hash"] for row in rows}
+
+    def begin(self):
+        self._query(
+            f"""
+            CREATE OR REPLACE TABLE `{self.staging_table}` (
+                Biosample STRING,
+                Agent STRING,
+                Date DATE,
+                Country STRING,
+                region STRING,
+                Precipitation FLOAT64
+            )
+            """
+        )
+
+    def write(self, df):
+        job = self.client.load_table_from_dataframe(
+            df[COLUMNS], self.staging_table, job_config=self.job_config
+        )
+        job.result()
+
+    def merge(self, watermarks):
+        from google.cloud import bigquery
+
+        agents = sorted(watermarks)
+        self._query(
+            f"""
+            BEGIN TRANSACTION;
+
+            MERGE `{self.table}` T
+            USING (
+                SELECT Biosample, Agent, Date, Country, region, Precipitation
+                FROM `{self.staging_table}`
+                WHERE TRUE
+                QUALIFY ROW_NUMBER() OVER (
+                    PARTITION BY Biosample, Agent ORDER BY {DEDUPLICATE_ORDER}
+                ) = 1
+            ) S
+            ON T.Biosample = S.Biosample AND T.Agent = S.Agent
+            WHEN MATCHED THEN UPDATE SET
+                Date = S.Date,
+                Country = S.Country,
+                region = S.region,
+                Precipitation = S.Precipitation
+            WHEN NOT MATCHED THEN INSERT
+                (Biosample, Agent, Date, Country, region, Precipitation)
+                VALUES (S.Biosample, S.Agent, S.Date, S.Country, S.region,
+                    S.Precipitation)
+            WHEN NOT MATCHED BY SOURCE AND T.Agent IN UNNEST(@agents) THEN DELETE;
+
+            MERGE `{self.watermark_table}` W
+            USING (
+                SELECT agent AS Agent, content_hash
+                FROM UNNEST(@agents) AS agent WITH OFFSET i
+                JOIN UNNEST(@hashes) AS content_hash WITH OFFSET j ON i = j
+            ) S
+            ON W.Agent = S.Agent
+            WHEN MATCHED THEN UPDATE SET
+                content_hash = S.content_hash,
+                loaded_at = CURRENT_TIMESTAMP()
+            WHEN NOT MATCHED THEN INSERT (Agent, content_hash, loaded_at)
+                VALUES (S.Agent, S.content_hash, CURRENT_TIMESTAMP());
+
+            COMMIT TRANSACTION;
+            """,
+            [
+                bigquery.ArrayQueryParameter("agents", "STRING", agents),
+                bigquery.ArrayQueryParameter(
+                    "hashes", "STRING", [watermarks[agent] for agent in agents]
+                ),
+            ],
+        )
+
+
+class SQLiteSink(WarehouseSink):
+    """
+    Local SQLite table for offline runs and tests.
+    """
+
+    def __init__(self, path, table="agents_and_precip"):
+        """
+        :param path: Path to SQLite database, created if it does not exist
+        :param table: Table name
+        """
+        super().__init__()
+        self.path = path
+        self.table = table
+        self.staging_table = f"{table}_staging"
+        self.watermark_table = f"{table}_watermarks"
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+
+        columns = """
+            Biosample TEXT NOT NULL,
+            Agent TEXT NOT NULL,
+            Date TEXT,
+            Country TEXT,
+            region TEXT,
+            Precipitation REAL
+        """
+        self._connection.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {columns},
+                PRIMARY KEY (Biosample, Agent)
+            );
+            CREATE INDEX IF NOT EXISTS {table}_agent_date ON {table} (Agent, Date);
+            CREATE TABLE IF NOT EXISTS {self.staging_table} ({columns});
+            CREATE TABLE IF NOT EXISTS {self.watermark_table} (
+                Agent TEXT PRIMARY KEY,
+                content_hash TEXT,
+                loaded_at TEXT
+            );
+            """
+        )
+
+    def watermarks(self):
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT Agent, content_hash FROM {self.watermark_table}"
+            ).fetchall()
+        return dict(rows)
+
+    def begin(self):
+        with self._lock:
+            self._connection.execute(f"DELETE FROM {self.staging_table}")
+            self._connection.commit()
+
+    def write(self, df):
+        rows = df[COLUMNS].astype(object).where(df[COLUMNS].notna(), None)
+        # Dates read from parquet are stored as YYYY-MM-DD text
+        rows["Date"] = [
+            str(date) if date is not None else None for date in rows["Date"]
+        ]
+        with self._lock:
+            self._connection.executemany(
+                f"INSERT INTO {self.staging_table} VALUES (?, ?, ?, ?, ?, ?)",
+                rows.itertuples(index=False, name=None),
+            )
+            self._connection.commit()
+
+    def merge(self, watermarks):
+        agents = sorted(watermarks)
+        placeholders = ", ".join("?" * len(agents))
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"""
+                DELETE FROM {self.table}
+                WHERE Agent IN ({placeholders}) AND NOT EXISTS (
+                    SELECT 1 FROM {self.staging_table} S
+                    WHERE S.Biosample = {self.table}.Biosample
+                        AND S.Agent = {self.table}.Agent
+                )
+                """,
+                agents,
+            )
+            self._connection.execute(
+                f"""
+                INSERT INTO {self.table}
+                SELECT Biosample, Agent, Date, Country, region, Precipitation
+                FROM (
+                    SELECT *, ROW_NUMBER() OVER (
+                        PARTITION BY Biosample, Agent ORDER BY {DEDUPLICATE_ORDER}
+                    ) AS row
+                    FROM {self.staging_table}
+                )
+                WHERE row = 1
+                ON CONFLICT (Biosample, Agent) DO UPDATE SET
+                    Date = excluded.Date,
+                    Country = excluded.Country,
+                    region = excluded.region,
+                    Precipitation = excluded.Precipitation
+                """
+            )
+            self._connection.executemany(
+                f"""
+                INSERT OR REPLACE INTO {self.watermark_table}
+                VALUES (?, ?, datetime('now'))
+                """,
+                [(agent, watermarks[agent]) for agent in agents],
+            )
+
+    def read(self):
+        """
+        :return: Dataframe of the whole table
+        """
+        with self._lock:
+            return pd.read_sql_query(f"SELECT * FROM {self.table}", self._connection)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def get_warehouse_sink(name, store_path=None):
+    """
+    :param name: "bigquery" or "sqlite"
+    :param store_path: Path to the SQLite database when name is "sqlite"
+    :return: WarehouseSink
+    """
+    if name == "bigquery":
+        return BigQuerySink()
+    if name == "sqlite":
+        return SQLiteSink(store_path)
+    raise ValueError(f"Unknown warehouse sink '{name}'.")
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+"""
+This script provides the backends that precipitation is
+looked up from: live meteostat requests or a local SQLite
+store that can be pre-warmed and queried offline.
+"""
+
+import os
+import sys
+import sqlite3
+import argparse
+import threading
+import pandas as pd
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from meteostat import Daily, Monthly, Point
+from station_cache import StationResolver
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+# Frequencies each backend has precipitation for
+FREQUENCIES = {"meteostat": ["monthly", "daily"], "local": ["monthly"]}
+
+
+class WeatherBackend(ABC):
+    """
+    Interface of a precipitation source.
+    """
+
+    @abstractmethod
+    def precipitation(self, station, start, end, frequency="monthly"):
+        """
+        Get precipitation of a station between two dates.
+
+        :param station: Station from StationResolver
+        :param start: First date
+        :param end: Last date
+        :param frequency: "monthly" or "daily"
+        :return: Dataframe indexed by time with a prcp column, one row per
+            month (or day) that has data
+        """
+
+
+class MeteostatBackend(WeatherBackend):
+    """
+    Precipitation from live meteostat requests.
+    """
+
+    def precipitation(self, station, start, end, frequency="monthly"):
+        area = Point(station.latitude, station.longitude, 1)
+
+        if frequency == "monthly":
+            data = Monthly(area, start, end).fetch()
+        elif frequency == "daily":
+            data = Daily(area, start, end).fetch()
+        else:
+            raise ValueError(f"Unknown frequency '{frequency}'.")
+
+        if "prcp" not in data.columns:
+            return pd.DataFrame({"prcp": []}, index=pd.DatetimeIndex([], name="time"))
+        return data[["prcp"]]
+
+
+class TimedWeatherBackend(WeatherBackend):
+    """
+    Records the latency of every request to another backend.
+    """
+
+    def __init__(self, backend, metrics):
+        """
+        :param backend: WeatherBackend to forward requests to
+        :param metrics: Metrics that latencies are observed in
+        """
+        self.backend = backend
+        self.metrics = metrics
+        self.name = type(backend).__name__
+
+    def precipitation(self, station, start, end, frequency="monthly"):
+        with self.metrics.timer("weather_request", backend=self.name):
+            return self.backend.precipitation(station, start, end, frequency)
+
+
+class LocalWeatherStore(WeatherBackend):
+    """
+    Monthly precipitation stored in SQLite, keyed by station id and year-month.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path to SQLite database, created if it does not exist
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS precipitation (
+                station TEXT NOT NULL,
+                month TEXT NOT NULL,
+                prcp REAL,
+                PRIMARY KEY (station, month)
+            )
+            """
+        )
+        self._connection.commit()
+
+    def precipitation(self, station, start, end, frequency="monthly"):
+        if frequency != "monthly":
+            raise ValueError("LocalWeatherStore only has monthly precipitation.")
+
+        with self._lock:
+            rows = self._connection.execute(
+                """
+                SELECT month, prcp FROM precipitation
+                WHERE station = ? AND month BETWEEN ? AND ?
+                ORDER BY month
+                """,
+                (station.id, f"{start:%Y-%m}", f"{end:%Y-%m}"),
+            ).fetchall()
+
+        index = pd.DatetimeIndex(
+            [datetime.strptime(month, "%Y-%m") for month, _ in rows], name="time"
+        )
+        return pd.DataFrame(
+            {"prcp": pd.Series([prcp for _, prcp in rows], dtype="float64").values},
+            index=index,
+        )
+
+    def put(self, station, data):
+        """
+        Store monthly precipitation of a station.
+
+        :param station: Station from StationResolver
+        :param data: Dataframe indexed by time with a prcp column
+        """
+        rows = [
+            (station.id, f"{time:%Y-%m}", None if pd.isna(prcp) else float(prcp))
+            for time, prcp in data["prcp"].items()
+        ]
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO precipitation VALUES (?, ?, ?)", rows
+            )
+            self._connection.commit()
+
+    def warm(self, backend, stations, start, end):
+        """
+        Copy precipitation of stations from another backend into the store.
+
+        :param backend: WeatherBackend to fetch from, e.g. MeteostatBackend
+        :param stations: Iterable of Station
+        :param start: First date
+        :param end: Last date
+        :return: Number of stations stored
+        """
+        count = 0
+        for station in stations:
+            self.put(station, backend.precipitation(station, start, end))
+            count += 1
+        return count
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def check_weather_backend(name, frequency="monthly"):
+    """
+    Check that a backend exists and has precipitation at a frequency, so
+    a flow fails before any agent instead of once per station.
+
+    :param name: "meteostat" or "local"
+    :param frequency: "monthly" or "daily"
+    """
+    if name not in FREQUENCIES:
+        raise ValueError(f"Unknown weather backend '{name}'.")
+    if frequency not in FREQUENCIES[name]:
+        raise ValueError(f"Weather backend '{name}' has no {frequency} precipitation.")
+
+
+def get_weather_backend(name, store_path=None, frequency="monthly"):
+    """
+    :param name: "meteostat" or "local"
+    :param store_path: Path to the SQLite store when name is "local"
+    :param frequency: "monthly" or "daily" precipitation that is looked up
+    :return: WeatherBackend
+    """
+    check_weather_backend(name, frequency)
+    if name == "meteostat":
+        return MeteostatBackend()
+    if name == "local":
+        if not store_path or not os.path.isfile(store_path):
+            raise FileNotFoundError(f"Local weather store {store_path} does not exist.")
+        return LocalWeatherStore(store_path)
+
+
+def main():
+    """
+    Pre-warm a local weather store with every station in a station cache.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--station-cache", default="clean_data/station_cache.json")
+    parser.add_argument("--store", default="clean_data/weather.sqlite")
+    parser.add_argument("--start", type=int, default=1900, help="First year")
+    parser.add_argument(
+        "--end", type=int, default=datetime.now().year, help="Last year"
+    )
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.station_cache):
+        sys.stderr.write(f"ERROR: {args.station_cache} does not exist.")
+        sys.exit(1)
+
+    stations = StationResolver(cache_path=args.station_cache).stations()
+
+    store = LocalWeatherStore(args.store)
+    count = store.warm(
+        MeteostatBackend(),
+        sorted(stations),
+        datetime(args.start, 1, 1),
+        datetime(args.end, 12, 31),
+    )
+    store.close()
+
+    print(f"INFO: Stored precipitation of {count} stations in {args.store}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+This script maps a function over many items on a
+long-lived thread pool with a bounded number of
+items in flight, yielding results in input order.
+"""
+
+import os
+import concurrent.futures
+
+
+__author__ = "Gregory Sprenger"
+__license__ = "Apache 2.0"
+__version__ = "1.0.0"
+
+
+def default_workers():
+    """
+    :return: Number of worker threads to use when none is given
+    """
+    return os.cpu_count() or 1
+
+
+def default_in_flight(workers=None):
+    """
+    :param workers: Worker threads of the executor, defaults to default_workers
+    :return: Items in flight that keep the workers busy, 4 per worker
+    """
+    return 4 * (workers or default_workers())
+
+
+def map_ordered(executor, func, items, max_in_flight):
+    """
+    Submit func(item) for every item to executor and yield the results in
+    the same order as items. At most max_in_flight items are submitted or
+    waiting to be yielded at once, so a large or lazy iterable of items is
+    never loaded into memory. If any call raises, pending calls are
+    cancelled and the exception is raised to the caller.
+
+    :param executor: concurrent.futures executor shared by the flow run
+    :param func: Function to call with each item
+    :param items: Iterable of items
+    :param max_in_flight: Maximum items in flight, see default_in_flight
+    :return: Generator of func(item) results
+    """
+    items = iter(items)
+    pending = {}
+    results = {}
+    next_submit = 0
+    next_yield = 0
+    exhausted = False
+
+    try:
+        while not exhausted or pending or results:
+            # Submit until the window is full
+            while not exhausted and next_submit - next_yield < max_in_flight:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(func, item)] = next_submit
+                next_submit += 1
+
+            # Wait for at least one item to finish
+            if pending and next_yield not in results:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+
+            # Yield finished items in input order
+            while next_yield in results:
+                yield results.pop(next_yield)
+                next_yield += 1
+    finally:
+        for future in pending:
+            future.cancel()
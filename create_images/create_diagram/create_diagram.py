@@ -43,7 +43,7 @@ with Diagram(direction="TB", graph_attr=main_cluster):
             scrape_webpage << Edge(label=" Scrape webpage", color="black") >> transform
             (
                 fetch_data
-                << Edge(label="Fetch data with\nNCBI edirect tool", color="black")
+                << Edge(label="Fetch data with\nNCBI E-utilities", color="black")
                 >> transform
             )
 
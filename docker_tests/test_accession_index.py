@@ -0,0 +1,137 @@
+import os
+import sys
+import tempfile
+import unittest
+import concurrent.futures
+import pandas as pd
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from accession_index import AccessionIndex, IndexedRecords, source_key
+
+
+def record(accession, date, location):
+    return (
+        f"1: Sample {accession}\n"
+        f"Attributes:\n"
+        f'    /collection date="{date}"\n'
+        f'    /geographic location="{location}"\n'
+        f"Accession: {accession}\tID: 1\n"
+    )
+
+
+def frame(rows):
+    return pd.DataFrame(
+        rows,
+        columns=["Biosample", "Agent", "Date", "Country", "region", "Precipitation"],
+    )
+
+
+class TestAccessionIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "accessions.sqlite")
+        self.index = AccessionIndex(self.path, "config1", "code1")
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def test_lookup(self):
+        sources = {
+            "SAMN1": source_key("2020-01-01", "USA: Texas"),
+            "SAMN2": source_key("missing", "USA"),
+        }
+        self.index.store(
+            sources, frame([["SAMN1", "Anthrax", "2020-01-01", "US", "TX", 1.5]])
+        )
+
+        found = self.index.lookup(sources)
+        self.assertEqual(found["SAMN1"], ("2020-01-01", "US", "TX", 1.5))
+        self.assertEqual(found["SAMN2"], (None, None, None, None))
+
+        # A changed attribute, other settings or other code are misses
+        changed = {"SAMN1": source_key("2020-01-02", "USA: Texas")}
+        self.assertEqual(self.index.lookup(changed), {})
+        for config, code in [("config2", "code1"), ("config1", "code2")]:
+            other = AccessionIndex(self.path, config, code)
+            self.assertEqual(other.lookup(sources), {})
+            other.close()
+
+        self.assertEqual(self.index.stats()["hits"], 2)
+        self.assertEqual(self.index.stats()["misses"], 1)
+
+    def test_dropped_ttl(self):
+        sources = {
+            "SAMN1": source_key("2020-01-01", "USA: Texas"),
+            "SAMN2": source_key("missing", "USA"),
+        }
+        self.index.store(
+            sources, frame([["SAMN1", "Anthrax", "2020-01-01", "US", "TX", 1.5]])
+        )
+
+        # Dropped biosamples are resolved again once they expired
+        expired = AccessionIndex(self.path, "config1", "code1", dropped_ttl=-1)
+        self.assertEqual(list(expired.lookup(sources)), ["SAMN1"])
+        expired.close()
+
+    def test_concurrent_writers(self):
+        # Worker processes each open their own connection to the database
+        def work(i):
+            index = AccessionIndex(self.path, "config1", "code1")
+            for j in range(20):
+                accession = f"SAMN{i}_{j}"
+                index.store(
+                    {accession: source_key("2020-01-01", "USA")},
+                    frame([[accession, "Anthrax", "2020-01-01", "US", "", 1.0]]),
+                )
+                index.add_members(f"Agent{i}", [accession])
+            index.close()
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            list(executor.map(work, range(4)))
+
+        links = self.index.export_memberships(os.path.join(self.tmp.name, "m.parquet"))
+        self.assertEqual(links, 80)
+
+    def test_indexed_records(self):
+        records = [
+            record("SAMN1", "2020-01-01", "USA: Texas"),
+            record("SAMN2", "missing", "USA"),
+            record("SAMN3", "2021-05-01", "Germany"),
+        ]
+        self.index.store(
+            {
+                "SAMN1": source_key("2020-01-01", "USA: Texas"),
+                "SAMN2": source_key("missing", "USA"),
+            },
+            frame([["SAMN1", "Anthrax", "2020-01-01", "US", "TX", 1.5]]),
+        )
+
+        indexed = IndexedRecords(records, self.index, "Ricin", chunk_size=2)
+        self.assertEqual(list(indexed), [records[2]])
+        self.assertEqual(
+            indexed.rows, [["SAMN1", "Ricin", "2020-01-01", "US", "TX", 1.5]]
+        )
+        self.assertEqual(list(indexed.new_sources()), ["SAMN3"])
+
+    def test_export_memberships(self):
+        self.index.set_members("Anthrax", ["SAMN1", "SAMN2"])
+        self.index.set_members("Ricin", ["SAMN1"])
+        # Replaces the earlier members of the agent
+        self.index.set_members("Anthrax", ["SAMN2"])
+
+        path = os.path.join(self.tmp.name, "agent_membership.parquet")
+        self.assertEqual(self.index.export_memberships(path), 2)
+        self.assertEqual(
+            pq.read_table(path).to_pylist(),
+            [
+                {"Biosample": "SAMN2", "Agent": "Anthrax"},
+                {"Biosample": "SAMN1", "Agent": "Ricin"},
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
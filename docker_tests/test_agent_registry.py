@@ -0,0 +1,91 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from agent_registry import AgentRegistry
+
+
+PAGE = """<html><body>
+<ol>
+<li>Bacillus anthracis</li>
+<li>Botulinum neurotoxins (producing species)</li>
+<li>Ebola virus</li>
+</ol>
+<ol>
+<li>SARS-associated coronavirus (SARS-CoV)</li>
+<li>Yersinia pestis\xa0[Pestis]</li>
+</ol>
+</body></html>"""
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        StubHandler.requests.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(PAGE.encode())
+
+
+class TestAgentRegistry(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/list.htm"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "agent_registry.json")
+        StubHandler.requests = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def test_conditional_refresh(self):
+        registry = AgentRegistry(self.path, self.url)
+        self.assertEqual(registry.refresh(), "updated")
+        self.assertEqual(
+            registry.agents(),
+            [
+                "Bacillus anthracis",
+                "Ebola virus",
+                "Yersinia pestis",
+                "SARS-CoV",
+                "influenza virus",
+                "Botulinum neurotoxins",
+            ],
+        )
+
+        # Within max_age no request is made, afterwards only a 304
+        registry = AgentRegistry(self.path, self.url)
+        self.assertEqual(registry.refresh(), "fresh")
+        self.assertEqual(registry.refresh(max_age=0), "unchanged")
+        self.assertEqual(StubHandler.requests, [None, '"v1"'])
+
+    def test_offline(self):
+        AgentRegistry(self.path, self.url).refresh()
+        agents = AgentRegistry(self.path, self.url).agents()
+        self.server.shutdown()
+        self.server.server_close()
+
+        registry = AgentRegistry(self.path, self.url)
+        self.assertEqual(registry.refresh(max_age=0, timeout=1), "offline")
+        self.assertEqual(registry.agents(), agents)
+
+        with self.assertRaises(RuntimeError):
+            AgentRegistry(self.path + ".missing", self.url).refresh(timeout=1)
@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from biosample_parser import parse_record, split_location
+
+
+KEYS = ["collection date", "geographic location"]
+
+RECORD = (
+    "1: Sample SAMN1\n"
+    "Identifiers: BioSample: SAMN1; Sample name: 1\n"
+    "Organism: Yersinia pestis\n"
+    "Attributes:\n"
+    '{indent}/collection date="2020-01-15"\n'
+    '{indent}/geographic location="USA: Texas, Galveston"\n'
+    '{indent}/collection date="2021-01-01"\n'
+    "Accession: SAMN1\tID: 1"
+)
+
+
+class TestBiosampleParser(unittest.TestCase):
+    def test_parse_record(self):
+        parsed = parse_record(RECORD.format(indent="    "))
+        self.assertEqual(parsed.accession, "SAMN1")
+        self.assertEqual(parsed.biosample_id, "SAMN1")
+        self.assertEqual(parsed.organism, "Yersinia pestis")
+        # The first of repeated attributes is kept
+        self.assertEqual(
+            parsed.attributes,
+            {
+                "collection date": "2020-01-15",
+                "geographic location": "USA: Texas, Galveston",
+            },
+        )
+
+    def test_indent(self):
+        # Attributes indented with tabs or other numbers of spaces
+        for indent in ["\t", "  ", ""]:
+            record = RECORD.format(indent=indent)
+            for keys in [None, KEYS]:
+                parsed = parse_record(record, keys)
+                self.assertEqual(parsed.accession, "SAMN1")
+                self.assertEqual(
+                    parsed.attributes["geographic location"], "USA: Texas, Galveston"
+                )
+
+    def test_keys(self):
+        parsed = parse_record(RECORD.format(indent="    "), ["collection date"])
+        self.assertEqual(parsed.accession, "SAMN1")
+        self.assertIsNone(parsed.organism)
+        self.assertEqual(parsed.attributes, {"collection date": "2020-01-15"})
+
+    def test_missing(self):
+        parsed = parse_record("1: Sample\nAttributes:", KEYS)
+        self.assertIsNone(parsed.accession)
+        self.assertEqual(parsed.attributes, {})
+
+    def test_split_location(self):
+        self.assertEqual(
+            split_location("USA: California, Los Angeles"), ("USA", "California")
+        )
+        self.assertEqual(split_location("Germany"), ("Germany", ""))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import sys
+import json
+import subprocess
+import tempfile
+import unittest
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")
+
+# Transforms and writes a synthetic agent in a fresh process and prints
+# its peak RSS. VmHWM starts over on exec, unlike ru_maxrss which keeps
+# the high-water mark of the forking test process.
+CHILD = """
+import os
+import sys
+import json
+import concurrent.futures
+import pandas as pd
+
+sys.path.insert(0, sys.argv[1])
+
+from station_cache import Station
+from weather_backends import WeatherBackend
+from parquet_dataset import write_agent
+from agent_transform import (
+    load_geography,
+    transform_chunks,
+    transform_records,
+    write_local_chunks,
+)
+
+
+class Resolver:
+    def candidates(self, country, region=""):
+        return (Station(country + region, 0, 0),)
+
+
+class Weather(WeatherBackend):
+    def precipitation(self, station, start, end, frequency="monthly"):
+        index = pd.date_range(start.replace(day=1), end, freq="MS", name="time")
+        return pd.DataFrame({"prcp": 1.0}, index=index)
+
+
+def records(n):
+    for i in range(n):
+        yield (
+            f"{i + 1}: Sample {i}\\n"
+            f"Identifiers: BioSample: SAMN{i:09d}; Sample name: {i}\\n"
+            f"Organism: Yersinia pestis\\n"
+            f"Attributes:\\n"
+            f'    /collection date="20{i % 20:02d}-{i % 12 + 1:02d}-01"\\n'
+            f'    /geographic location="USA: Texas, Galveston"\\n'
+            f'    /host="Homo sapiens"\\n'
+            f'    /isolation source="{"x" * 200}"\\n'
+            f"Accession: SAMN{i:09d}\\tID: {i}"
+        )
+
+
+n, bounded, outpath = int(sys.argv[2]), sys.argv[3] == "1", sys.argv[4]
+countries, regions = load_geography()
+args = (
+    "Yersinia_pestis",
+    regions,
+    countries,
+    Resolver(),
+    Weather(),
+    concurrent.futures.ThreadPoolExecutor(2),
+    "monthly",
+    True,
+)
+if bounded:
+    _, rows = write_local_chunks(
+        transform_chunks(records(n), *args, max_records=5_000), "Yersinia_pestis", outpath
+    )
+else:
+    df = transform_records(records(n), *args)
+    rows = len(df)
+    write_agent(df, os.path.join(outpath, "dataset"), "Yersinia_pestis")
+with open("/proc/self/status") as f:
+    peak = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:")) / 1024
+print(json.dumps({"rows": rows, "peak_mb": peak}))
+"""
+
+
+def peak_rss(n, bounded):
+    with tempfile.TemporaryDirectory() as outpath:
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD, BIN, str(n), str(int(bounded)), outpath],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    assert result["rows"] == n, result
+    return result["peak_mb"]
+
+
+class TestBoundedMemory(unittest.TestCase):
+    def test_rss_is_flat(self):
+        small = peak_rss(20_000, bounded=True)
+        large = peak_rss(200_000, bounded=True)
+        unbounded = peak_rss(200_000, bounded=False)
+        peaks = f"peak RSS {small:.0f} MB, {large:.0f} MB, unbounded {unbounded:.0f} MB"
+
+        # Ten times the input, about the same peak
+        self.assertLess(large - small, 30, peaks)
+        self.assertLess(large, unbounded, peaks)
+
+
+if __name__ == "__main__":
+    unittest.main()
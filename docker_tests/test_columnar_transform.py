@@ -0,0 +1,95 @@
+import os
+import sys
+import glob
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from metrics import Metrics
+from record_reader import read_records
+from agent_transform import load_geography, parse_biosample
+from columnar_transform import records_to_frame, transform_frame
+
+
+RAW_DATA = os.path.join(os.path.dirname(__file__), "..", "data", "raw_data")
+
+
+def record(accession, date, location):
+    lines = [f"1: Sample {accession}", "Attributes:"]
+    if date is not None:
+        lines.append(f'    /collection date="{date}"')
+    if location is not None:
+        lines.append(f'    /geographic location="{location}"')
+    if accession is not None:
+        lines.append(f"Accession: {accession}\tID: 1")
+    return "\n".join(lines)
+
+
+# One record per filter rule
+EDGE_CASES = [
+    record("SAMN1", "2020-01-15", "USA: Texas, Galveston"),
+    record("SAMN2", "2020-1-5", "Germany"),
+    record("SAMN3", "2020-01", "USA"),
+    record("SAMN4", "missing", "USA"),
+    record("SAMN5", "2020-02-30", "USA"),
+    record("SAMN6", None, "USA"),
+    record("SAMN7", "2020-01-15", None),
+    record("SAMN8", "2020-01-15", ""),
+    record("SAMN9", "2020-01-15", "Atlantis: Capital"),
+    record(None, "2020-01-15", "USA"),
+]
+
+
+def dropped(metrics):
+    return {
+        entry["labels"]["reason"]: entry["value"]
+        for entry in metrics.to_dict()["counters"]
+        if entry["name"] == "biosamples_dropped" and entry["value"]
+    }
+
+
+class TestColumnarTransform(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.countries, cls.regions = load_geography()
+
+    def assertSameAsPerRecord(self, records):
+        per_record = Metrics()
+        expected = []
+        for biosample in records:
+            parsed = parse_biosample(
+                biosample, self.regions, self.countries, per_record
+            )
+            if parsed is not None:
+                expected.append([parsed[0], "Agent", *parsed[1:]])
+
+        columnar = Metrics()
+        df = transform_frame(
+            records_to_frame(records), "Agent", self.countries, self.regions, columnar
+        )
+
+        self.assertEqual(df.values.tolist(), expected)
+        self.assertEqual(dropped(columnar), dropped(per_record))
+
+    def test_edge_cases(self):
+        self.assertSameAsPerRecord(EDGE_CASES)
+
+    def test_raw_data(self):
+        paths = sorted(glob.glob(os.path.join(RAW_DATA, "Brucella_*.tsv.gz")))
+        if not paths:
+            self.skipTest("No raw data")
+        for path in paths:
+            self.assertSameAsPerRecord(list(read_records(path)))
+
+    def test_empty(self):
+        df = transform_frame(
+            records_to_frame([]), "Agent", self.countries, self.regions
+        )
+        self.assertEqual(
+            list(df.columns), ["Biosample", "Agent", "Date", "Country", "region"]
+        )
+        self.assertTrue(df.empty)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import threading
+import unittest
+
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from eutils import EutilsClient, EutilsError, fetch_agent
+from record_reader import read_records
+from record_stream import RecordStream
+
+
+RECORDS = [
+    f'{i + 1}: Sample {i}\nAttributes:\n    /collection date="2020-01-0{i % 9 + 1}"\n'
+    f"Accession: SAMN{i}\tID: {i}\n"
+    for i in range(23)
+]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Set per test: number of efetch requests at retstart fail_at that fail
+    failures = 0
+    fail_at = 0
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        StubHandler.requests.append((url.path, params))
+
+        if url.path.endswith("esearch.fcgi"):
+            result = {"count": str(len(RECORDS)), "webenv": "ENV", "querykey": "1"}
+            self.reply(200, json.dumps({"esearchresult": result}), "application/json")
+        elif url.path.endswith("efetch.fcgi"):
+            if StubHandler.failures > 0 and params["retstart"] == str(
+                StubHandler.fail_at
+            ):
+                StubHandler.failures -= 1
+                self.reply(503, "busy")
+                return
+            start = int(params["retstart"])
+            end = start + int(params["retmax"])
+            self.reply(200, "\n".join(RECORDS[start:end]))
+        else:
+            self.reply(404, "")
+
+
+class TestEutils(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.out_path = os.path.join(self.tmpdir.name, "Agent.tsv")
+        StubHandler.failures = 0
+        StubHandler.fail_at = 0
+        StubHandler.requests = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def fetch(self, retries=3):
+        async def run():
+            async with EutilsClient(
+                base_url=self.base_url, rate=100, retries=retries, backoff=0
+            ) as client:
+                return await fetch_agent(client, "Agent", self.out_path, retmax=5)
+
+        return asyncio.run(run())
+
+    def read_accessions(self):
+        with open(self.out_path) as f:
+            records = [r for r in f.read().split("\n\n") if r.strip()]
+        return [r.rsplit("Accession: ", 1)[1].split("\t")[0] for r in records]
+
+    def efetch_starts(self):
+        return [
+            int(params["retstart"])
+            for path, params in StubHandler.requests
+            if path.endswith("efetch.fcgi")
+        ]
+
+    def test_fetch_in_batches(self):
+        self.assertEqual(self.fetch(), 23)
+        self.assertEqual(self.read_accessions(), [f"SAMN{i}" for i in range(23)])
+        self.assertEqual(self.efetch_starts(), [0, 5, 10, 15, 20])
+        self.assertFalse(os.path.exists(f"{self.out_path}.checkpoint"))
+
+    def test_retry(self):
+        StubHandler.failures = 2
+        self.assertEqual(self.fetch(), 23)
+        self.assertEqual(len(self.read_accessions()), 23)
+        self.assertEqual(self.efetch_starts(), [0, 0, 0, 5, 10, 15, 20])
+
+    def test_resume(self):
+        # The third batch fails without retries, so the download stops there
+        StubHandler.failures = 1
+        StubHandler.fail_at = 10
+        with self.assertRaises(EutilsError):
+            self.fetch(retries=0)
+        self.assertTrue(os.path.exists(f"{self.out_path}.checkpoint"))
+        self.assertFalse(os.path.exists(self.out_path))
+
+        StubHandler.requests = []
+        self.assertEqual(self.fetch(), 23)
+        self.assertEqual(self.efetch_starts(), [10, 15, 20])
+        self.assertEqual(self.read_accessions(), [f"SAMN{i}" for i in range(23)])
+
+    def test_record_stream(self):
+        stream = RecordStream(
+            ["Agent", "Other agent"], self.tmpdir.name, base_url=self.base_url, retmax=5
+        )
+
+        for term in ["Agent", "Other agent"]:
+            records = list(stream.records(term))
+            self.assertEqual(records, [r.rstrip("\n") for r in RECORDS])
+            # Raw text is complete once the records are exhausted
+            self.assertEqual(list(read_records(stream.raw_path(term))), records)
+
+    def test_record_stream_error(self):
+        StubHandler.failures = 1
+        StubHandler.fail_at = 5
+        stream = RecordStream(
+            ["Agent"], self.tmpdir.name, base_url=self.base_url, retmax=5, retries=0
+        )
+
+        with self.assertRaises(EutilsError):
+            list(stream.records("Agent"))
+
+    def test_record_stream_close(self):
+        stream = RecordStream(
+            ["Agent", "Other agent"],
+            self.tmpdir.name,
+            base_url=self.base_url,
+            retmax=5,
+            max_batches=1,
+        )
+
+        # Abandoned agents and the ones not read yet stop downloading
+        records = stream.records("Agent")
+        next(records)
+        records.close()
+        stream.close()
+        self.assertFalse(stream._thread.is_alive())
+
+        # Their partial raw files are closed and removed
+        self.assertEqual(
+            [name for name in os.listdir(self.tmpdir.name) if name.endswith(".part")],
+            [],
+        )
@@ -0,0 +1,107 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from prefect import task
+from prefect.states import Completed, Running
+
+import fan_out_agents
+from fan_out_agents import wait_first
+
+
+class Future:
+    def __init__(self, polls):
+        # Polls until the task run is finished
+        self.polls = polls
+
+    def get_state(self):
+        self.polls -= 1
+        return Completed() if self.polls <= 0 else Running()
+
+    def wait(self):
+        return Completed()
+
+
+@task
+def fail_ricin(term, local_inpath, api_key=None, rate=None):
+    if term == "Ricin":
+        raise RuntimeError("Download failed")
+    return 1
+
+
+@task
+def skip_agent(term, settings, incremental=True):
+    return {"filename": term, "status": "unchanged"}
+
+
+class TestFanOutAgents(unittest.TestCase):
+    def test_wait_first(self):
+        large, small, other = Future(polls=5), Future(polls=2), Future(polls=3)
+        downloading = [("large", large), ("small", small)]
+        processing = [("other", other)]
+
+        # The agent submitted later finishes first and frees its slot
+        runs, term, future, state = wait_first(downloading, processing, interval=0)
+        self.assertIs(runs, downloading)
+        self.assertEqual((term, future), ("small", small))
+        self.assertTrue(state.is_completed())
+        self.assertEqual(downloading, [("large", large)])
+        self.assertEqual(processing, [("other", other)])
+
+    def test_failed_download(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        with open(os.path.join(tmpdir.name, "agents_list.txt"), "w") as f:
+            f.write("Abrin\nRicin\nSaxitoxin\n")
+
+        errors = []
+
+        def run():
+            try:
+                fan_out_agents.fan_out_agents(
+                    reuse_accessions=False, ncbi_concurrency=1
+                )
+            except Exception as e:
+                errors.append(e)
+
+        # The agent whose download failed is reported, not waited on forever
+        cwd = os.getcwd()
+        os.chdir(tmpdir.name)
+        self.addCleanup(os.chdir, cwd)
+        with mock.patch.multiple(
+            fan_out_agents,
+            scrape_agents_webpage=lambda start, end: None,
+            fetch_agent_data=fail_ricin,
+            process_agent=skip_agent,
+        ):
+            thread = threading.Thread(target=run, daemon=True)
+            thread.start()
+            thread.join(timeout=120)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([str(e) for e in errors], ["Agents failed: Ricin."])
+
+    def test_worker_context_frequency(self):
+        get_weather_backend = mock.Mock()
+        with mock.patch.multiple(
+            fan_out_agents,
+            make_station_resolver=mock.Mock(),
+            get_weather_backend=get_weather_backend,
+        ):
+            context = fan_out_agents.WorkerContext(
+                "clean_data", True, 0, "meteostat", "daily", "local", 1, False, "", ""
+            )
+        context.executor.shutdown()
+
+        get_weather_backend.assert_called_once_with(
+            "meteostat", os.path.join("clean_data", "weather.sqlite"), "daily"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import unittest
+import concurrent.futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from gazetteer import Gazetteer, load_gazetteer, normalize
+
+
+class TestGazetteer(unittest.TestCase):
+    def setUp(self):
+        self.gazetteer = load_gazetteer()
+
+    def test_normalize(self):
+        self.assertEqual(normalize(" Göttingen (Lower Saxony)"), "GOTTINGEN")
+        self.assertEqual(normalize("Cote d'Ivoire"), "COTE D IVOIRE")
+        self.assertEqual(normalize("Tyne & Wear"), "TYNE AND WEAR")
+
+    def test_resolve(self):
+        cases = {
+            "USA: Texas, Galveston": ("US", "TX"),
+            "usa:texas": ("US", "TX"),
+            "Russia: Moscow": ("RU", ""),
+            "Tanzania": ("TZ", ""),
+            "Newry, Northern Ireland": ("GB", ""),
+            "Germany, Göttingen": ("DE", ""),
+            "China (Original Japan)": ("CN", ""),
+            "missing": ("", ""),
+            "NA": ("", ""),
+            "": ("", ""),
+        }
+        for location, expected in cases.items():
+            self.assertEqual(self.gazetteer.resolve(location), expected, location)
+
+        self.gazetteer.resolve("USA: Texas, Galveston")
+        self.assertEqual(self.gazetteer.stats()["hits"], 1)
+        self.assertEqual(self.gazetteer.stats()["size"], len(cases))
+
+    def test_region_of_country(self):
+        # Merida is a Venezuelan region and Messina an Italian one
+        self.assertEqual(self.gazetteer.resolve("Spain: Merida"), ("ES", ""))
+        self.assertEqual(self.gazetteer.resolve("Venezuela: Merida"), ("VE", "ME"))
+        self.assertEqual(self.gazetteer.resolve("Italy: Messina"), ("IT", "ME"))
+        self.assertEqual(self.gazetteer.resolve("USA: Messina, Maine"), ("US", "ME"))
+
+    def test_memo(self):
+        gazetteer = Gazetteer({"USA": "US"}, {"US": {"TEXAS": "TX"}}, maxsize=2)
+        locations = ["USA: Texas", "USA", "USA: Texas", "USA: Ohio"] * 50
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            resolved = list(executor.map(gazetteer.resolve, locations))
+
+        self.assertEqual(
+            resolved[:4], [("US", "TX"), ("US", ""), ("US", "TX"), ("US", "")]
+        )
+        stats = gazetteer.stats()
+        self.assertEqual(stats["hits"] + stats["misses"], len(locations))
+        self.assertEqual(stats["size"], 2)
+
+    def test_fuzzy(self):
+        countries = {"SWITZERLAND": "CH"}
+        self.assertEqual(Gazetteer(countries, {}).resolve("Swtizerland"), ("", ""))
+        self.assertEqual(
+            Gazetteer(countries, {}, fuzzy=True).resolve("Swtizerland"), ("CH", "")
+        )
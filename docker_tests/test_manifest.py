@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from manifest import Manifest, code_version, config_version
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "manifest.json")
+        self.output = os.path.join(self.tmpdir.name, "_partitions.json")
+        open(self.output, "w").close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, text):
+        with open(os.path.join(self.tmpdir.name, name), "w") as f:
+            f.write(text)
+
+    def test_is_current(self):
+        manifest = Manifest(self.path)
+        self.assertFalse(manifest.is_current("Ricin", "input", "code", "config"))
+        manifest.record("Ricin", "input", "code", "config", self.output)
+
+        # Saved and loaded again
+        manifest = Manifest(self.path)
+        self.assertTrue(manifest.is_current("Ricin", "input", "code", "config"))
+        self.assertFalse(manifest.is_current("Ricin", "other", "code", "config"))
+        self.assertFalse(manifest.is_current("Ricin", "input", "other", "config"))
+        self.assertFalse(manifest.is_current("Ricin", "input", "code", "other"))
+        self.assertFalse(manifest.is_current("Abrin", "input", "code", "config"))
+
+        # Agents whose output was removed are built again
+        os.remove(self.output)
+        self.assertFalse(manifest.is_current("Ricin", "input", "code", "config"))
+
+    def test_code_version(self):
+        files = ["agent_transform.py", "countries.json"]
+        self.write("agent_transform.py", "x = 1")
+        self.write("deploy.py", "y = 1")
+        version = code_version(self.tmpdir.name, files)
+
+        # Only the transform's files count
+        self.write("deploy.py", "y = 2")
+        self.assertEqual(code_version(self.tmpdir.name, files), version)
+        self.write("countries.json", "{}")
+        self.assertNotEqual(code_version(self.tmpdir.name, files), version)
+
+    def test_config_version(self):
+        self.assertEqual(
+            config_version({"batch": True, "frequency": "monthly"}),
+            config_version({"frequency": "monthly", "batch": True}),
+        )
+        self.assertNotEqual(
+            config_version({"batch": True}), config_version({"batch": False})
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
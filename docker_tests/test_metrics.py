@@ -0,0 +1,68 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics(prefix="test")
+        self.metrics.count("biosamples_dropped", reason="missing_date")
+        self.metrics.count("biosamples_dropped", 2, reason="missing_date")
+        self.metrics.count("biosamples_dropped", reason="no_station")
+        self.metrics.gauge("station_cache_hit_rate", 0.5)
+        self.metrics.observe("write_gcs", 0.02)
+        self.metrics.observe("write_gcs", 7.0)
+
+    def test_to_dict(self):
+        data = self.metrics.to_dict()
+
+        counters = {
+            entry["labels"]["reason"]: entry["value"] for entry in data["counters"]
+        }
+        self.assertEqual(counters, {"missing_date": 3, "no_station": 1})
+        self.assertEqual(data["gauges"][0]["value"], 0.5)
+
+        histogram = data["histograms"][0]
+        self.assertEqual(histogram["count"], 2)
+        self.assertEqual(histogram["buckets"]["0.05"], 1)
+        self.assertEqual(histogram["buckets"]["10.0"], 1)
+
+    def test_merge(self):
+        merged = Metrics(prefix="test")
+        merged.count("biosamples_dropped", reason="no_station")
+        merged.merge(self.metrics.to_dict())
+        merged.merge(self.metrics.to_dict())
+
+        data = merged.to_dict()
+        counters = {
+            entry["labels"]["reason"]: entry["value"] for entry in data["counters"]
+        }
+        self.assertEqual(counters, {"missing_date": 6, "no_station": 3})
+        self.assertEqual(data["gauges"][0]["value"], 0.5)
+        self.assertEqual(data["histograms"][0]["count"], 4)
+        self.assertEqual(data["histograms"][0]["buckets"]["10.0"], 2)
+
+    def test_to_prometheus(self):
+        text = self.metrics.to_prometheus()
+
+        self.assertIn("# TYPE test_biosamples_dropped_total counter", text)
+        self.assertIn('test_biosamples_dropped_total{reason="missing_date"} 3', text)
+        self.assertIn("test_station_cache_hit_rate 0.5", text)
+        # Buckets are cumulative
+        self.assertIn('test_write_gcs_seconds_bucket{le="0.05"} 1', text)
+        self.assertIn('test_write_gcs_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn("test_write_gcs_seconds_count 2", text)
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = self.metrics.export(tmpdir, "run")
+
+            with open(path) as f:
+                self.assertEqual(json.load(f), self.metrics.to_dict())
+            self.assertTrue(os.path.isfile(os.path.join(tmpdir, "run.prom")))
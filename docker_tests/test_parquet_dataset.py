@@ -0,0 +1,146 @@
+import os
+import sys
+import datetime
+import tempfile
+import unittest
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from parquet_dataset import (
+    OUTPUT_SCHEMA,
+    ChunkedWriter,
+    DatasetWriter,
+    count_rows,
+    iter_frames,
+    read_dataset,
+    read_partitions,
+    write_agent,
+)
+
+
+def frame(agent, rows, dates=("2020-01-01",), precipitation=1.5, region="TX"):
+    return pd.DataFrame(
+        {
+            "Biosample": [f"SAMN{i}" for i in range(rows)],
+            "Agent": agent,
+            "Date": [dates[i % len(dates)] for i in range(rows)],
+            "Country": "US",
+            "region": region,
+            "Precipitation": precipitation,
+        }
+    )
+
+
+class TestParquetDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, "dataset")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def paths(self, agent):
+        index = os.path.join(self.root, f"agent={agent}", "_partitions.json")
+        return [
+            os.path.join(os.path.dirname(index), part["path"])
+            for part in read_partitions(index)
+        ]
+
+    def test_count_rows(self):
+        empty = os.path.join(self.tmpdir.name, "empty.parquet")
+        open(empty, "w").close()
+
+        write_agent(frame("a", 3), self.root, "a")
+        write_agent(frame("b", 0), self.root, "b")
+
+        self.assertEqual(count_rows(self.paths("a")[0]), 3)
+        self.assertEqual(self.paths("b"), [])
+        self.assertIsNone(count_rows(empty))
+        self.assertIsNone(count_rows(os.path.join(self.tmpdir.name, "missing")))
+
+    def test_write_agent(self):
+        dates = ["2019-05-01", "2020-01-01", "not a date"]
+        write_agent(frame("a", 9, dates, precipitation="2"), self.root, "a")
+
+        paths = self.paths("a")
+        self.assertEqual(
+            [os.path.relpath(path, self.root) for path in paths],
+            [
+                "agent=a/year=2019/part-0.parquet",
+                "agent=a/year=2020/part-0.parquet",
+                "agent=a/year=__HIVE_DEFAULT_PARTITION__/part-0.parquet",
+            ],
+        )
+        metadata = pq.ParquetFile(paths[0]).metadata
+        self.assertEqual(pq.read_schema(paths[0]), OUTPUT_SCHEMA)
+        self.assertEqual(metadata.row_group(0).column(2).compression, "ZSTD")
+        self.assertTrue(metadata.row_group(0).column(2).is_stats_set)
+
+        # Writes append row groups, closing replaces the previous partitions
+        with DatasetWriter(self.root, "a", row_group_size=2) as writer:
+            writer.write(frame("a", 3, ["2021-01-01"]))
+            writer.write(frame("a", 3, ["2021-01-01"]))
+        paths = self.paths("a")
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(pq.ParquetFile(paths[0]).metadata.num_row_groups, 4)
+        self.assertEqual(os.listdir(self.root), ["agent=a"])
+
+    def test_chunked_writer(self):
+        # Small writes are buffered until max_rows, flushed in row groups of it
+        with ChunkedWriter(self.root, "a", max_rows=10) as writer:
+            for _ in range(7):
+                writer.write(frame("a", 3))
+        self.assertEqual(writer.flushes, 2)
+        self.assertEqual(writer.rows, 21)
+        metadata = pq.ParquetFile(self.paths("a")[0]).metadata
+        self.assertEqual(
+            [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)],
+            [10, 2, 9],
+        )
+
+        # Or flushed once the buffered dataframes exceed max_bytes
+        with ChunkedWriter(self.root, "a", max_bytes=1) as writer:
+            writer.write(frame("a", 3))
+            writer.write(frame("a", 3))
+        self.assertEqual(writer.flushes, 2)
+
+    def test_iter_frames(self):
+        write_agent(frame("a", 7, region=None, precipitation=0.1), self.root, "a")
+        write_agent(frame("b", 0), self.root, "b")
+        write_agent(frame("c", 5, ["2019-01-01", "2020-06-01"]), self.root, "c")
+        paths = self.paths("a") + self.paths("b") + self.paths("c")
+
+        frames = list(iter_frames(paths, batch_size=4))
+
+        self.assertTrue(all(len(df) <= 7 for df in frames))
+        df = pd.concat(frames)
+        self.assertEqual(len(df), 12)
+        self.assertEqual(df["Precipitation"].dtype, "float64")
+        # Read back exactly as written
+        self.assertEqual(sorted(set(df["Precipitation"])), [0.1, 1.5])
+        self.assertEqual(df["region"].isna().sum(), 7)
+        self.assertEqual(df["Date"].iloc[0], datetime.date(2020, 1, 1))
+        self.assertEqual(list(iter_frames([])), [])
+
+        # Filters and columns are pushed down to the files
+        frames = list(
+            iter_frames(
+                paths,
+                filter=ds.field("Date") < datetime.date(2020, 1, 1),
+                columns=["Biosample", "Agent"],
+            )
+        )
+        self.assertEqual(list(frames[0].columns), ["Biosample", "Agent"])
+        self.assertEqual(len(frames[0]), 3)
+
+    def test_read_dataset(self):
+        write_agent(frame("a", 4, ["2019-01-01", "2020-01-01"]), self.root, "a")
+        write_agent(frame("b", 3), self.root, "b")
+
+        self.assertEqual(len(read_dataset(self.root)), 7)
+        df = read_dataset(self.root, agents=["a"], years=[2020])
+        self.assertEqual(len(df), 2)
+        self.assertEqual(set(df["Agent"]), {"a"})
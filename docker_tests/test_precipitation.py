@@ -0,0 +1,86 @@
+import os
+import sys
+import unittest
+import concurrent.futures
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from station_cache import Station
+from weather_backends import WeatherBackend
+from precipitation import add_precipitation
+
+
+COLUMNS = ["Biosample", "Agent", "Date", "Country", "region"]
+
+
+class Resolver:
+    # Texas has two candidate stations, Germany none
+    def candidates(self, country, region=""):
+        if country == "US" and region == "TX":
+            return (Station("TX1", 0, 0), Station("TX2", 0, 0))
+        if country == "US":
+            return (Station(f"US{region}", 0, 0),)
+        return ()
+
+
+class CountingBackend(WeatherBackend):
+    # TX1 has no data before 2020, every other station reports its month
+    def __init__(self):
+        self.requests = []
+
+    def precipitation(self, station, start, end, frequency="monthly"):
+        self.requests.append((station.id, start, end))
+        index = pd.date_range(start.replace(day=1), end, freq="MS", name="time")
+        if station.id == "TX1":
+            index = index[index.year >= 2020]
+        return pd.DataFrame({"prcp": index.month.astype(float)}, index=index)
+
+
+class TestPrecipitation(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame(
+            [
+                ["SAMN1", "Agent", "2020-03-10", "US", "TX"],
+                ["SAMN2", "Agent", "2019-05-02", "US", "TX"],
+                ["SAMN3", "Agent", "2021-07-01", "US", "GA"],
+                ["SAMN4", "Agent", "2020-01-01", "DE", ""],
+                ["SAMN5", "Agent", "not a date", "US", "GA"],
+                ["SAMN6", "Agent", "2020-08-20", "US", "TX"],
+            ],
+            columns=COLUMNS,
+        )
+
+    def test_one_request_per_station(self):
+        backend = CountingBackend()
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            df = add_precipitation(
+                self.df, Resolver(), "monthly", executor, weather_backend=backend
+            )
+
+        # Rows without a station or a valid date are dropped, the order is kept
+        self.assertEqual(list(df.columns), COLUMNS + ["Precipitation"])
+        self.assertEqual(list(df["Biosample"]), ["SAMN1", "SAMN2", "SAMN3", "SAMN6"])
+        self.assertEqual(list(df["Precipitation"]), [3.0, 5.0, 7.0, 8.0])
+
+        # TX1 covers all Texas dates at once, SAMN2 falls back to TX2
+        stations = sorted(station for station, _, _ in backend.requests)
+        self.assertEqual(stations, ["TX1", "TX2", "USGA"])
+
+    def test_daily_without_executor(self):
+        backend = CountingBackend()
+        df = add_precipitation(
+            self.df.iloc[[2]], Resolver(), "daily", weather_backend=backend
+        )
+        self.assertEqual(list(df["Precipitation"]), [7.0])
+
+    def test_empty(self):
+        df = add_precipitation(
+            pd.DataFrame(columns=COLUMNS), Resolver(), weather_backend=CountingBackend()
+        )
+        self.assertTrue(df.empty)
+        self.assertEqual(list(df.columns), COLUMNS + ["Precipitation"])
+
+
+if __name__ == "__main__":
+    unittest.main()
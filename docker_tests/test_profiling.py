@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import pstats
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from profiling import profiled, section, start_profiling, stop_profiling
+
+
+@profiled(sample_every=3)
+def hot(n):
+    return sum(range(n))
+
+
+@profiled
+def outer():
+    return hot(10)
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        stop_profiling()
+        self.tmp.cleanup()
+
+    def test_off(self):
+        self.assertEqual(hot(10), 45)
+        with section("loop"):
+            pass
+
+        profiler = start_profiling(self.tmp.name)
+        stop_profiling()
+        hot(10)
+        self.assertEqual(profiler.calls, {})
+
+    def test_sample_every(self):
+        profiler = start_profiling(self.tmp.name)
+        for _ in range(7):
+            hot(10)
+
+        self.assertEqual(profiler.calls["hot"], 7)
+        self.assertEqual(profiler.profiled["hot"], 3)
+        stats = profiler.stats()["hot"]
+        (calls,) = [
+            entry[1]
+            for (_, _, function), entry in stats.stats.items()
+            if function == "hot"
+        ]
+        self.assertEqual(calls, 3)
+
+    def test_outermost_section(self):
+        profiler = start_profiling(self.tmp.name)
+        outer()
+
+        # hot is profiled as part of outer
+        self.assertEqual(profiler.calls, {"outer": 1, "hot": 1})
+        self.assertEqual(list(profiler.stats()), ["outer"])
+
+    def test_export(self):
+        profiler = start_profiling(self.tmp.name)
+        outer()
+        with section("loop", sampled=True):
+            busy(0.1)
+
+        path = profiler.export("run")
+        directory = os.path.join(self.tmp.name, "run")
+        self.assertEqual(
+            sorted(os.listdir(directory)), ["loop.folded", "outer.prof", "summary.md"]
+        )
+        pstats.Stats(os.path.join(directory, "outer.prof"))
+
+        with open(os.path.join(directory, "loop.folded")) as f:
+            stacks = f.read().splitlines()
+        self.assertTrue(all("test_profiling.py" in stack for stack in stacks))
+        self.assertGreater(sum(int(stack.rsplit(" ", 1)[1]) for stack in stacks), 5)
+
+        with open(path) as f:
+            summary = f.read()
+        self.assertIn("| loop | 1 of 1 |", summary)
+        self.assertIn("| outer | 1 of 1 |", summary)
+        self.assertIn("(busy)` | sampled |", summary)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import gzip
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from record_reader import find_raw_file, iter_chunks, iter_records, read_records
+
+
+TEXT = (
+    "1: Sample 1\n"
+    "Accession: SAMN1\tID: 1\n"
+    "\n"
+    "\n"
+    "2: Sample 2\r\n"
+    "Accession: SAMN2\tID: 2\r\n"
+    "\n"
+    "3: Sample 3\n"
+    "Accession: SAMN3\tID: 3"
+)
+RECORDS = [
+    "1: Sample 1\nAccession: SAMN1\tID: 1",
+    "2: Sample 2\nAccession: SAMN2\tID: 2",
+    "3: Sample 3\nAccession: SAMN3\tID: 3",
+]
+
+
+class TestRecordReader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, compress):
+        path = os.path.join(self.tmpdir.name, name)
+        with (gzip.open if compress else open)(path, "wt", newline="") as f:
+            f.write(TEXT)
+        return path
+
+    def test_plain_and_gzip(self):
+        self.assertEqual(list(read_records(self.write("A.tsv", False))), RECORDS)
+        self.assertEqual(list(read_records(self.write("B.tsv.gz", True))), RECORDS)
+        # Compression is detected from the contents, not the name
+        self.assertEqual(list(read_records(self.write("C.tsv", True))), RECORDS)
+
+    def test_find_raw_file(self):
+        gz = self.write("A.tsv.gz", True)
+        self.assertEqual(find_raw_file(self.tmpdir.name, "A"), gz)
+        plain = self.write("A.tsv", False)
+        self.assertEqual(find_raw_file(self.tmpdir.name, "A"), plain)
+        self.assertIsNone(find_raw_file(self.tmpdir.name, "B"))
+
+    def test_iter_records(self):
+        self.assertEqual(list(iter_records([])), [])
+        self.assertEqual(list(iter_records(["\n", "a\n", "b"])), ["a\nb"])
+
+    def test_iter_chunks(self):
+        self.assertEqual(
+            list(iter_chunks(["a", "b", "c", "d", "e"], 2, 100)),
+            [["a", "b"], ["c", "d"], ["e"]],
+        )
+        self.assertEqual(
+            list(iter_chunks(["aaa", "b", "cc"], 10, 3)), [["aaa"], ["b", "cc"]]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
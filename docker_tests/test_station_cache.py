@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from station_cache import Station, StationResolver
+
+
+class CountingIndex:
+    # Stands in for meteostat, only the US has stations
+    def __init__(self):
+        self.lookups = []
+
+    def nearest(self, country, region="", k=5):
+        self.lookups.append((country, region))
+        if country != "US":
+            return []
+        return [Station(f"{country}{region}", 30.0, -90.0)]
+
+
+class TestStationCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "station_cache.json")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_memoized(self):
+        index = CountingIndex()
+        resolver = StationResolver(index=index)
+
+        for _ in range(3):
+            self.assertEqual(resolver.resolve("US", "TX").id, "USTX")
+            # Pairs without a station are cached too
+            self.assertIsNone(resolver.resolve("ZZ"))
+        self.assertIsNone(resolver.resolve(""))
+
+        self.assertEqual(index.lookups, [("US", "TX"), ("ZZ", "")])
+        self.assertEqual(resolver.stats()["hits"], 4)
+        self.assertEqual(resolver.stats()["misses"], 2)
+
+    def test_lru(self):
+        index = CountingIndex()
+        resolver = StationResolver(maxsize=2, index=index)
+
+        resolver.resolve("US", "TX")
+        resolver.resolve("US", "GA")
+        resolver.resolve("US", "TX")
+        # Evicts GA, the least recently used pair
+        resolver.resolve("US", "CA")
+        resolver.resolve("US", "TX")
+        resolver.resolve("US", "GA")
+
+        self.assertEqual(
+            index.lookups, [("US", "TX"), ("US", "GA"), ("US", "CA"), ("US", "GA")]
+        )
+
+    def test_persisted(self):
+        resolver = StationResolver(cache_path=self.path, index=CountingIndex())
+        resolver.resolve("US", "TX")
+        resolver.resolve("ZZ")
+        resolver.save()
+
+        index = CountingIndex()
+        resolver = StationResolver(cache_path=self.path, index=index)
+        self.assertEqual(resolver.resolve("US", "TX"), Station("USTX", 30.0, -90.0))
+        self.assertIsNone(resolver.resolve("ZZ"))
+        self.assertEqual(index.lookups, [])
+        self.assertEqual(
+            sorted(os.listdir(self.tmpdir.name)),
+            ["station_cache.json", "station_cache.json.lock"],
+        )
+
+    def test_save_merges(self):
+        # Two worker processes resolve different pairs from the same cache
+        first = StationResolver(cache_path=self.path, index=CountingIndex())
+        second = StationResolver(cache_path=self.path, index=CountingIndex())
+        first.resolve("US", "TX")
+        second.resolve("US", "GA")
+        first.save()
+        second.save()
+
+        index = CountingIndex()
+        resolver = StationResolver(cache_path=self.path, index=index)
+        resolver.resolve("US", "TX")
+        resolver.resolve("US", "GA")
+        self.assertEqual(index.lookups, [])
+
+    def test_load_single_station_cache(self):
+        # Caches from before candidate stations held one station or None
+        with open(self.path, "w") as f:
+            json.dump({"US|TX": ["72243", 29.9, -95.3], "ZZ|": None}, f)
+
+        resolver = StationResolver(cache_path=self.path, index=CountingIndex())
+        self.assertEqual(
+            resolver.candidates("US", "TX"), (Station("72243", 29.9, -95.3),)
+        )
+        self.assertEqual(resolver.candidates("ZZ"), ())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import unittest
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from station_cache import StationResolver
+from station_index import StationIndex
+from weather_backends import WeatherBackend
+from precipitation import add_precipitation
+
+
+INVENTORY = pd.DataFrame(
+    {
+        "id": ["A", "B", "C", "D"],
+        "country": ["US", "US", "US", "DE"],
+        "region": ["GA", "GA", "TX", None],
+        "latitude": [33.0, 34.0, 31.0, 52.5],
+        "longitude": [-84.0, -84.5, -99.0, 13.4],
+        "monthly_start": pd.to_datetime(
+            ["1950-01-01", "1960-01-01", None, "1940-01-01"]
+        ),
+    }
+).set_index("id")
+
+
+class FakeBackend(WeatherBackend):
+    # Station A has no data, station B reports 1.0 for every month
+    def precipitation(self, station, start, end, frequency="monthly"):
+        if station.id == "A":
+            return pd.DataFrame({"prcp": []}, index=pd.DatetimeIndex([], name="time"))
+        index = pd.date_range(start.replace(day=1), end, freq="MS", name="time")
+        return pd.DataFrame({"prcp": 1.0}, index=index)
+
+
+class TestStationIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = StationIndex(INVENTORY)
+
+    def test_skips_stations_without_monthly_data(self):
+        self.assertNotIn("C", self.index.ids)
+
+    def test_nearest_to_region_centroid(self):
+        stations = self.index.nearest("US", "GA", k=2)
+        self.assertEqual({s.id for s in stations}, {"A", "B"})
+
+    def test_nearest_to_country_centroid(self):
+        self.assertEqual(self.index.nearest("DE", k=1)[0].id, "D")
+
+    def test_unknown_country(self):
+        self.assertEqual(self.index.nearest("ZZ"), [])
+
+    def test_region_falls_back_to_country(self):
+        self.assertEqual(self.index.centroid("DE", "XX"), self.index.centroid("DE"))
+
+    def test_add_precipitation_falls_back_to_next_station(self):
+        resolver = StationResolver(index=self.index, k=2)
+        first = resolver.resolve("US", "GA")
+
+        df = pd.DataFrame(
+            [["SAMN1", "Agent", "2020-02-10", "US", "GA"]],
+            columns=["Biosample", "Agent", "Date", "Country", "region"],
+        )
+        df = add_precipitation(df, resolver, weather_backend=FakeBackend())
+
+        self.assertEqual(list(df["Precipitation"]), [1.0])
+        self.assertEqual(resolver.candidates("US", "GA")[0], first)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from storage_backends import LocalStorage, Uploader, md5_file
+
+
+class FlakyStorage(LocalStorage):
+    # Fails the first upload of every object
+    def __init__(self, root):
+        super().__init__(root)
+        self.attempts = {}
+
+    def upload(self, from_path, to_path):
+        self.attempts[to_path] = self.attempts.get(to_path, 0) + 1
+        if self.attempts[to_path] == 1:
+            raise ConnectionError("connection reset")
+        super().upload(from_path, to_path)
+
+
+class TestUploader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.files = []
+        for i in range(5):
+            path = os.path.join(self.tmpdir.name, f"agent_{i}.parquet.gz")
+            with open(path, "wb") as f:
+                f.write(os.urandom(1024))
+            self.files.append(path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def upload_all(self, storage):
+        with Uploader(storage, max_workers=2, max_pending=2, backoff=0) as uploader:
+            futures = [
+                uploader.submit(path, f"data/{os.path.basename(path)}")
+                for path in self.files
+            ]
+        return uploader, [future.result() for future in futures]
+
+    def test_upload_and_skip_unchanged(self):
+        storage = LocalStorage(os.path.join(self.tmpdir.name, "bucket"))
+
+        uploader, results = self.upload_all(storage)
+        self.assertEqual(results, [True] * 5)
+        for path in self.files:
+            self.assertEqual(
+                storage.checksum(f"data/{os.path.basename(path)}"), md5_file(path)
+            )
+
+        uploader, results = self.upload_all(storage)
+        self.assertEqual(results, [False] * 5)
+        self.assertEqual(uploader.skipped, 5)
+
+    def test_retry(self):
+        storage = FlakyStorage(os.path.join(self.tmpdir.name, "bucket"))
+
+        uploader, results = self.upload_all(storage)
+        self.assertEqual(results, [True] * 5)
+        self.assertEqual(set(storage.attempts.values()), {2})
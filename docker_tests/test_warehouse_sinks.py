@@ -0,0 +1,85 @@
+import os
+import sys
+import tempfile
+import unittest
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from warehouse_sinks import COLUMNS, SQLiteSink
+
+
+def agent_frame(agent, biosamples, precipitation=1.5):
+    return pd.DataFrame(
+        {
+            "Biosample": biosamples,
+            "Agent": agent,
+            "Date": "2020-01-01",
+            "Country": "US",
+            "region": None,
+            "Precipitation": precipitation,
+        }
+    )
+
+
+class TestSQLiteSink(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.sink = SQLiteSink(os.path.join(self.tmpdir.name, "warehouse.sqlite"))
+
+    def tearDown(self):
+        self.sink.close()
+        self.tmpdir.cleanup()
+
+    def load(self, df, watermarks):
+        self.sink.begin()
+        self.sink.load(df)
+        self.sink.merge(watermarks)
+
+    def test_merge_is_idempotent(self):
+        df = pd.concat(
+            [agent_frame("A", ["SAMN1", "SAMN2"]), agent_frame("B", ["SAMN1"])]
+        )
+
+        self.load(df, {"A": "a1", "B": "b1"})
+        self.load(df, {"A": "a1", "B": "b1"})
+
+        table = self.sink.read()
+        self.assertEqual(len(table), 3)
+        self.assertEqual(self.sink.watermarks(), {"A": "a1", "B": "b1"})
+
+        throughput = self.sink.throughput()
+        self.assertEqual(throughput["rows"], 6)
+        self.assertGreater(throughput["bytes"], 0)
+
+    def test_merge_changed_agent(self):
+        self.load(
+            pd.concat(
+                [agent_frame("A", ["SAMN1", "SAMN2"]), agent_frame("B", ["SAMN1"])]
+            ),
+            {"A": "a1", "B": "b1"},
+        )
+
+        # SAMN2 was dropped from A and SAMN1 updated, B is untouched
+        self.load(agent_frame("A", ["SAMN1", "SAMN3"], 4.0), {"A": "a2"})
+
+        table = self.sink.read().set_index(["Agent", "Biosample"])["Precipitation"]
+        self.assertEqual(
+            table.to_dict(),
+            {("A", "SAMN1"): 4.0, ("A", "SAMN3"): 4.0, ("B", "SAMN1"): 1.5},
+        )
+        self.assertEqual(self.sink.watermarks(), {"A": "a2", "B": "b1"})
+
+    def test_merge_duplicates(self):
+        # The latest date wins, whichever order the rows were staged in
+        rows = [
+            ["SAMN1", "A", "2020-01-01", "US", None, 1.0],
+            ["SAMN1", "A", "2020-03-01", "US", "TX", 3.0],
+            ["SAMN1", "A", "2020-03-01", "US", None, 2.0],
+        ]
+        for order in (rows, rows[::-1]):
+            self.load(pd.DataFrame(order, columns=COLUMNS), {"A": "a1"})
+            self.assertEqual(
+                self.sink.read().values.tolist(),
+                [["SAMN1", "A", "2020-03-01", "US", None, 2.0]],
+            )
@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+import unittest
+import pandas as pd
+
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from station_cache import Station
+from weather_backends import LocalWeatherStore, WeatherBackend, get_weather_backend
+from precipitation import add_precipitation
+
+
+class FakeBackend(WeatherBackend):
+    # One row per month with precipitation equal to the month number
+    def precipitation(self, station, start, end, frequency="monthly"):
+        index = pd.date_range(start.replace(day=1), end, freq="MS", name="time")
+        return pd.DataFrame({"prcp": index.month.astype(float)}, index=index)
+
+
+class FakeResolver:
+    def candidates(self, country_abbrev, region_abbrev=""):
+        if country_abbrev == "US":
+            return (Station("72219", 33.6, -84.4),)
+        return ()
+
+
+class TestLocalWeatherStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = LocalWeatherStore(os.path.join(self.tmpdir.name, "weather.sqlite"))
+        self.station = Station("72219", 33.6, -84.4)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_warm_and_query(self):
+        self.store.warm(
+            FakeBackend(), [self.station], datetime(2020, 1, 1), datetime(2020, 12, 31)
+        )
+        data = self.store.precipitation(
+            self.station, datetime(2020, 3, 15), datetime(2020, 4, 2)
+        )
+        self.assertEqual(list(data["prcp"]), [3.0, 4.0])
+
+    def test_missing_month_is_empty(self):
+        data = self.store.precipitation(
+            self.station, datetime(2020, 3, 15), datetime(2020, 3, 15)
+        )
+        self.assertTrue(data.empty)
+        with self.assertRaises(IndexError):
+            data["prcp"][0]
+
+    def test_add_precipitation_offline(self):
+        self.store.warm(
+            FakeBackend(), [self.station], datetime(2020, 1, 1), datetime(2020, 6, 30)
+        )
+        df = pd.DataFrame(
+            [
+                ["SAMN1", "Agent", "2020-02-10", "US", "GA"],
+                ["SAMN2", "Agent", "2020-05-01", "US", "GA"],
+                ["SAMN3", "Agent", "2021-05-01", "US", "GA"],
+                ["SAMN4", "Agent", "2020-05-01", "DE", ""],
+            ],
+            columns=["Biosample", "Agent", "Date", "Country", "region"],
+        )
+        df = add_precipitation(df, FakeResolver(), weather_backend=self.store)
+        self.assertEqual(list(df["Biosample"]), ["SAMN1", "SAMN2"])
+        self.assertEqual(list(df["Precipitation"]), [2.0, 5.0])
+
+    def test_get_weather_backend(self):
+        path = os.path.join(self.tmpdir.name, "weather.sqlite")
+        backend = get_weather_backend("local", path)
+        self.assertIsInstance(backend, LocalWeatherStore)
+        backend.close()
+
+        # The local store only has monthly precipitation
+        with self.assertRaises(ValueError):
+            get_weather_backend("local", path, frequency="daily")
+        with self.assertRaises(ValueError):
+            get_weather_backend("other")
+
+    def test_interface(self):
+        with self.assertRaises(TypeError):
+            WeatherBackend()
+
+
+if __name__ == "__main__":
+    unittest.main()
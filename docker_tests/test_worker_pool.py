@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import threading
+import unittest
+import concurrent.futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bin"))
+
+from worker_pool import map_ordered
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_order(self):
+        # Later items finish first
+        def slow(i):
+            time.sleep((10 - i) * 0.005)
+            return i * i
+
+        results = map_ordered(self.executor, slow, range(10), 4)
+        self.assertEqual(list(results), [i * i for i in range(10)])
+
+    def test_exception(self):
+        calls = []
+
+        def fail(i):
+            calls.append(i)
+            if i == 3:
+                raise ValueError(i)
+            return i
+
+        results = map_ordered(self.executor, fail, range(100), 4)
+        with self.assertRaises(ValueError):
+            list(results)
+        # Items after the window of the failed one are never submitted
+        self.assertLess(max(calls), 10)
+
+    def test_bounded_window(self):
+        lock = threading.Lock()
+        consumed = 0
+
+        def items():
+            nonlocal consumed
+            for i in range(50):
+                with lock:
+                    consumed += 1
+                yield i
+
+        # Items are only pulled while fewer than 3 wait to be yielded
+        for yielded, result in enumerate(
+            map_ordered(self.executor, lambda i: i, items(), 3), start=1
+        ):
+            self.assertEqual(result, yielded - 1)
+            self.assertLessEqual(consumed - yielded, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()